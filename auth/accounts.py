@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import sys
+
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from requests import HTTPError
+
+from auth.microsoft import LoginRequired, MicrosoftAuth
+from auth.minecraft import MinecraftAuth
+from auth.realms import AsyncRealmsClient
+from auth.refresher import TokenRefresher
+from auth.xbox import XboxAuth
+
+
+# "main=12829680,123;alt=555" — аккаунт и его миры. Пусто — один аккаунт по умолчанию
+REALM_ACCOUNTS = os.getenv("REALM_ACCOUNTS", "")
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_auth_error(error: HTTPError) -> bool:
+    response = getattr(error, "response", None)
+    if response is None:
+        return False
+    return response.status_code in {401, 403}
+
+
+class Credentials(NamedTuple):
+    mc_token: str
+    uuid: str
+    name: str
+
+
+class Account:
+    """
+    One Microsoft account with its own auth chain and account-scoped tokens
+    """
+
+    def __init__(self, name: str = "", world_ids: Optional[List[int]] = None):
+        self.name = name
+        self.world_ids = list(world_ids or [])
+
+        self.ms = MicrosoftAuth(account=name)
+        self.xbox = XboxAuth(account=name)
+        self.mc = MinecraftAuth(account=name)
+        self.refresher = TokenRefresher(self.ms, self.xbox, self.mc)
+
+        self._profile: Optional[dict] = None
+        self._profile_token: Optional[str] = None
+
+    def authorize(self) -> Credentials:
+        """
+        Walks MS → XBL → XSTS → Minecraft; asks for a browser login only
+        when the refresh token is gone and stdin is a terminal
+        """
+        # Microsoft
+        try:
+            token = self.ms.get_access_token()
+        except LoginRequired:
+            # Без терминала input() в рабочем потоке ждал бы вечно
+            if sys.stdin is None or not sys.stdin.isatty():
+                raise
+            token = self.ms.login()
+
+        # Xbox
+        xbl_token, uhs = self.xbox.get_xbl_token(token)
+        try:
+            xsts_token, uhs = self.xbox.get_xsts_token(xbl_token)
+        except HTTPError as error:
+            if not _is_auth_error(error):
+                raise
+            xbl_token, uhs = self.xbox.authenticate(token)
+            xsts_token, uhs = self.xbox.authorize_xsts(xbl_token)
+
+        # Minecraft
+        try:
+            mc_token = self.mc.get_token(xsts_token, uhs)
+        except HTTPError as error:
+            if not _is_auth_error(error):
+                raise
+            xbl_token, uhs = self.xbox.authenticate(token)
+            xsts_token, uhs = self.xbox.authorize_xsts(xbl_token)
+            mc_token = self.mc.authenticate(xsts_token, uhs)
+
+        # Профиль не меняется, пока жив токен — не запрашиваем его каждый тик
+        if self._profile is None or self._profile_token != mc_token:
+            try:
+                profile = self.mc.get_profile(mc_token)
+            except HTTPError as error:
+                if not _is_auth_error(error):
+                    raise
+                mc_token = self.mc.authenticate(xsts_token, uhs)
+                profile = self.mc.get_profile(mc_token)
+
+            self._profile = profile
+            self._profile_token = mc_token
+            print(f"Logged in as: {profile['name']}" + (f" ({self.name})" if self.name else ""))
+
+        return Credentials(mc_token, self._profile["id"], self._profile["name"])
+
+    def dump(self) -> dict:
+        return {"profile": self._profile, "profile_token": self._profile_token}
+
+    def load(self, data: dict) -> None:
+        # Профиль годится, только пока жив токен, с которым его получили (см. authorize)
+        if data.get("profile") is not None and self._profile is None:
+            self._profile = data["profile"]
+            self._profile_token = data["profile_token"]
+
+
+class AccountManager:
+    """
+    Maps tracked realms to the accounts that own them and authorizes
+    accounts concurrently.
+    """
+
+    def __init__(self, accounts: List[Account]):
+        self.accounts = accounts
+        self._owners: Dict[int, Account] = {}
+        for account in accounts:
+            self.assign(account, account.world_ids)
+
+    @classmethod
+    def from_env(cls, default_world_ids: List[int], spec: str = REALM_ACCOUNTS) -> "AccountManager":
+        accounts = []
+        for entry in filter(None, (part.strip() for part in spec.split(";"))):
+            name, _, world_ids = entry.partition("=")
+            accounts.append(Account(name.strip(), [int(world_id) for world_id in world_ids.split(",") if world_id.strip()]))
+        return cls(accounts or [Account("", default_world_ids)])
+
+    def assign(self, account: Account, world_ids: Iterable[int]) -> None:
+        for world_id in world_ids:
+            self._owners[world_id] = account
+
+    def account_for(self, world_id: int) -> Account:
+        # Мир, которого нет в конфиге, считаем миром первого аккаунта
+        return self._owners.get(world_id, self.accounts[0])
+
+    def group(self, world_ids: Iterable[int]) -> Dict[Account, List[int]]:
+        groups: Dict[Account, List[int]] = {}
+        for world_id in world_ids:
+            groups.setdefault(self.account_for(world_id), []).append(world_id)
+        return groups
+
+    def dump(self) -> Dict[str, dict]:
+        return {
+            account.name: {
+                "world_ids": [world_id for world_id, owner in self._owners.items() if owner is account],
+                **account.dump(),
+            }
+            for account in self.accounts
+        }
+
+    def load(self, data: Dict[str, dict]) -> Optional[List[int]]:
+        """
+        Restores profiles and discovered worlds from `dump()`; worlds listed in
+        the config win over the saved ones. Returns every known world, or
+        None if some account still has to discover its worlds.
+        """
+        world_ids: Optional[List[int]] = []
+        for account in self.accounts:
+            saved = data.get(account.name, {})
+            account.load(saved)
+            # Сохранённые миры нужны только аккаунтам, чьи миры ищутся через /worlds
+            account_world_ids = account.world_ids or saved.get("world_ids", [])
+            if not account_world_ids:
+                world_ids = None
+                continue
+            self.assign(account, account_world_ids)
+            if world_ids is not None:
+                world_ids.extend(account_world_ids)
+        return world_ids
+
+    async def discover(self, realms: AsyncRealmsClient, credentials: Dict[Account, Credentials]) -> List[int]:
+        """
+        Worlds of the authorized accounts: configured ones, otherwise the ones they own (by /worlds)
+        """
+        world_ids = []
+        for account, account_credentials in credentials.items():
+            account_world_ids = account.world_ids
+            if not account_world_ids:
+                worlds = await realms.get_worlds(*account_credentials)
+                # Только свои миры: данные мира и бэкапы Realms отдаёт владельцу, приглашённым — нет
+                account_world_ids = [world["id"] for world in worlds["servers"] if world.get("ownerUUID") == account_credentials.uuid]
+            self.assign(account, account_world_ids)
+            world_ids.extend(account_world_ids)
+        return world_ids
+
+    async def authorize(self, accounts: Optional[Iterable[Account]] = None) -> Dict[Account, Credentials]:
+        """
+        Credentials of every account that authorized; failed accounts are logged and left out
+        """
+        accounts = list(accounts if accounts is not None else self.accounts)
+        results = await asyncio.gather(*(asyncio.to_thread(account.authorize) for account in accounts), return_exceptions=True)
+        credentials = {}
+        for account, result in zip(accounts, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to authorize account %r: %r", account.name or "default", result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                credentials[account] = result
+        return credentials
@@ -0,0 +1,56 @@
+import os
+
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT    = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+
+TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# Сколько keep-alive соединений держать к каждому хосту.
+# К Realms ходим чаще всего (по запросу на каждый мир), к auth-хостам — раз в сутки.
+POOL_SIZES = {
+    "https://pc.realms.minecraft.net": int(os.getenv("REALMS_POOL_SIZE", "10")),
+    "https://api.minecraftservices.com": 2,
+    "https://user.auth.xboxlive.com": 1,
+    "https://xsts.auth.xboxlive.com": 1,
+    "https://login.microsoftonline.com": 1,
+}
+DEFAULT_POOL_SIZE = 4
+
+
+_session: Optional[requests.Session] = None
+
+
+def create_session() -> requests.Session:
+    session = requests.Session()
+
+    default = HTTPAdapter(pool_connections=len(POOL_SIZES), pool_maxsize=DEFAULT_POOL_SIZE)
+    session.mount("https://", default)
+    session.mount("http://", default)
+
+    for prefix, size in POOL_SIZES.items():
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=size))
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Shared connection-pooled session for all Microsoft/Xbox/Minecraft calls
+    """
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -2,12 +2,23 @@ import time
 import os
 import base64
 import hashlib
-import requests
+from typing import Optional
 from urllib.parse import urlencode
 
+from requests import HTTPError, Session
+
+from auth.http_client import TIMEOUT, get_session
+from auth.resilience import resilience
+from auth.token_store import scoped_key, token_store
 from db import get_setting, set_setting
 
 
+class LoginRequired(RuntimeError):
+    """
+    There is no refresh token or Microsoft rejected it: only `login()` helps
+    """
+
+
 class MicrosoftAuth:
     CLIENT_ID = "c36a9fb6-4f2a-41ff-90bd-ae7cc92031eb"
     REDIRECT_URI = "http://localhost:3000"
@@ -21,6 +32,15 @@ class MicrosoftAuth:
     TOKEN_URL = "https://login.microsoftonline.com/consumers/oauth2/v2.0/token"
     AUTH_URL = "https://login.microsoftonline.com/consumers/oauth2/v2.0/authorize"
 
+    def __init__(self, session: Optional[Session] = None, account: str = ""):
+        self.session = session or get_session()
+        self.account = account
+
+        self.access_token_key = scoped_key(account, MicrosoftAuth.ACCESS_TOKEN_KEY)
+        self.refresh_token_key = scoped_key(account, MicrosoftAuth.REFRESH_TOKEN_KEY)
+        self.expires_key = scoped_key(account, MicrosoftAuth.EXPIRES_KEY)
+        self.pkce_verifier_key = scoped_key(account, MicrosoftAuth.PKCE_VERIFIER_KEY)
+
     # ---------- PKCE ----------
 
     @staticmethod
@@ -33,18 +53,12 @@ class MicrosoftAuth:
 
     # ---------- PUBLIC API ----------
 
-    def get_access_token(self) -> str:
-        token = get_setting(self.ACCESS_TOKEN_KEY)
-        expires = get_setting(self.EXPIRES_KEY)
-
-        if token and expires and time.time() < float(expires):
-            return token
-
-        return self._refresh_token()
+    def get_access_token(self, margin: float = 0) -> str:
+        return token_store.fetch(self.access_token_key, self.expires_key, self._refresh_token, margin=margin).token
 
     def login(self):
         verifier, challenge = self._gen_pkce()
-        set_setting(self.PKCE_VERIFIER_KEY, verifier)
+        set_setting(self.pkce_verifier_key, verifier)
 
         url = (
             f"{self.AUTH_URL}?"
@@ -58,6 +72,8 @@ class MicrosoftAuth:
             })
         )
 
+        if self.account:
+            print(f"Account: {self.account}")
         print("Open this URL in browser:")
         print(url)
 
@@ -70,11 +86,11 @@ class MicrosoftAuth:
     # ---------- INTERNAL ----------
 
     def _exchange_code(self, code: str) -> str:
-        verifier = get_setting(self.PKCE_VERIFIER_KEY)
+        verifier = get_setting(self.pkce_verifier_key)
         if not verifier:
             raise RuntimeError("PKCE verifier not found")
 
-        r = requests.post(
+        r = resilience.call("microsoft:token", lambda: self.session.post(
             self.TOKEN_URL,
             data={
                 "client_id": self.CLIENT_ID,
@@ -83,42 +99,48 @@ class MicrosoftAuth:
                 "redirect_uri": self.REDIRECT_URI,
                 "code_verifier": verifier,
             },
-            timeout=15,
-        )
-        r.raise_for_status()
+            timeout=TIMEOUT,
+        ), idempotent=False)
         data = r.json()
 
         return self._store_tokens(data)
 
     def _refresh_token(self) -> str:
-        refresh_token = get_setting(self.REFRESH_TOKEN_KEY)
+        refresh_token = get_setting(self.refresh_token_key)
         if not refresh_token:
-            raise RuntimeError("No refresh token — login required")
-
-        r = requests.post(
-            self.TOKEN_URL,
-            data={
-                "client_id": self.CLIENT_ID,
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-                "scope": self.SCOPES,
-            },
-            timeout=15,
-        )
-        r.raise_for_status()
+            raise LoginRequired("No refresh token — login required")
+
+        try:
+            r = resilience.call("microsoft:token", lambda: self.session.post(
+                self.TOKEN_URL,
+                data={
+                    "client_id": self.CLIENT_ID,
+                    "grant_type": "refresh_token",
+                    "refresh_token": refresh_token,
+                    "scope": self.SCOPES,
+                },
+                timeout=TIMEOUT,
+            ), idempotent=False)
+        except HTTPError as error:
+            # invalid_grant: refresh-токен отозван или истёк
+            if error.response is not None and error.response.status_code in {400, 401}:
+                raise LoginRequired("Refresh token rejected — login required") from error
+            raise
         data = r.json()
 
         return self._store_tokens(data)
 
     def _store_tokens(self, data: dict) -> str:
-        set_setting(self.ACCESS_TOKEN_KEY, data["access_token"])
-
+        extra = {}
         if "refresh_token" in data:
-            set_setting(self.REFRESH_TOKEN_KEY, data["refresh_token"])
-
-        set_setting(
-            self.EXPIRES_KEY,
-            str(int(time.time()) + int(data["expires_in"]) - 60)
+            extra[self.refresh_token_key] = data["refresh_token"]
+
+        token_store.put(
+            self.access_token_key,
+            self.expires_key,
+            data["access_token"],
+            int(time.time()) + int(data["expires_in"]) - 60,
+            extra=extra,
         )
 
         return data["access_token"]
@@ -1,8 +1,14 @@
 import time
 
-import requests
+from typing import Optional
 
-from db import get_setting, set_setting
+from requests import Session
+from requests.cookies import RequestsCookieJar, cookiejar_from_dict
+
+from auth.http_client import TIMEOUT, get_session
+from auth.resilience import resilience
+from auth.response_cache import response_cache
+from auth.token_store import scoped_key, token_store
 
 
 class MinecraftAuth:
@@ -14,42 +20,65 @@ class MinecraftAuth:
     MC_TOKEN_KEY = "mc_token"
     MC_EXPIRES_KEY = "mc_token_expires"
 
-    def _realm_cookies(self, mc_token: str, uuid: str, name: str) -> dict:
-        return {
-            "sid": f"token:{mc_token}:{uuid}",
-            "user": name,
-            "version": "1.20.4",
-        }
-
-    def get_token(self, xsts_token: str, user_hash: str) -> str:
-        token = get_setting(self.MC_TOKEN_KEY)
-        expires = get_setting(self.MC_EXPIRES_KEY)
-
-        if token and expires and time.time() < float(expires):
-            return token
-
-        return self.authenticate(xsts_token, user_hash)
+    def __init__(self, session: Optional[Session] = None, account: str = ""):
+        self.session = session or get_session()
+        self.account = account
+
+        self.mc_token_key = scoped_key(account, MinecraftAuth.MC_TOKEN_KEY)
+        self.mc_expires_key = scoped_key(account, MinecraftAuth.MC_EXPIRES_KEY)
+
+        self._cookies: Optional[RequestsCookieJar] = None
+        self._cookies_for: Optional[tuple] = None
+
+    def _realm_cookies(self, mc_token: str, uuid: str, name: str) -> RequestsCookieJar:
+        # Cookie jar собираем один раз на токен, а не на каждый запрос
+        if self._cookies is None or self._cookies_for != (mc_token, uuid, name):
+            self._cookies = cookiejar_from_dict({
+                "sid": f"token:{mc_token}:{uuid}",
+                "user": name,
+                "version": "1.20.4",
+            })
+            self._cookies_for = (mc_token, uuid, name)
+        return self._cookies
+
+    def _realms_get(self, endpoint: str, path: str, mc_token: str, uuid: str, name: str) -> dict:
+        cached = response_cache.lookup(uuid, path)
+        if cached is not None and cached.is_fresh(time.time()):
+            return cached.data
+
+        r = resilience.call(f"realms:{endpoint}", lambda: self.session.get(
+            f"{self.REALMS_BASE}{path}",
+            cookies=self._realm_cookies(mc_token, uuid, name),
+            headers=cached.validators() if cached else None,
+            timeout=TIMEOUT,
+        ), breaker_key=f"realms:{path}")
+        return response_cache.store(uuid, path, endpoint, r, cached)
+
+    def get_token(self, xsts_token: str, user_hash: str, margin: float = 0) -> str:
+        return token_store.fetch(
+            self.mc_token_key,
+            self.mc_expires_key,
+            lambda: self.authenticate(xsts_token, user_hash),
+            margin=margin,
+        ).token
 
     def authenticate(self, xsts_token: str, user_hash: str) -> str:
         """
         Step 3:
         XSTS token → Minecraft access token
         """
-        r = requests.post(
+        r = resilience.call("minecraft:login_with_xbox", lambda: self.session.post(
             self.MC_AUTH_URL,
             json={
                 "identityToken": f"XBL3.0 x={user_hash};{xsts_token}"
             },
-            timeout=15,
-        )
-
-        r.raise_for_status()
+            timeout=TIMEOUT,
+        ), idempotent=False)
         data = r.json()
 
         token = data["access_token"]
-        set_setting(self.MC_TOKEN_KEY, token)
         expires_in = int(data.get("expires_in", 23 * 3600))
-        set_setting(self.MC_EXPIRES_KEY, str(int(time.time()) + expires_in - 60))
+        token_store.put(self.mc_token_key, self.mc_expires_key, token, int(time.time()) + expires_in - 60)
 
         return token
 
@@ -57,26 +86,19 @@ class MinecraftAuth:
         """
         Check if Realms service is available for user
         """
-        r = requests.get(
-            f"{self.REALMS_BASE}/mco/available",
-            cookies=self._realm_cookies(mc_token, uuid, name),
-            timeout=15,
-        )
-        return r.json()
+        return self._realms_get("/mco/available", "/mco/available", mc_token, uuid, name)
 
     def get_profile(self, mc_token: str) -> dict:
         """
         Get Minecraft profile info
         """
-        r = requests.get(
+        r = resilience.call("minecraft:profile", lambda: self.session.get(
             self.PROFILE_URL,
             headers={
                 "Authorization": f"Bearer {mc_token}"
             },
-            timeout=15,
-        )
-
-        r.raise_for_status()
+            timeout=TIMEOUT,
+        ))
         return r.json()
 
 
@@ -84,65 +106,32 @@ class MinecraftAuth:
         """
         Get list of all Realms worlds
         """
-        r = requests.get(
-            f"{self.REALMS_BASE}/worlds",
-            cookies=self._realm_cookies(mc_token, uuid, name),
-            timeout=15,
-        )
-        return r.json()
+        return self._realms_get("/worlds", "/worlds", mc_token, uuid, name)
 
 
     def get_world_info(self, mc_token: str, uuid: str, name: str, world_id: int) -> dict:
         """
         Get info about a specific Realm world
         """
-        r = requests.get(
-            f"{self.REALMS_BASE}/worlds/{world_id}",
-            cookies=self._realm_cookies(mc_token, uuid, name),
-            timeout=15,
-        )
-
-        r.raise_for_status()
-        return r.json()
+        return self._realms_get("/worlds/{id}", f"/worlds/{world_id}", mc_token, uuid, name)
 
 
     def get_world_backups(self, mc_token: str, uuid: str, name: str, world_id: int) -> dict:
         """
         Get info about a specific Realm world
         """
-        r = requests.get(
-            f"{self.REALMS_BASE}/worlds/{world_id}/backups",
-            cookies=self._realm_cookies(mc_token, uuid, name),
-            timeout=15,
-        )
-
-        r.raise_for_status()
-        return r.json()
+        return self._realms_get("/worlds/{id}/backups", f"/worlds/{world_id}/backups", mc_token, uuid, name)
 
 
     def get_world_last_backup(self, mc_token: str, uuid: str, name: str, world_id: int, slot: int) -> dict:
         """
         Get info about a specific Realm world
         """
-        r = requests.get(
-            f"{self.REALMS_BASE}/worlds/{world_id}/slot/{slot}/download",
-            cookies=self._realm_cookies(mc_token, uuid, name),
-            timeout=15,
-        )
-
-        r.raise_for_status()
-        return r.json()
+        return self._realms_get("/worlds/{id}/slot/{slot}/download", f"/worlds/{world_id}/slot/{slot}/download", mc_token, uuid, name)
 
 
     def get_realm_ip(self, mc_token: str, uuid: str, name: str, world_id: int) -> dict:
         """
         Get info about a specific Realm world
         """
-        r = requests.get(
-            f"{self.REALMS_BASE}/worlds/v1/{world_id}/join/pc",
-            cookies=self._realm_cookies(mc_token, uuid, name),
-            timeout=15,
-        )
-
-        r.raise_for_status()
-        return r.json()
+        return self._realms_get("/worlds/v1/{id}/join/pc", f"/worlds/v1/{world_id}/join/pc", mc_token, uuid, name)
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+
+from typing import Dict, Iterable, Optional, Union
+
+import httpx
+
+from auth.http_client import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, POOL_SIZES
+from auth.minecraft import MinecraftAuth
+from auth.resilience import resilience
+from auth.response_cache import CachedResponse, response_cache
+
+
+REALMS_CONCURRENCY = int(os.getenv("REALMS_CONCURRENCY", "8"))
+
+
+class AsyncRealmsClient:
+    """
+    asyncio counterpart of the Realms part of `MinecraftAuth`.
+
+    Tokens are still obtained with `MinecraftAuth`; this client only talks to
+    pc.realms.minecraft.net and can poll many worlds concurrently.
+    """
+
+    REALMS_BASE = MinecraftAuth.REALMS_BASE
+
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, concurrency: int = REALMS_CONCURRENCY):
+        self.client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZES[self.REALMS_BASE]),
+        )
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._cookie_headers: Dict[tuple, str] = {}
+
+    def _realm_cookies(self, mc_token: str, uuid: str, name: str) -> str:
+        # Заголовок Cookie собираем один раз на токен (токенов столько, сколько аккаунтов)
+        key = (mc_token, uuid, name)
+        if key not in self._cookie_headers:
+            self._cookie_headers = {k: v for k, v in self._cookie_headers.items() if k[1] != uuid}
+            self._cookie_headers[key] = f"sid=token:{mc_token}:{uuid}; user={name}; version=1.20.4"
+        return self._cookie_headers[key]
+
+    async def _send(self, path: str, mc_token: str, uuid: str, name: str,
+                    cached: Optional[CachedResponse]) -> httpx.Response:
+        headers = {"Cookie": self._realm_cookies(mc_token, uuid, name)}
+        if cached is not None:
+            headers.update(cached.validators())
+        # Семафор держим только на время запроса, а не на паузы между повторами
+        async with self._semaphore:
+            return await self.client.get(f"{self.REALMS_BASE}{path}", headers=headers)
+
+    async def _get(self, endpoint: str, path: str, mc_token: str, uuid: str, name: str) -> dict:
+        # Кэш и breaker'ы общие с MinecraftAuth: endpoint и путь одинаковы в обоих клиентах.
+        # Breaker — на путь, то есть на мир: сбоящий мир не закрывает опрос остальных
+        cached = response_cache.lookup(uuid, path)
+        if cached is not None and cached.is_fresh(time.time()):
+            return cached.data
+
+        r = await resilience.acall(f"realms:{endpoint}", lambda: self._send(path, mc_token, uuid, name, cached),
+                                   breaker_key=f"realms:{path}")
+        return response_cache.store(uuid, path, endpoint, r, cached)
+
+    def invalidate(self, uuid: Optional[str] = None, path: Optional[str] = None) -> int:
+        """
+        Forgets cached responses, e.g. `/worlds` after a realm was added or removed
+        """
+        return response_cache.invalidate(uuid, path)
+
+    # ---------- ENDPOINTS ----------
+
+    async def get_worlds(self, mc_token: str, uuid: str, name: str) -> dict:
+        return await self._get("/worlds", "/worlds", mc_token, uuid, name)
+
+    async def get_world_info(self, mc_token: str, uuid: str, name: str, world_id: int) -> dict:
+        return await self._get("/worlds/{id}", f"/worlds/{world_id}", mc_token, uuid, name)
+
+    async def get_world_backups(self, mc_token: str, uuid: str, name: str, world_id: int) -> dict:
+        return await self._get("/worlds/{id}/backups", f"/worlds/{world_id}/backups", mc_token, uuid, name)
+
+    async def get_world_last_backup(self, mc_token: str, uuid: str, name: str, world_id: int, slot: int) -> dict:
+        return await self._get("/worlds/{id}/slot/{slot}/download", f"/worlds/{world_id}/slot/{slot}/download", mc_token, uuid, name)
+
+    async def get_realm_ip(self, mc_token: str, uuid: str, name: str, world_id: int) -> dict:
+        return await self._get("/worlds/v1/{id}/join/pc", f"/worlds/v1/{world_id}/join/pc", mc_token, uuid, name)
+
+    # ---------- FAN-OUT ----------
+
+    async def get_worlds_info(self, mc_token: str, uuid: str, name: str,
+                              world_ids: Iterable[int]) -> Dict[int, Union[dict, Exception]]:
+        """
+        Fetches `/worlds/{id}` for every world at once (at most `concurrency`
+        requests in flight). A failed world maps to its exception.
+        """
+        world_ids = list(world_ids)
+        results = await asyncio.gather(
+            *(self.get_world_info(mc_token, uuid, name, world_id) for world_id in world_ids),
+            return_exceptions=True,
+        )
+        return dict(zip(world_ids, results))
+
+    async def close(self) -> None:
+        await self.client.aclose()
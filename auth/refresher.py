@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+import time
+
+from auth.microsoft import MicrosoftAuth
+from auth.minecraft import MinecraftAuth
+from auth.token_store import token_store
+from auth.xbox import XboxAuth
+
+
+# За сколько секунд до истечения обновляем токен
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "600"))
+TOKEN_REFRESH_RETRY  = float(os.getenv("TOKEN_REFRESH_RETRY", "60"))
+TOKEN_REFRESH_MAX_SLEEP = 3600
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    """
+    Renews MS → XBL → XSTS → Minecraft tokens in the background
+    `margin` seconds before they expire, so poll ticks always find valid
+    tokens in the token store and never wait on auth calls.
+    """
+
+    def __init__(self, ms: MicrosoftAuth, xbox: XboxAuth, mc: MinecraftAuth, margin: float = TOKEN_REFRESH_MARGIN):
+        self.ms = ms
+        self.xbox = xbox
+        self.mc = mc
+        self.margin = margin
+
+    def _layers(self):
+        return [
+            (self.ms.access_token_key, self.ms.expires_key, None),
+            (self.xbox.xbl_token_key, self.xbox.xbl_expires_key, self.xbox.xbl_uhs_key),
+            (self.xbox.xsts_token_key, self.xbox.xsts_expires_key, self.xbox.xsts_uhs_key),
+            (self.mc.mc_token_key, self.mc.mc_expires_key, None),
+        ]
+
+    def refresh_due(self) -> float:
+        """
+        Renews every layer that expires within `margin`.
+        Returns seconds until the next layer needs renewing.
+        """
+        token = self.ms.get_access_token(self.margin)
+        xbl_token, _ = self.xbox.get_xbl_token(token, self.margin)
+        xsts_token, uhs = self.xbox.get_xsts_token(xbl_token, self.margin)
+        self.mc.get_token(xsts_token, uhs, self.margin)
+
+        expires = [
+            cached.expires
+            for cached in (token_store.get(*layer) for layer in self._layers())
+            if cached is not None
+        ]
+        return min(expires, default=time.time()) - self.margin - time.time()
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            try:
+                delay = await asyncio.to_thread(self.refresh_due)
+            except Exception:
+                logger.exception("Background token refresh failed")
+                delay = TOKEN_REFRESH_RETRY
+
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=min(max(delay, TOKEN_REFRESH_RETRY), TOKEN_REFRESH_MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
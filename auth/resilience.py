@@ -0,0 +1,214 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import requests
+
+from metrics import HTTP_REQUEST_SECONDS
+
+
+HTTP_RETRIES       = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF_BASE  = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX   = float(os.getenv("HTTP_BACKOFF_MAX", "10"))
+# Retry-After длиннее этого не ждём внутри вызова — отдаём ошибку и открываем breaker
+HTTP_RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", "30"))
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+
+
+Response = TypeVar("Response", requests.Response, httpx.Response)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint: str, retry_at: float):
+        super().__init__(f"circuit for {endpoint} is open for {max(retry_at - time.time(), 0):.0f}s")
+        self.endpoint = endpoint
+        self.retry_at = retry_at
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    `Retry-After` (seconds or HTTP-date) → absolute unix time
+    """
+    if not value:
+        return None
+    now = now if now is not None else time.time()
+    try:
+        return now + max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls (or on a Retry-After the
+    caller could not wait out) and rejects calls until the cooldown passes;
+    then lets a single probe call through. A call counts once, however
+    many attempts it took.
+    """
+
+    def __init__(self, endpoint: str, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.endpoint = endpoint
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if not self.open_until:
+                return
+            now = time.time()
+            if now < self.open_until or self._probing:
+                raise CircuitOpenError(self.endpoint, max(self.open_until, now + 1))
+            self._probing = True
+
+    def release(self) -> None:
+        # Пробный вызов прервался, не дойдя до хоста — следующий вызов снова станет пробным
+        with self._lock:
+            self._probing = False
+
+    def success(self) -> None:
+        with self._lock:
+            self.consecutive = 0
+            self.open_until = 0.0
+            self._probing = False
+
+    def failure(self, retry_at: Optional[float] = None) -> None:
+        with self._lock:
+            self.consecutive += 1
+            self._probing = False
+            now = time.time()
+            if self.consecutive >= self.failures:
+                self.open_until = max(self.open_until, now + self.cooldown)
+            if retry_at and retry_at > now:
+                self.open_until = max(self.open_until, retry_at)
+
+
+class Resilience:
+    """
+    Retry policy plus one circuit breaker per endpoint (or per `breaker_key`,
+    e.g. per world), shared by the sync (requests) and async (httpx) API
+    clients. `endpoint` also labels the latency metric, so it stays a template.
+
+    Idempotent calls are retried with full-jitter exponential backoff on
+    transport errors and RETRY_STATUSES, honouring `Retry-After`. Other calls
+    are retried only on 429, which means the request was not processed.
+    Non-retryable error statuses are raised with `raise_for_status()`.
+    """
+
+    def __init__(self, retries: int = HTTP_RETRIES, backoff_base: float = HTTP_BACKOFF_BASE,
+                 backoff_max: float = HTTP_BACKOFF_MAX, retry_after_max: float = HTTP_RETRY_AFTER_MAX):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(key)
+            return self._breakers[key]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _on_error(self, breaker: CircuitBreaker, error: Exception, attempt: int, idempotent: bool) -> float:
+        if not idempotent or attempt >= self.retries:
+            breaker.failure()
+            raise error
+        return self._backoff(attempt)
+
+    def _on_response(self, breaker: CircuitBreaker, response: Response, attempt: int, idempotent: bool) -> Optional[float]:
+        """
+        Returns the delay before the next attempt, or None when `response` is final
+        """
+        if response.status_code not in RETRY_STATUSES:
+            # 4xx — проблема запроса, а не хоста
+            breaker.success()
+            # 304 — ответ на условный запрос (httpx считает его ошибкой)
+            if response.status_code != 304:
+                response.raise_for_status()
+            return None
+
+        retry_at = parse_retry_after(response.headers.get("Retry-After"))
+        delay = self._backoff(attempt)
+        if retry_at is not None:
+            delay = max(delay, retry_at - time.time())
+        retryable = idempotent or response.status_code == 429
+        if not retryable or attempt >= self.retries or delay > self.retry_after_max:
+            # Breaker узнаёт об исходе вызова, а не о каждой попытке
+            breaker.failure(retry_at)
+            response.raise_for_status()
+        return delay
+
+    def call(self, endpoint: str, send: Callable[[], requests.Response], idempotent: bool = True,
+             breaker_key: Optional[str] = None) -> requests.Response:
+        breaker = self.breaker(breaker_key or endpoint)
+        # Повторы — часть того же вызова, в том числе пробного
+        breaker.before_call()
+        attempt = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    response = send()
+                except TRANSPORT_ERRORS as error:
+                    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status="error")
+                    delay = self._on_error(breaker, error, attempt, idempotent)
+                else:
+                    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=str(response.status_code))
+                    delay = self._on_response(breaker, response, attempt, idempotent)
+                    if delay is None:
+                        return response
+                time.sleep(delay)
+                attempt += 1
+        except BaseException:
+            # Исход уже записан либо вызов прервался, не дойдя до хоста — пробу отпускаем
+            breaker.release()
+            raise
+
+    async def acall(self, endpoint: str, send: Callable[[], Awaitable[httpx.Response]],
+                    idempotent: bool = True, breaker_key: Optional[str] = None) -> httpx.Response:
+        breaker = self.breaker(breaker_key or endpoint)
+        breaker.before_call()
+        attempt = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    response = await send()
+                except TRANSPORT_ERRORS as error:
+                    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status="error")
+                    delay = self._on_error(breaker, error, attempt, idempotent)
+                else:
+                    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=str(response.status_code))
+                    delay = self._on_response(breaker, response, attempt, idempotent)
+                    if delay is None:
+                        return response
+                await asyncio.sleep(delay)
+                attempt += 1
+        except BaseException:
+            breaker.release()
+            raise
+
+
+resilience = Resilience()
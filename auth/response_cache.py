@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, Union
+
+import httpx
+import requests
+
+
+# Секунды; 0 — не кэшировать. Список миров и адреса меняются редко, список игроков — постоянно
+REALMS_CACHE_TTLS = {
+    "/worlds": float(os.getenv("REALMS_WORLDS_TTL", "3600")),
+    "/worlds/v1/{id}/join/pc": float(os.getenv("REALMS_ADDRESS_TTL", "3600")),
+    "/worlds/{id}": float(os.getenv("REALMS_WORLD_INFO_TTL", "5")),
+}
+
+NOT_MODIFIED = 304
+
+
+@dataclass
+class CachedResponse:
+    data: dict
+    expires: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def is_fresh(self, now: float) -> bool:
+        return now < self.expires
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Parsed Realms responses keyed by (account uuid, path) with per-endpoint TTLs.
+
+    An expired entry is revalidated with If-None-Match / If-Modified-Since
+    when the server sent validators; a 304 just extends it. Cached data is
+    shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None):
+        self.ttls = dict(REALMS_CACHE_TTLS if ttls is None else ttls)
+        self._entries: Dict[Tuple[str, str], CachedResponse] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, uuid: str, path: str) -> Optional[CachedResponse]:
+        with self._lock:
+            return self._entries.get((uuid, path))
+
+    def store(self, uuid: str, path: str, endpoint: str,
+              response: Union[requests.Response, httpx.Response], cached: Optional[CachedResponse]) -> dict:
+        """
+        Returns the data for `response` (the cached data on 304) and caches it
+        for the endpoint's TTL. `cached` is the entry the request was validated against.
+        """
+        ttl = self.ttls.get(endpoint, 0)
+        if response.status_code == NOT_MODIFIED and cached is not None:
+            data = cached.data
+        else:
+            data = response.json()
+        if ttl <= 0:
+            return data
+
+        entry = CachedResponse(
+            data,
+            time.time() + ttl,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        if response.status_code == NOT_MODIFIED and cached is not None:
+            # 304 может не повторять валидаторы
+            entry.etag = entry.etag or cached.etag
+            entry.last_modified = entry.last_modified or cached.last_modified
+        with self._lock:
+            self._entries[(uuid, path)] = entry
+        return data
+
+    def invalidate(self, uuid: Optional[str] = None, path: Optional[str] = None) -> int:
+        """
+        Drops entries of `uuid` and/or `path` (everything by default).
+        Returns the number of dropped entries.
+        """
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (uuid is None or key[0] == uuid) and (path is None or key[1] == path)
+            ]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+
+response_cache = ResponseCache()
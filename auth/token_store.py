@@ -0,0 +1,118 @@
+import threading
+import time
+
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Optional
+
+from db import get_settings, set_settings
+from metrics import TOKEN_REFRESHES
+
+
+def scoped_key(account: str, key: str) -> str:
+    # У аккаунта по умолчанию ключи прежние — уже сохранённые токены остаются рабочими
+    return f"{account}:{key}" if account else key
+
+
+@dataclass
+class CachedToken:
+    token: str
+    expires: float
+    user_hash: Optional[str] = None
+
+    def is_valid(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) < self.expires
+
+
+class TokenStore:
+    """
+    In-memory cache in front of the `settings` table for auth tokens.
+
+    Token, user hash and expiry are kept together under the token key.
+    MySQL is read only on a miss and written only when a token is stored.
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, CachedToken] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, token_key: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(token_key, threading.Lock())
+
+    def get(self, token_key: str, expires_key: str, uhs_key: Optional[str] = None) -> Optional[CachedToken]:
+        cached = self._tokens.get(token_key)
+        if cached is not None:
+            return cached
+
+        keys = [token_key, expires_key] + ([uhs_key] if uhs_key else [])
+        values = get_settings(keys)
+        token = values.get(token_key)
+        expires = values.get(expires_key)
+        uhs = values.get(uhs_key) if uhs_key else None
+        if not token or not expires or (uhs_key and not uhs):
+            return None
+
+        cached = CachedToken(token=token, expires=float(expires), user_hash=uhs)
+        self._tokens[token_key] = cached
+        return cached
+
+    def put(self, token_key: str, expires_key: str, token: str, expires: int,
+            uhs_key: Optional[str] = None, user_hash: Optional[str] = None,
+            extra: Optional[Dict[str, str]] = None) -> CachedToken:
+        # `extra` — другие настройки, которые надо записать в той же транзакции
+        values = dict(extra or {})
+        values.update({token_key: token, expires_key: str(expires)})
+        if uhs_key:
+            values[uhs_key] = user_hash
+        set_settings(values)
+
+        cached = CachedToken(token=token, expires=float(expires), user_hash=user_hash)
+        self._tokens[token_key] = cached
+        return cached
+
+    def fetch(self, token_key: str, expires_key: str, refresh: Callable[[], object],
+              uhs_key: Optional[str] = None, margin: float = 0) -> CachedToken:
+        """
+        Returns a token valid for at least `margin` more seconds, calling `refresh`
+        (which must `put` the new token) otherwise. Concurrent callers share one refresh.
+        """
+        cached = self.get(token_key, expires_key, uhs_key)
+        if cached and cached.is_valid(time.time() + margin):
+            return cached
+
+        with self._lock_for(token_key):
+            # Пока ждали блокировку, токен мог обновить другой поток
+            cached = self.get(token_key, expires_key, uhs_key)
+            if cached and cached.is_valid(time.time() + margin):
+                return cached
+
+            account, _, layer = token_key.rpartition(":")
+            try:
+                refresh()
+            except Exception:
+                TOKEN_REFRESHES.inc(account=account, layer=layer, result="error")
+                raise
+            TOKEN_REFRESHES.inc(account=account, layer=layer, result="ok")
+            return self._tokens[token_key]
+
+    def invalidate(self, token_key: str) -> None:
+        self._tokens.pop(token_key, None)
+
+    def dump(self) -> Dict[str, dict]:
+        # Только access-токены: refresh-токены живут лишь в settings
+        now = time.time()
+        return {key: asdict(cached) for key, cached in self._tokens.items() if cached.is_valid(now)}
+
+    def load(self, tokens: Dict[str, dict]) -> None:
+        """
+        Warms the cache from `dump()`; expired tokens and keys already cached are skipped
+        """
+        now = time.time()
+        for key, data in tokens.items():
+            cached = CachedToken(**data)
+            if key not in self._tokens and cached.is_valid(now):
+                self._tokens[key] = cached
+
+
+token_store = TokenStore()
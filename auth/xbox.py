@@ -1,9 +1,12 @@
 import time
 from datetime import datetime, timezone
+from typing import Optional
 
-import requests
+from requests import Session
 
-from db import get_setting, set_setting
+from auth.http_client import TIMEOUT, get_session
+from auth.resilience import resilience
+from auth.token_store import scoped_key, token_store
 
 
 class XboxAuth:
@@ -18,6 +21,18 @@ class XboxAuth:
     XSTS_EXPIRES_KEY = "xsts_token_expires"
     XSTS_UHS_KEY = "xsts_user_hash"
 
+    def __init__(self, session: Optional[Session] = None, account: str = ""):
+        self.session = session or get_session()
+        self.account = account
+
+        self.xbl_token_key = scoped_key(account, XboxAuth.XBL_TOKEN_KEY)
+        self.xbl_expires_key = scoped_key(account, XboxAuth.XBL_EXPIRES_KEY)
+        self.xbl_uhs_key = scoped_key(account, XboxAuth.XBL_UHS_KEY)
+
+        self.xsts_token_key = scoped_key(account, XboxAuth.XSTS_TOKEN_KEY)
+        self.xsts_expires_key = scoped_key(account, XboxAuth.XSTS_EXPIRES_KEY)
+        self.xsts_uhs_key = scoped_key(account, XboxAuth.XSTS_UHS_KEY)
+
     @staticmethod
     def _parse_not_after(data: dict, fallback_seconds: int = 23 * 3600) -> int:
         not_after = data.get("NotAfter")
@@ -32,28 +47,38 @@ class XboxAuth:
     def _store_xbl(self, data: dict) -> tuple[str, str]:
         token = data["Token"]
         uhs = data["DisplayClaims"]["xui"][0]["uhs"]
-        set_setting(self.XBL_TOKEN_KEY, token)
-        set_setting(self.XBL_UHS_KEY, uhs)
-        set_setting(self.XBL_EXPIRES_KEY, str(self._parse_not_after(data)))
+        token_store.put(
+            self.xbl_token_key,
+            self.xbl_expires_key,
+            token,
+            self._parse_not_after(data),
+            self.xbl_uhs_key,
+            uhs,
+        )
         return token, uhs
 
     def _store_xsts(self, data: dict) -> tuple[str, str]:
         token = data["Token"]
         uhs = data["DisplayClaims"]["xui"][0]["uhs"]
-        set_setting(self.XSTS_TOKEN_KEY, token)
-        set_setting(self.XSTS_UHS_KEY, uhs)
-        set_setting(self.XSTS_EXPIRES_KEY, str(self._parse_not_after(data)))
+        token_store.put(
+            self.xsts_token_key,
+            self.xsts_expires_key,
+            token,
+            self._parse_not_after(data),
+            self.xsts_uhs_key,
+            uhs,
+        )
         return token, uhs
 
-    def get_xbl_token(self, ms_access_token: str) -> tuple[str, str]:
-        token = get_setting(self.XBL_TOKEN_KEY)
-        uhs = get_setting(self.XBL_UHS_KEY)
-        expires = get_setting(self.XBL_EXPIRES_KEY)
-
-        if token and uhs and expires and time.time() < float(expires):
-            return token, uhs
-
-        return self.authenticate(ms_access_token)
+    def get_xbl_token(self, ms_access_token: str, margin: float = 0) -> tuple[str, str]:
+        cached = token_store.fetch(
+            self.xbl_token_key,
+            self.xbl_expires_key,
+            lambda: self.authenticate(ms_access_token),
+            self.xbl_uhs_key,
+            margin,
+        )
+        return cached.token, cached.user_hash
 
     def authenticate(self, ms_access_token: str) -> tuple[str, str]:
         """
@@ -62,7 +87,7 @@ class XboxAuth:
         Returns:
             (xbl_token, user_hash)
         """
-        r = requests.post(
+        r = resilience.call("xbox:user.authenticate", lambda: self.session.post(
             self.XBL_AUTH_URL,
             json={
                 "Properties": {
@@ -73,23 +98,21 @@ class XboxAuth:
                 "RelyingParty": "http://auth.xboxlive.com",
                 "TokenType": "JWT",
             },
-            timeout=15,
-        )
-
-        r.raise_for_status()
+            timeout=TIMEOUT,
+        ), idempotent=False)
         data = r.json()
 
         return self._store_xbl(data)
 
-    def get_xsts_token(self, xbl_token: str) -> tuple[str, str]:
-        token = get_setting(self.XSTS_TOKEN_KEY)
-        uhs = get_setting(self.XSTS_UHS_KEY)
-        expires = get_setting(self.XSTS_EXPIRES_KEY)
-
-        if token and uhs and expires and time.time() < float(expires):
-            return token, uhs
-
-        return self.authorize_xsts(xbl_token)
+    def get_xsts_token(self, xbl_token: str, margin: float = 0) -> tuple[str, str]:
+        cached = token_store.fetch(
+            self.xsts_token_key,
+            self.xsts_expires_key,
+            lambda: self.authorize_xsts(xbl_token),
+            self.xsts_uhs_key,
+            margin,
+        )
+        return cached.token, cached.user_hash
 
     def authorize_xsts(self, xbl_token: str) -> tuple[str, str]:
         """
@@ -98,7 +121,7 @@ class XboxAuth:
         Returns:
             (xsts_token, user_hash)
         """
-        r = requests.post(
+        r = resilience.call("xbox:xsts.authorize", lambda: self.session.post(
             self.XSTS_AUTH_URL,
             json={
                 "Properties": {
@@ -108,10 +131,8 @@ class XboxAuth:
                 "RelyingParty": "rp://api.minecraftservices.com/",
                 "TokenType": "JWT",
             },
-            timeout=15,
-        )
-
-        r.raise_for_status()
+            timeout=TIMEOUT,
+        ), idempotent=False)
         data = r.json()
 
         return self._store_xsts(data)
@@ -0,0 +1,116 @@
+import asyncio
+
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select
+
+from auth.realms import AsyncRealmsClient
+from db import Backup, SessionLocal, get_settings, set_setting, set_settings, upsert
+
+
+# Ссылка на последний бэкап мира хранится под f"{LAST_BACKUP_URL}_{world_id}";
+# без суффикса — ключ старых версий, когда мир был один
+LAST_BACKUP_URL = "last_backup_url"
+
+
+def backup_url_key(world_id: int) -> str:
+    return f"{LAST_BACKUP_URL}_{world_id}"
+
+
+def migrate_backup_url(world_ids: List[int]) -> None:
+    """
+    Moves the legacy single-world `LAST_BACKUP_URL` setting to the per-world key.
+    With several worlds it can't be attributed and is left alone.
+    """
+    if len(world_ids) != 1:
+        return
+    key = backup_url_key(world_ids[0])
+    stored = get_settings([LAST_BACKUP_URL, key])
+    if LAST_BACKUP_URL in stored:
+        set_settings({key: stored.get(key, stored[LAST_BACKUP_URL]), LAST_BACKUP_URL: None})
+
+
+def _backup_row(world_id: int, slot: int, backup: dict) -> dict:
+    return {
+        "world_id": world_id,
+        "backup_id": backup["backupId"],
+        "slot": slot,
+        "created_at": int(backup["lastModifiedDate"]) // 1000,
+        "size": int(backup.get("size", 0)),
+        "download_url": None,
+    }
+
+
+def _load_ids(world_id: int) -> Set[str]:
+    with SessionLocal() as session:
+        return set(session.scalars(select(Backup.backup_id).where(Backup.world_id == world_id)))
+
+
+def _save(rows: List[dict], url_key: str, download_url: str) -> None:
+    with SessionLocal() as session:
+        upsert(session, Backup, rows, "slot", "created_at", "size", "download_url")
+        session.commit()
+    # Настройки могут жить не в БД (SETTINGS_BACKEND), поэтому отдельной записью
+    set_setting(url_key, download_url)
+
+
+class BackupCatalog:
+    """
+    Realm backups we have already seen, per world and slot.
+
+    Each tick costs one `/backups` listing; a signed download link is
+    requested only when a backup we don't know about shows up.
+    """
+
+    def __init__(self):
+        self._known: Dict[int, Set[str]] = {}
+
+    async def _known_ids(self, world_id: int) -> Set[str]:
+        if world_id not in self._known:
+            known = await asyncio.to_thread(_load_ids, world_id)
+            # Пока шёл запрос, load() мог уже заполнить набор — объединяем
+            self._known.setdefault(world_id, set()).update(known)
+        return self._known[world_id]
+
+    async def refresh(self, realms: AsyncRealmsClient, mc_token: str, uuid: str, name: str,
+                      world_id: int, slot: int) -> Optional[dict]:
+        """
+        Records new backups of the world's active `slot`.
+        Returns the newest new backup (with its download link) or None if nothing changed.
+        """
+        listing = await realms.get_world_backups(mc_token, uuid, name, world_id)
+        known = await self._known_ids(world_id)
+        new = [backup for backup in listing.get("backups", []) if backup["backupId"] not in known]
+        if not new:
+            return None
+
+        rows = [_backup_row(world_id, slot, backup) for backup in new]
+        newest = max(rows, key=lambda row: row["created_at"])
+        last_backup = await realms.get_world_last_backup(mc_token, uuid, name, world_id, slot)
+        newest["download_url"] = last_backup["downloadLink"]
+
+        await asyncio.to_thread(_save, rows, backup_url_key(world_id), newest["download_url"])
+        known.update(row["backup_id"] for row in rows)
+        return newest
+
+    def dump(self) -> Dict[str, List[str]]:
+        return {str(world_id): sorted(known) for world_id, known in self._known.items()}
+
+    def load(self, known: Dict[str, List[str]]) -> None:
+        """
+        Restores known backup ids from `dump()`. A backup recorded after the
+        dump is recorded again on the next refresh (the upsert is idempotent).
+        """
+        for world_id, backup_ids in known.items():
+            self._known.setdefault(int(world_id), set()).update(backup_ids)
+
+    def latest(self, world_id: int, slot: Optional[int] = None, limit: int = 1) -> List[dict]:
+        with SessionLocal() as session:
+            query = select(Backup).where(Backup.world_id == world_id)
+            if slot is not None:
+                query = query.where(Backup.slot == slot)
+            rows = session.scalars(query.order_by(Backup.created_at.desc()).limit(limit))
+            return [
+                {column.name: getattr(row, column.name) for column in Backup.__table__.columns}
+                for row in rows
+            ]
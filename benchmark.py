@@ -0,0 +1,302 @@
+"""
+Offline benchmark of the poll tick.
+
+Starts a local stub of the Microsoft token, Xbox (XBL/XSTS), Minecraft
+(login_with_xbox, profile), Realms (/worlds*) and Telegram Bot API endpoints,
+points the clients at it and measures tick latency for several realm counts,
+both resident (one `Monitor`, many ticks) and one-shot (a fresh process per
+tick, like `realmctl run` from cron).
+
+    python benchmark.py --realms 1 10 100 1000 --ticks 20 --latency 0.02 --error-rate 0.01
+
+Settings live in a throwaway SQLite file unless DATABASE_URL is set.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, NamedTuple
+
+
+PLAYERS_PER_REALM = 3
+ONLINE_PROBABILITY = 0.3
+OWNER_UUID = "00000000000000000000000000000001"
+
+
+# ---------- STUB ----------
+
+class StubConfig:
+    def __init__(self, realms: int = 1, latency: float = 0.0, error_rate: float = 0.0):
+        self.realms = realms
+        self.latency = latency
+        self.error_rate = error_rate
+
+
+def _world(world_id: int) -> dict:
+    return {
+        "id": world_id,
+        "name": f"Realm {world_id}",
+        "ownerUUID": OWNER_UUID,
+        "state": "OPEN",
+        "expired": False,
+        "activeSlot": 1,
+        "slots": [{"slotId": 1}],
+        "players": [
+            {"name": f"p{world_id}_{i}", "online": random.random() < ONLINE_PROBABILITY}
+            for i in range(PLAYERS_PER_REALM)
+        ],
+    }
+
+
+def _auth_token(data: dict) -> dict:
+    return {
+        "Token": "bench-xbox-token",
+        "NotAfter": "2099-01-01T00:00:00Z",
+        "DisplayClaims": {"xui": [{"uhs": "bench-uhs"}]},
+    }
+
+
+def _telegram(method: str) -> object:
+    if method == "getMe":
+        return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+    if method in ("sendMessage", "editMessageText"):
+        return {"message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "group"}, "text": ""}
+    return True
+
+
+AUTH_ROUTES = {
+    "/consumers/oauth2/v2.0/token": lambda data: {"access_token": "bench-ms", "refresh_token": "bench-refresh", "expires_in": 3600},
+    "/user/authenticate": _auth_token,
+    "/xsts/authorize": _auth_token,
+    "/authentication/login_with_xbox": lambda data: {"access_token": "bench-mc", "expires_in": 86400},
+    "/minecraft/profile": lambda data: {"id": OWNER_UUID, "name": "Bench"},
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: object) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self) -> None:
+        config: StubConfig = self.server.config
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        path = self.path.split("?")[0]
+        time.sleep(config.latency)
+
+        # Auth не ломаем: упавший refresh ушёл бы в интерактивный логин
+        if path in AUTH_ROUTES:
+            return self._reply(200, AUTH_ROUTES[path]({}))
+        if random.random() < config.error_rate:
+            return self._reply(503, {"error": "injected"})
+
+        telegram = re.fullmatch(r"/bot[^/]+/(\w+)", path)
+        if telegram:
+            return self._reply(200, {"ok": True, "result": _telegram(telegram.group(1))})
+        if path == "/worlds":
+            return self._reply(200, {"servers": [_world(world_id) for world_id in range(1, config.realms + 1)]})
+        match = re.fullmatch(r"/worlds(?:/v1)?/(\d+)(/.*)?", path)
+        if not match:
+            return self._reply(404, {"error": "not found"})
+        world_id, rest = int(match.group(1)), match.group(2) or ""
+        if rest == "":
+            return self._reply(200, _world(world_id))
+        if rest == "/backups":
+            return self._reply(200, {"backups": [{"backupId": f"{world_id}-1", "lastModifiedDate": 1700000000000, "size": 1024}]})
+        if rest.endswith("/download"):
+            return self._reply(200, {"downloadLink": f"http://127.0.0.1/backups/{world_id}.tar.gz"})
+        if rest == "/join/pc":
+            return self._reply(200, {"address": f"realm{world_id}.example:25565"})
+        return self._reply(404, {"error": "not found"})
+
+    do_GET = _route
+    do_POST = _route
+
+
+def start_stub(config: StubConfig) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------- CLIENTS ----------
+
+def _configure_env(base: str, database_url: str) -> None:
+    # До импорта модулей проекта: они читают конфиг при импорте
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["TELEGRAM_API_URL"] = f"{base}/bot"
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+    os.environ.setdefault("TELEGRAM_CHAT_ID", "1")
+    os.environ["REALM_IDS"] = ""
+    os.environ["REALM_ACCOUNTS"] = ""
+    os.environ["METRICS_PORT"] = "0"
+    # Иначе повторные тики читали бы /worlds/{id} из кэша
+    os.environ["REALMS_WORLD_INFO_TTL"] = "0"
+
+
+def _point_clients_at(base: str) -> None:
+    from auth.http_client import POOL_SIZES
+    from auth.microsoft import MicrosoftAuth
+    from auth.minecraft import MinecraftAuth
+    from auth.realms import AsyncRealmsClient
+    from auth.xbox import XboxAuth
+
+    POOL_SIZES[base] = POOL_SIZES[MinecraftAuth.REALMS_BASE]
+    MicrosoftAuth.TOKEN_URL = f"{base}/consumers/oauth2/v2.0/token"
+    XboxAuth.XBL_AUTH_URL = f"{base}/user/authenticate"
+    XboxAuth.XSTS_AUTH_URL = f"{base}/xsts/authorize"
+    MinecraftAuth.MC_AUTH_URL = f"{base}/authentication/login_with_xbox"
+    MinecraftAuth.PROFILE_URL = f"{base}/minecraft/profile"
+    MinecraftAuth.REALMS_BASE = AsyncRealmsClient.REALMS_BASE = base
+
+
+def _seed_login() -> None:
+    from auth.microsoft import MicrosoftAuth
+    from db import init_db, set_setting
+
+    init_db()
+    set_setting(MicrosoftAuth.REFRESH_TOKEN_KEY, "bench-refresh")
+
+
+# ---------- RUNS ----------
+
+class Result(NamedTuple):
+    mode: str
+    realms: int
+    latencies: List[float]
+    failed: int
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[max(math.ceil(p * len(ordered)) - 1, 0)] if ordered else float("nan")
+
+
+async def _resident(realms: int, ticks: int) -> List[float]:
+    from auth.response_cache import response_cache
+    from monitor import Monitor
+
+    # Список миров из прошлого прогона закэширован
+    response_cache.invalidate()
+    monitor = Monitor()
+    latencies = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Прогрев: авторизация и поиск миров
+            await monitor.tick()
+            world_ids = list(monitor.scheduler.worlds)
+            assert len(world_ids) == realms, f"expected {realms} realms, got {len(world_ids)}"
+            for _ in range(ticks):
+                started = time.perf_counter()
+                await monitor.tick(world_ids)
+                latencies.append(time.perf_counter() - started)
+    finally:
+        await monitor.close()
+    return latencies
+
+
+def run_resident(realms: int, ticks: int) -> Result:
+    return Result("resident", realms, asyncio.run(_resident(realms, ticks)), 0)
+
+
+def run_one_shot(base: str, realms: int, ticks: int) -> Result:
+    latencies = []
+    failed = 0
+    for _ in range(ticks):
+        started = time.perf_counter()
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", base],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        latencies.append(time.perf_counter() - started)
+        if child.returncode:
+            failed += 1
+            logging.warning("one-shot tick failed: %s", child.stderr.decode()[-500:])
+    return Result("one-shot", realms, latencies, failed)
+
+
+def run_child(base: str) -> None:
+    _point_clients_at(base)
+    from main import main
+
+    asyncio.run(main())
+
+
+def report(results: List[Result]) -> None:
+    print(f"{'mode':<10}{'realms':>8}{'ticks':>7}{'p50 ms':>10}{'p99 ms':>10}{'ticks/s':>10}{'polls/s':>10}{'failed':>8}")
+    for result in results:
+        total = sum(result.latencies)
+        ticks = len(result.latencies)
+        print(
+            f"{result.mode:<10}{result.realms:>8}{ticks:>7}"
+            f"{result.percentile(0.5) * 1000:>10.1f}{result.percentile(0.99) * 1000:>10.1f}"
+            f"{ticks / total if total else 0:>10.2f}{ticks * result.realms / total if total else 0:>10.1f}"
+            f"{result.failed:>8}"
+        )
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="offline tick benchmark against a local API stub")
+    parser.add_argument("--realms", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--ticks", type=int, default=20, help="resident ticks per realm count")
+    parser.add_argument("--one-shot-ticks", type=int, default=5, help="one-shot runs per realm count (0 to skip)")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub response delay, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Realms/Telegram responses that are 503")
+    parser.add_argument("--database-url", help="SQLAlchemy URL (default: DATABASE_URL or a temporary SQLite file)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.child:
+        return run_child(args.child)
+
+    config = StubConfig(latency=args.latency, error_rate=args.error_rate)
+    stub = start_stub(config)
+    base = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or os.getenv("DATABASE_URL") or f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+        _configure_env(base, database_url)
+        _point_clients_at(base)
+        _seed_login()
+
+        results = []
+        for realms in args.realms:
+            config.realms = realms
+            results.append(run_resident(realms, args.ticks))
+            if args.one_shot_ticks:
+                results.append(run_one_shot(base, realms, args.one_shot_ticks))
+        stub.shutdown()
+
+        from db import dispose_engine
+        dispose_engine()
+
+    report(results)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import time
+
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram.helpers import escape_markdown
+
+import presence
+from backups import BackupCatalog
+from events import EventBatch, EventEngine
+from metrics import TELEGRAM_COMMANDS_TOTAL, TELEGRAM_REQUEST_SECONDS
+from tg import BOT_TOKEN, MSK, TELEGRAM_API_URL, format_duration, format_players, format_playtime, get_targets, weekly_playtime
+
+
+# 1 — отвечать на команды в чатах из TELEGRAM_TARGETS (long polling, только в режиме monitor)
+TELEGRAM_COMMANDS = os.getenv("TELEGRAM_COMMANDS", "0") == "1"
+TELEGRAM_TOP_LIMIT = int(os.getenv("TELEGRAM_TOP_LIMIT", "10"))
+
+# Неделя — из памяти, остальное — из истории присутствия
+TOP_PERIODS = {"day": (24 * 3600, "день"), "week": (7 * 24 * 3600, "неделю"), "month": (30 * 24 * 3600, "месяц")}
+
+
+logger = logging.getLogger(__name__)
+
+Address = Callable[[int], Awaitable[str]]
+
+
+def _stamp(ts: int) -> str:
+    return datetime.fromtimestamp(ts, MSK).strftime("%d.%m %H:%M")
+
+
+class BotCommands:
+    """
+    Answers /online, /top, /player, /backup and /ip in target chats.
+
+    Answers come from the monitor's state (event engine rosters and sessions,
+    rolling playtime) and local stores (presence history, backup catalog).
+    /ip goes through the cached Realms client and at most one lookup per realm
+    is in flight, so commands never multiply upstream requests.
+    """
+
+    def __init__(self, events: EventEngine, backups: BackupCatalog, address: Address):
+        self.events = events
+        self.backups = backups
+        self.address = address
+        self.answers: Dict[str, Callable[[List[int], List[str], EventBatch], Awaitable[str]]] = {
+            "online": self.online,
+            "top": self.top,
+            "player": self.player,
+            "backup": self.backup,
+            "ip": self.ip,
+        }
+        self._address_locks: Dict[int, asyncio.Lock] = {}
+        self._app: Optional[Application] = None
+
+    # ---------- ANSWERS ----------
+
+    async def answer(self, chat_id: str, command: str, args: List[str], now_ts: int) -> Optional[str]:
+        """
+        Reply text for `command`; None for unknown commands and chats that are not targets
+        """
+        targets = get_targets()
+        realm_ids = targets.chat_realms(chat_id, set(targets.realms) | set(self.events.online))
+        if command not in self.answers or not realm_ids:
+            return None
+        return await self.answers[command](realm_ids, args, self.events.snapshot(now_ts))
+
+    async def online(self, realm_ids: List[int], args: List[str], batch: EventBatch) -> str:
+        now_utc = datetime.fromtimestamp(batch.now_ts, timezone.utc)
+        if len(realm_ids) == 1:
+            players = batch.rosters.get(realm_ids[0], [])
+            return f"👥 *Онлайн:* {len(players)}\n{format_players(players, batch.sessions, now_utc)}"
+
+        online = {name for realm_id in realm_ids for name in batch.rosters.get(realm_id, ())}
+        sections = "\n".join(
+            f"\n🌍 *{escape_markdown(get_targets().name(realm_id))}* ({len(batch.rosters.get(realm_id, ()))})\n"
+            f"{format_players(batch.rosters.get(realm_id, []), batch.sessions, now_utc)}"
+            for realm_id in realm_ids
+        )
+        return f"👥 *Онлайн:* {len(online)}\n{sections}"
+
+    async def top(self, realm_ids: List[int], args: List[str], batch: EventBatch) -> str:
+        period = args[0].lower() if args else "week"
+        if period not in TOP_PERIODS:
+            return f"Использование: /top [{'|'.join(TOP_PERIODS)}]"
+
+        seconds, label = TOP_PERIODS[period]
+        totals: Dict[str, int] = {}
+        if period == "week":
+            shown = get_targets().shown(realm_ids, batch.rosters)
+            totals = {name: secs for name, secs in weekly_playtime(batch.sessions, batch.now_ts).items() if name in shown}
+        else:
+            # Из БД — в потоке, чтобы не держать цикл событий
+            totals = await asyncio.to_thread(presence.player_totals, batch.now_ts - seconds, batch.now_ts, realm_ids)
+
+        if not totals:
+            return "— никто не играл —"
+        ranked = sorted(totals.items(), key=lambda item: -item[1])[:TELEGRAM_TOP_LIMIT]
+        lines = "\n".join(f"{place}. {escape_markdown(name)}: {format_playtime(secs)}" for place, (name, secs) in enumerate(ranked, 1))
+        return f"🏆 *Топ за {label}:*\n{lines}"
+
+    async def player(self, realm_ids: List[int], args: List[str], batch: EventBatch) -> str:
+        if not args:
+            return "Использование: /player <ник>"
+        # Ищем только среди игроков миров этого чата
+        shown = {name.lower(): name for name in get_targets().shown(realm_ids, batch.rosters)}
+        name = shown.get(args[0].lower())
+        if name is None:
+            return "Игрок не найден"
+
+        playing = [get_targets().name(realm_id) for realm_id in realm_ids if name in batch.rosters.get(realm_id, ())]
+        session = batch.sessions.get(name)
+        if playing:
+            now_utc = datetime.fromtimestamp(batch.now_ts, timezone.utc)
+            started_at = datetime.fromtimestamp(session["started_at"], timezone.utc)
+            status = f"🟢 *{escape_markdown(name)}* — {', '.join(escape_markdown(realm) for realm in playing)} {format_duration(started_at, now_utc)}"
+        elif session is not None:
+            status = f"⚪ *{escape_markdown(name)}* — был в игре в {_stamp(session['last_seen'])} (МСК)"
+        else:
+            status = f"⚪ *{escape_markdown(name)}* — не в сети"
+        week = weekly_playtime(batch.sessions, batch.now_ts).get(name, 0)
+        return f"{status}\n📊 За неделю: {format_playtime(week)}"
+
+    async def backup(self, realm_ids: List[int], args: List[str], batch: EventBatch) -> str:
+        lines = []
+        for realm_id in realm_ids:
+            name = escape_markdown(get_targets().name(realm_id))
+            latest = await asyncio.to_thread(self.backups.latest, realm_id)
+            if not latest:
+                lines.append(f"🌍 *{name}*: бэкапов нет")
+                continue
+            row = latest[0]
+            line = f"🌍 *{name}*: {_stamp(row['created_at'])} (МСК), {row['size'] / 2 ** 20:.0f} МБ"
+            if row["download_url"]:
+                line += f", [скачать]({row['download_url']})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    async def ip(self, realm_ids: List[int], args: List[str], batch: EventBatch) -> str:
+        lines = []
+        for realm_id in realm_ids:
+            name = escape_markdown(get_targets().name(realm_id))
+            try:
+                # Один запрос на мир за раз, дальше — из кэша ответов
+                async with self._address_locks.setdefault(realm_id, asyncio.Lock()):
+                    address = await self.address(realm_id)
+            except Exception as e:
+                logger.warning("Failed to get the address of world %s: %r", realm_id, e)
+                lines.append(f"🌍 *{name}*: адрес недоступен")
+                continue
+            lines.append(f"🌍 *{name}*: `{address}`")
+        return "\n".join(lines)
+
+    # ---------- POLLING ----------
+
+    async def _handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        message = update.effective_message
+        command = message.text.split()[0][1:].split("@")[0].lower()
+        TELEGRAM_COMMANDS_TOTAL.inc(command=command)
+        text = await self.answer(str(update.effective_chat.id), command, context.args or [], int(time.time()))
+        if text:
+            with TELEGRAM_REQUEST_SECONDS.time(method="sendMessage"):
+                await message.reply_text(text, parse_mode="Markdown", disable_web_page_preview=True)
+
+    async def _error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        logger.warning("Telegram command failed: %r", context.error)
+
+    async def start(self) -> None:
+        # Отдельный Bot: long polling не должен занимать соединения статусных сообщений
+        self._app = Application.builder().token(BOT_TOKEN).base_url(TELEGRAM_API_URL).build()
+        self._app.add_handler(CommandHandler(list(self.answers), self._handle))
+        self._app.add_error_handler(self._error)
+        await self._app.initialize()
+        await self._app.start()
+        # Накопившиеся за время простоя команды не разгребаем
+        await self._app.updater.start_polling(allowed_updates=[Update.MESSAGE], drop_pending_updates=True)
+
+    async def stop(self) -> None:
+        if self._app is None:
+            return
+        if self._app.updater.running:
+            await self._app.updater.stop()
+        if self._app.running:
+            await self._app.stop()
+        await self._app.shutdown()
+        self._app = None
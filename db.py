@@ -1,9 +1,19 @@
+import json
 import os
+import threading
+import time
 
-from typing import Optional
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Mapping, Optional
 
-from sqlalchemy import create_engine, Column, String
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, delete, event, select, BigInteger, Column, Index, Integer, String, Text
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+
+from metrics import DB_QUERIES, DB_QUERY_SECONDS
+from snapshot import write_atomic
 
 
 MYSQL_USER     = os.getenv("MYSQL_USER")
@@ -12,15 +22,88 @@ MYSQL_HOST     = os.getenv("MYSQL_HOST")
 MYSQL_PORT     = os.getenv("MYSQL_PORT")
 MYSQL_DB       = os.getenv("MYSQL_DB")
 
+# Любой URL SQLAlchemy (например, sqlite:///realm.sqlite3) вместо MySQL из MYSQL_*
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+DB_POOL_SIZE     = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_RECYCLE  = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# db — таблица settings в той же БД; memory — только в памяти процесса; file — JSON-файл SETTINGS_FILE
+SETTINGS_BACKEND = os.getenv("SETTINGS_BACKEND", "db")
+SETTINGS_FILE    = os.getenv("SETTINGS_FILE", "settings.json")
+
+
+_engine: Optional[Engine] = None
+_sessionmaker: Optional[sessionmaker] = None
+_engine_lock = threading.Lock()
+
+
+def _mysql_url() -> str:
+    # Как можно скачать сертификат для подключения к MySQL
+    # mkdir ~/.mysql
+    # curl -o ~/.mysql/root.crt https://storage.yandexcloud.net/cloud-certs/CA.pem
+    ssl_ca_path = os.path.expanduser("~/.mysql/root.crt")
+    assert os.path.isfile(ssl_ca_path), "Не найден сертификат для подключения к MySQL"
+    return f"mysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}?ssl_ca={ssl_ca_path}"
+
+
+def create_db_engine(url: Optional[str] = None, pool_size: int = DB_POOL_SIZE,
+                     pool_recycle: int = DB_POOL_RECYCLE, pool_pre_ping: bool = DB_POOL_PRE_PING) -> Engine:
+    url = make_url(url or DATABASE_URL or _mysql_url())
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            # Одна in-memory БД на все потоки, а не своя в каждом
+            engine = create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+        else:
+            engine = create_engine(url, pool_pre_ping=pool_pre_ping)
+    else:
+        engine = create_engine(url, pool_size=pool_size, pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping)
+
+    event.listen(engine, "before_cursor_execute", _query_started)
+    event.listen(engine, "after_cursor_execute", _query_finished)
+    event.listen(engine, "commit", _committed)
+    return engine
+
+
+def get_engine() -> Engine:
+    """
+    Process-wide engine, created on first use
+    """
+    global _engine, _sessionmaker
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_db_engine()
+            _sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+        return _engine
+
+
+def SessionLocal() -> Session:
+    get_engine()
+    return _sessionmaker()
+
+
+def dispose_engine() -> None:
+    global _engine, _sessionmaker
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+            _sessionmaker = None
+
 
-# Как можно скачать сертификат для подключения к MySQL
-# mkdir ~/.mysql
-# curl -o ~/.mysql/root.crt https://storage.yandexcloud.net/cloud-certs/CA.pem
-ssl_ca_path = os.path.expanduser("~/.mysql/root.crt")
-assert os.path.isfile(ssl_ca_path), "Не найден сертификат для подключения к MySQL"
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    context._started = time.perf_counter()
 
-engine = create_engine(f"mysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}?ssl_ca={ssl_ca_path}", pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    kind = statement.lstrip().split(None, 1)[0].upper()
+    DB_QUERIES.inc(statement=kind)
+    DB_QUERY_SECONDS.observe(time.perf_counter() - context._started, statement=kind)
+
+
+def _committed(conn):
+    DB_QUERIES.inc(statement="COMMIT")
 
 
 Base = declarative_base()
@@ -33,26 +116,213 @@ class Setting(Base):
     value = Column(String, nullable=False)
 
 
-def set_setting(key: str, value: str) -> None:
-    with SessionLocal() as session:
-        setting = session.get(Setting, key)
-        if setting:
-            setting.value = value
+class ActiveSession(Base):
+    __tablename__ = 'player_sessions'
+
+    player     = Column(String(64), primary_key=True, nullable=False)
+    started_at = Column(Integer, nullable=False)
+    last_seen  = Column(Integer, nullable=False)
+
+
+class PlayInterval(Base):
+    __tablename__ = 'play_intervals'
+    __table_args__ = (
+        Index('ix_play_intervals_player_start', 'player', 'start_ts'),
+        Index('ix_play_intervals_start', 'start_ts'),
+    )
+
+    id       = Column(Integer, primary_key=True, autoincrement=True)
+    player   = Column(String(64), nullable=False)
+    start_ts = Column(Integer, nullable=False)
+    duration = Column(Integer, nullable=False)
+
+
+class Backup(Base):
+    __tablename__ = 'backups'
+    __table_args__ = (
+        Index('ix_backups_world_slot_created', 'world_id', 'slot', 'created_at'),
+    )
+
+    world_id     = Column(BigInteger, primary_key=True, nullable=False)
+    backup_id    = Column(String(64), primary_key=True, nullable=False)
+    slot         = Column(Integer, nullable=False)
+    created_at   = Column(Integer, nullable=False)
+    size         = Column(BigInteger, nullable=False)
+    download_url = Column(Text, nullable=True)
+
+
+class PresenceMinutes(Base):
+    # Сырая история: бит на каждую минуту часа, в которую игрок был в мире
+    __tablename__ = 'presence_minutes'
+    __table_args__ = (
+        Index('ix_presence_minutes_hour', 'hour_ts'),
+    )
+
+    realm_id = Column(BigInteger, primary_key=True, nullable=False)
+    hour_ts  = Column(Integer, primary_key=True, nullable=False)
+    player   = Column(String(64), primary_key=True, nullable=False)
+    minutes  = Column(BigInteger, nullable=False)
+
+
+class PresenceHour(Base):
+    # Свёртка по часам; realm_id = 0 — все миры вместе
+    __tablename__ = 'presence_hours'
+
+    realm_id       = Column(BigInteger, primary_key=True, nullable=False)
+    hour_ts        = Column(Integer, primary_key=True, nullable=False)
+    peak           = Column(Integer, nullable=False)
+    player_minutes = Column(Integer, nullable=False)
+
+
+class PresenceDay(Base):
+    # Свёртка по дням: минуты игрока в мире за сутки (UTC)
+    __tablename__ = 'presence_days'
+
+    realm_id = Column(BigInteger, primary_key=True, nullable=False)
+    day_ts   = Column(Integer, primary_key=True, nullable=False)
+    player   = Column(String(64), primary_key=True, nullable=False)
+    minutes  = Column(Integer, nullable=False)
+
+
+def init_db() -> None:
+    # Создаёт недостающие таблицы, существующие не трогает
+    Base.metadata.create_all(get_engine())
+
+
+def upsert(session, model, rows: List[dict], *columns: str) -> None:
+    """
+    `INSERT ... ON DUPLICATE KEY UPDATE` (`ON CONFLICT DO UPDATE` on SQLite)
+    of `columns` for every row
+    """
+    if not rows:
+        return
+    if session.get_bind().dialect.name == "sqlite":
+        stmt = sqlite.insert(model).values(rows)
+        keys = [column.name for column in model.__table__.primary_key]
+        session.execute(stmt.on_conflict_do_update(index_elements=keys, set_={column: stmt.excluded[column] for column in columns}))
+        return
+    stmt = mysql.insert(model).values(rows)
+    session.execute(stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in columns}))
+
+
+# ---------- SETTINGS ----------
+
+class SettingsStore(ABC):
+    """
+    Key/value settings storage. Missing keys are absent from `get_many`,
+    keys mapped to None in `set_many` are deleted.
+    """
+
+    @abstractmethod
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    def set_many(self, values: Mapping[str, Optional[str]]) -> None:
+        ...
+
+
+class DbSettingsStore(SettingsStore):
+    """
+    The `settings` table of the main database (MySQL or SQLite)
+    """
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        with SessionLocal() as session:
+            rows = session.execute(select(Setting.key, Setting.value).where(Setting.key.in_(keys)))
+            return {key: value for key, value in rows}
+
+    def set_many(self, values: Mapping[str, Optional[str]]) -> None:
+        upserts = {key: value for key, value in values.items() if value is not None}
+        removed = [key for key, value in values.items() if value is None]
+        with SessionLocal() as session:
+            upsert(session, Setting, [{"key": key, "value": value} for key, value in upserts.items()], "value")
+            if removed:
+                session.execute(delete(Setting).where(Setting.key.in_(removed)))
+            session.commit()
+
+
+class FileSettingsStore(SettingsStore):
+    """
+    Settings in a dict, persisted to a JSON file after every write
+    (kept only in memory when `path` is None).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._values: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._values = json.load(f)
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        with self._lock:
+            return {key: self._values[key] for key in keys if key in self._values}
+
+    def set_many(self, values: Mapping[str, Optional[str]]) -> None:
+        with self._lock:
+            for key, value in values.items():
+                if value is None:
+                    self._values.pop(key, None)
+                else:
+                    self._values[key] = value
+            if self.path:
+                # Через временный файл с fsync, чтобы при падении не остаться с обрезанным JSON
+                write_atomic(self.path, json.dumps(self._values))
+
+
+_settings_store: Optional[SettingsStore] = None
+
+
+def get_settings_store() -> SettingsStore:
+    global _settings_store
+    if _settings_store is None:
+        if SETTINGS_BACKEND == "memory":
+            _settings_store = FileSettingsStore()
+        elif SETTINGS_BACKEND == "file":
+            _settings_store = FileSettingsStore(SETTINGS_FILE)
+        elif SETTINGS_BACKEND == "db":
+            _settings_store = DbSettingsStore()
         else:
-            session.add(Setting(key=key, value=value))
+            raise ValueError(f"Unknown SETTINGS_BACKEND: {SETTINGS_BACKEND}")
+    return _settings_store
 
-        session.commit()
+
+def set_setting(key: str, value: str) -> None:
+    set_settings({key: value})
 
 
 def get_setting(key: str) -> Optional[str]:
-    with SessionLocal() as session:
-        setting = session.get(Setting, key)
-        return setting.value if setting else None
+    return get_settings([key]).get(key)
 
 
 def remove_setting(key: str) -> None:
-    with SessionLocal() as session:
-        setting = session.get(Setting, key)
-        if setting:
-            session.delete(setting)
-            session.commit()
+    delete_settings([key])
+
+
+# ---------- BULK ----------
+
+def get_settings(keys: Iterable[str]) -> Dict[str, str]:
+    """
+    Reads several settings at once (one `SELECT ... WHERE key IN (...)` for the DB backend).
+    Missing keys are absent from the result.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    return get_settings_store().get_many(keys)
+
+
+def set_settings(values: Mapping[str, Optional[str]]) -> None:
+    """
+    Writes several settings in one transaction (`INSERT ... ON DUPLICATE KEY UPDATE` for the DB backend).
+    Keys mapped to None are deleted in the same transaction.
+    """
+    if not values:
+        return
+    get_settings_store().set_many(values)
+
+
+def delete_settings(keys: Iterable[str]) -> None:
+    set_settings({key: None for key in keys})
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+import time
+
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+
+from metrics import TELEGRAM_RETRY_AFTER
+
+
+# Лимиты Bot API: ~30 сообщений в секунду всего и ~20 в минуту на группу
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE   = float(os.getenv("TELEGRAM_CHAT_RATE", str(20 / 60)))
+TELEGRAM_CHAT_BURST  = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+DELIVERY_WORKERS     = int(os.getenv("DELIVERY_WORKERS", "4"))
+
+
+logger = logging.getLogger(__name__)
+
+Send = Callable[[], Awaitable[None]]
+
+
+def _seconds(value: Union[int, float, timedelta]) -> float:
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            blocked = self.blocked_until - now
+            if blocked <= 0 and self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep(max(blocked, (1 - self.tokens) / self.rate))
+
+
+class DeliveryQueue:
+    """
+    Outbound queue for Telegram requests.
+
+    `submit` never waits on Telegram. Updates with the same key (e.g. the same
+    status message) are coalesced: only the latest pending one is sent.
+    Requests go through per-chat and global token buckets, and RetryAfter
+    pauses the chat and re-queues the update.
+    """
+
+    def __init__(self, workers: int = DELIVERY_WORKERS):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: Dict[str, Tuple[str, Send]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._chats: Dict[str, TokenBucket] = {}
+        self._global = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self._workers: List[asyncio.Task] = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+    def submit(self, key: str, chat_id: str, send: Send) -> None:
+        if key not in self._pending:
+            self._queue.put_nowait(key)
+        self._pending[key] = (chat_id, send)
+
+    def _chat(self, chat_id: str) -> TokenBucket:
+        if chat_id not in self._chats:
+            self._chats[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        return self._chats[chat_id]
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._queue.get()
+            try:
+                # Одно сообщение правим строго по очереди
+                lock = self._locks.setdefault(key, asyncio.Lock())
+                async with lock:
+                    if key in self._pending:
+                        await self._deliver(key)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, key: str) -> None:
+        chat = self._chat(self._pending[key][0])
+        await chat.acquire()
+        await self._global.acquire()
+
+        # Пока ждали лимит, обновление могли заменить более свежим
+        chat_id, send = self._pending.pop(key)
+        try:
+            await send()
+        except RetryAfter as e:
+            retry_after = _seconds(e.retry_after)
+            TELEGRAM_RETRY_AFTER.inc(chat=chat_id)
+            logger.warning("Telegram flood control for chat %s, retry in %.0fs", chat_id, retry_after)
+            chat.block(retry_after)
+            # Повторяем, только если за это время не пришло обновление новее
+            if key not in self._pending:
+                self.submit(key, chat_id, send)
+        except Exception:
+            logger.exception("Telegram delivery failed for %s", key)
+
+    async def close(self, timeout: Optional[float] = 30) -> None:
+        # Досылаем то, что уже в очереди, но не дольше timeout
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d undelivered Telegram updates", len(self._pending))
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
@@ -0,0 +1,183 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple, Optional, Tuple
+
+import requests
+
+from auth.http_client import TIMEOUT, get_session
+
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+CHUNK_SIZE = int(os.getenv("BACKUP_CHUNK_SIZE", str(1 << 20)))
+
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class PulledBackup(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    reused: bool
+
+
+def _hash_file(path: str, digest) -> int:
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def _read_meta(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _total_size(r: requests.Response) -> Optional[int]:
+    content_range = r.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def download(url: str, partial_path: str, session: Optional[requests.Session] = None,
+             throttle: Optional[Callable[[int], None]] = None) -> Tuple[str, int]:
+    """
+    Streams `url` into `partial_path` in CHUNK_SIZE pieces.
+
+    If a partial file is left from an interrupted run, only the missing range
+    is requested; `If-Range` makes the server send the whole file again when
+    it has changed in between. Returns (sha256, size) of the complete file.
+    """
+    session = session or get_session()
+    meta_path = f"{partial_path}.json"
+    meta = _read_meta(meta_path)
+
+    have = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    headers = {}
+    if have and meta.get("validator"):
+        headers["Range"] = f"bytes={have}-"
+        headers["If-Range"] = meta["validator"]
+
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+        if r.status_code == 416:
+            # Кусок битый или уже другой файл — начинаем заново
+            os.remove(partial_path)
+            return download(url, partial_path, session, throttle)
+        r.raise_for_status()
+
+        digest = hashlib.sha256()
+        if r.status_code == 206:
+            _hash_file(partial_path, digest)
+            mode = "ab"
+        else:
+            have = 0
+            mode = "wb"
+
+        total = _total_size(r)
+        validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+        with open(meta_path, "w") as f:
+            json.dump({"validator": validator, "total": total}, f)
+
+        with open(partial_path, mode) as f:
+            # Сырые байты: Content-Encoding не раскрываем, иначе Range не сойдётся
+            for chunk in r.raw.stream(CHUNK_SIZE, decode_content=False):
+                f.write(chunk)
+                digest.update(chunk)
+                have += len(chunk)
+                if throttle:
+                    throttle(len(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+
+    if total is not None and have != total:
+        # Недокачанный файл оставляем — в следующий раз продолжим с этого места
+        raise DownloadError(f"Incomplete download: {have} of {total} bytes")
+
+    os.remove(meta_path)
+    return digest.hexdigest(), have
+
+
+def _link(source: str, path: str) -> None:
+    # Атомарно: создаём ссылку рядом и переименовываем
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        os.symlink(os.path.abspath(source), tmp)
+    os.replace(tmp, path)
+
+
+def store(partial_path: str, sha256: str, size: int, slot_dir: str, backup_dir: str = BACKUP_DIR) -> PulledBackup:
+    """
+    Moves a finished download into the content-addressed store
+    (`objects/<sha256>.tar.gz`) and links it from `slot_dir`.
+    Identical archives are kept on disk once; an existing object is
+    verified before it is reused and repaired from the download if broken.
+    """
+    objects_dir = os.path.join(backup_dir, "objects")
+    os.makedirs(objects_dir, exist_ok=True)
+    os.makedirs(slot_dir, exist_ok=True)
+
+    obj = os.path.join(objects_dir, f"{sha256}.tar.gz")
+    reused = os.path.exists(obj)
+    if reused and not verify(obj):
+        # Перезаписываем тот же inode: жёсткие ссылки из других слотов тоже станут целыми
+        logger.warning("Stored backup %s is corrupted, restoring it from the new download", obj)
+        shutil.copyfile(partial_path, obj)
+    if reused:
+        os.remove(partial_path)
+    else:
+        os.replace(partial_path, obj)
+
+    existing = glob.glob(os.path.join(slot_dir, f"*-{sha256[:12]}.tar.gz"))
+    if existing:
+        return PulledBackup(existing[0], sha256, size, True)
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(slot_dir, f"{stamp}-{sha256[:12]}.tar.gz")
+    _link(obj, path)
+    return PulledBackup(path, sha256, size, reused)
+
+
+def verify(path: str) -> bool:
+    """
+    Checks a stored archive against the hash in its name
+    (`objects/<sha256>.tar.gz` or `<stamp>-<sha256[:12]>.tar.gz`)
+    """
+    real = os.path.realpath(path)
+    expected = os.path.basename(real)[:-len(".tar.gz")].rsplit("-", 1)[-1]
+    digest = hashlib.sha256()
+    _hash_file(real, digest)
+    return digest.hexdigest().startswith(expected)
+
+
+def pull_backup(url: str, world_id: int, slot: int, backup_dir: str = BACKUP_DIR,
+                session: Optional[requests.Session] = None,
+                throttle: Optional[Callable[[int], None]] = None) -> PulledBackup:
+    partial_dir = os.path.join(backup_dir, ".partial")
+    os.makedirs(partial_dir, exist_ok=True)
+    partial_path = os.path.join(partial_dir, f"{world_id}-slot{slot}.part")
+
+    sha256, size = download(url, partial_path, session, throttle)
+    slot_dir = os.path.join(backup_dir, str(world_id), f"slot{slot}")
+    return store(partial_path, sha256, size, slot_dir, backup_dir)
@@ -0,0 +1,340 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, ClassVar, Dict, Iterable, List, Optional, Set, TextIO, Tuple, Union
+
+import httpx
+
+from playtime import PlayerSession, store_sessions
+
+
+# Путь к JSONL-журналу событий; пусто — не писать
+EVENTS_JSONL = os.getenv("EVENTS_JSONL", "")
+# Через запятую; каждому URL уходит POST {"events": [...]} с непустыми пачками
+EVENTS_WEBHOOK_URLS = [url.strip() for url in os.getenv("EVENTS_WEBHOOK_URLS", "").split(",") if url.strip()]
+EVENTS_WEBHOOK_TIMEOUT = float(os.getenv("EVENTS_WEBHOOK_TIMEOUT", "5"))
+# Сколько пачек ждут отправки в один вебхук; при переполнении старые выбрасываются
+EVENTS_WEBHOOK_QUEUE = int(os.getenv("EVENTS_WEBHOOK_QUEUE", "1000"))
+# Как часто сохранять last_seen игроков, которые остаются онлайн (секунды)
+SESSION_HEARTBEAT = int(os.getenv("SESSION_HEARTBEAT", "300"))
+
+
+logger = logging.getLogger(__name__)
+
+
+# ---------- EVENTS ----------
+
+@dataclass(frozen=True)
+class PlayerJoined:
+    """`player` appeared in `realm_id`"""
+    type: ClassVar[str] = "join"
+    realm_id: int
+    player: str
+    ts: int
+
+
+@dataclass(frozen=True)
+class PlayerLeft:
+    """`player` is no longer in `realm_id`; `ts` is the last poll that saw them"""
+    type: ClassVar[str] = "leave"
+    realm_id: int
+    player: str
+    ts: int
+
+
+@dataclass(frozen=True)
+class SessionClosed:
+    """`player` stayed offline everywhere for the whole grace period"""
+    type: ClassVar[str] = "session_closed"
+    player: str
+    started_at: int
+    last_seen: int
+
+
+Event = Union[PlayerJoined, PlayerLeft, SessionClosed]
+
+
+def event_dict(event: Event) -> dict:
+    return {"type": event.type, **asdict(event)}
+
+
+@dataclass
+class EventBatch:
+    """
+    Events of one tick plus a read-only view of the state they lead to.
+
+    `players` is everyone online in any realm, `rosters` who is online in
+    each realm, `sessions` every open session (online or within the grace
+    period); online players have `last_seen == now_ts`.
+    """
+    now_ts: int
+    events: List[Event] = field(default_factory=list)
+    players: List[str] = field(default_factory=list)
+    sessions: Dict[str, PlayerSession] = field(default_factory=dict)
+    rosters: Dict[int, List[str]] = field(default_factory=dict)
+
+    def of(self, *types: type) -> List[Event]:
+        return [event for event in self.events if isinstance(event, types)]
+
+
+Subscriber = Callable[[EventBatch], Awaitable[None]]
+
+
+# ---------- ENGINE ----------
+
+class EventEngine:
+    """
+    Turns per-realm rosters into join/leave/session-closed events.
+
+    `observe()` diffs one realm against its previous roster (O(changed
+    players)), `publish()` closes sessions whose grace period ran out — a heap
+    keyed by deadline, so only due players are looked at — and hands the
+    batch to subscribers in subscription order.
+    """
+
+    def __init__(self, grace: int):
+        self.grace = grace
+        self.online: Dict[int, Set[str]] = {}
+        # В каких мирах игрок сейчас; пустое множество не храним
+        self.where: Dict[str, Set[int]] = {}
+        self.sessions: Dict[str, PlayerSession] = {}
+        self.subscribers: List[Subscriber] = []
+        self._polled_at: Dict[int, int] = {}
+        self._pending: List[Event] = []
+        # (last_seen + grace, player); устаревшие записи отбрасываются при извлечении
+        self._closing: List[Tuple[int, str]] = []
+
+    def subscribe(self, subscriber: Subscriber) -> Subscriber:
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def restore(self, sessions: Dict[str, PlayerSession], snapshot: Optional[dict] = None) -> None:
+        """
+        Picks up sessions left open by the previous run.
+
+        Without a `snapshot` their players count as offline until a poll sees
+        them again (which emits PlayerJoined and continues the session). With
+        one, the rosters from `dump()` are restored too, so players who are
+        still online produce no events at all. The DB stays the source of
+        truth for which sessions are open: roster players without an open
+        session are dropped.
+        """
+        snapshot = snapshot or {}
+        saved = snapshot.get("sessions", {})
+        for player, session in sessions.items():
+            last_seen = max(session["last_seen"], saved.get(player, {}).get("last_seen", 0))
+            self.sessions[player] = {"started_at": session["started_at"], "last_seen": last_seen}
+
+        for realm_id, players in snapshot.get("online", {}).items():
+            players = {player for player in players if player in self.sessions}
+            if not players:
+                continue
+            self.online[int(realm_id)] = players
+            self._polled_at[int(realm_id)] = snapshot["polled_at"][realm_id]
+            for player in players:
+                self.where.setdefault(player, set()).add(int(realm_id))
+
+        for player, session in self.sessions.items():
+            if player not in self.where:
+                heapq.heappush(self._closing, (session["last_seen"] + self.grace, player))
+
+    def dump(self) -> dict:
+        return {
+            "online": {str(realm_id): sorted(players) for realm_id, players in self.online.items()},
+            "polled_at": {str(realm_id): polled_at for realm_id, polled_at in self._polled_at.items()},
+            "sessions": self.sessions,
+        }
+
+    def observe(self, realm_id: int, players: Iterable[str], now_ts: int) -> None:
+        """
+        Records the roster of `realm_id` polled at `now_ts`
+        """
+        current = set(players)
+        previous = self.online.get(realm_id, set())
+        last_poll = self._polled_at.get(realm_id, now_ts)
+
+        for player in sorted(current - previous):
+            self.where.setdefault(player, set()).add(realm_id)
+            session = self.sessions.get(player)
+            if session is None:
+                self.sessions[player] = {"started_at": now_ts, "last_seen": now_ts}
+            else:
+                session["last_seen"] = now_ts
+            self._pending.append(PlayerJoined(realm_id, player, now_ts))
+
+        for player in sorted(previous - current):
+            realms = self.where[player]
+            realms.discard(realm_id)
+            if not realms:
+                # Ушёл отовсюду: last_seen — последний опрос, который его видел
+                del self.where[player]
+                session = self.sessions[player]
+                session["last_seen"] = max(session["last_seen"], last_poll)
+                heapq.heappush(self._closing, (session["last_seen"] + self.grace, player))
+            self._pending.append(PlayerLeft(realm_id, player, last_poll))
+
+        if current:
+            self.online[realm_id] = current
+            self._polled_at[realm_id] = now_ts
+        else:
+            self.online.pop(realm_id, None)
+            self._polled_at.pop(realm_id, None)
+
+    def forget(self, realm_id: int, now_ts: int) -> None:
+        """
+        Drops the roster of a realm that is no longer tracked (or whose state is too old)
+        """
+        self.observe(realm_id, (), now_ts)
+
+    def _expire(self, now_ts: int) -> None:
+        while self._closing and self._closing[0][0] < now_ts:
+            deadline, player = heapq.heappop(self._closing)
+            session = self.sessions.get(player)
+            # Вернулся или сессия уже продлена — запись устарела
+            if session is None or player in self.where or session["last_seen"] + self.grace != deadline:
+                continue
+            del self.sessions[player]
+            self._pending.append(SessionClosed(player, session["started_at"], session["last_seen"]))
+
+    def snapshot(self, now_ts: int, events: Optional[List[Event]] = None) -> EventBatch:
+        sessions = {
+            player: {"started_at": session["started_at"], "last_seen": now_ts if player in self.where else session["last_seen"]}
+            for player, session in self.sessions.items()
+        }
+        rosters = {realm_id: sorted(players) for realm_id, players in self.online.items()}
+        return EventBatch(now_ts, events or [], sorted(self.where), sessions, rosters)
+
+    async def publish(self, now_ts: int) -> EventBatch:
+        """
+        Closes expired sessions and delivers everything observed since the last publish
+        """
+        self._expire(now_ts)
+        events, self._pending = self._pending, []
+        batch = self.snapshot(now_ts, events)
+        for subscriber in self.subscribers:
+            try:
+                await subscriber(batch)
+            except Exception:
+                # Упавший подписчик не должен лишать событий остальных
+                logger.exception("Event subscriber %r failed", subscriber)
+        return batch
+
+
+# ---------- SUBSCRIBERS ----------
+
+class SessionStore:
+    """
+    Persists sessions from events: joins and leaves upsert one row each,
+    closed sessions become play intervals. Players who simply stay online are
+    written every SESSION_HEARTBEAT seconds, so a crash loses at most that
+    much of their session.
+    """
+
+    def __init__(self, retention: int, heartbeat: int = SESSION_HEARTBEAT):
+        self.retention = retention
+        self.heartbeat = heartbeat
+        self._heartbeat_at = 0
+
+    async def __call__(self, batch: EventBatch) -> None:
+        touched: Dict[str, PlayerSession] = {}
+        closed: Dict[str, PlayerSession] = {}
+        for event in batch.events:
+            if isinstance(event, SessionClosed):
+                closed[event.player] = {"started_at": event.started_at, "last_seen": event.last_seen}
+                touched.pop(event.player, None)
+            elif event.player in batch.sessions:
+                touched[event.player] = batch.sessions[event.player]
+
+        if batch.now_ts - self._heartbeat_at >= self.heartbeat:
+            touched.update((player, batch.sessions[player]) for player in batch.players)
+            self._heartbeat_at = batch.now_ts
+
+        if touched or closed:
+            store_sessions(touched, closed, batch.now_ts - self.retention)
+
+
+class JsonlSink:
+    """
+    Appends every event as a JSON line to `path`
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[TextIO] = None
+
+    async def __call__(self, batch: EventBatch) -> None:
+        if not batch.events:
+            return
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        for event in batch.events:
+            self._file.write(json.dumps(event_dict(event), ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    async def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class WebhookSink:
+    """
+    POSTs non-empty batches to `url` as {"ts": ..., "events": [...]}.
+
+    Batches go through a queue drained by a background task, so a slow
+    webhook never holds up the tick or the subscribers after it.
+    """
+
+    def __init__(self, url: str, timeout: float = EVENTS_WEBHOOK_TIMEOUT, queue_size: int = EVENTS_WEBHOOK_QUEUE):
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=timeout)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker: Optional[asyncio.Task] = None
+
+    async def __call__(self, batch: EventBatch) -> None:
+        if not batch.events:
+            return
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._work())
+        if self._queue.full():
+            # Вебхук не успевает — теряем самую старую пачку, а не новые события
+            self._queue.get_nowait()
+            self._queue.task_done()
+            logger.warning("Event webhook %s is falling behind, dropped the oldest batch", self.url)
+        self._queue.put_nowait({"ts": batch.now_ts, "events": [event_dict(event) for event in batch.events]})
+
+    async def _work(self) -> None:
+        while True:
+            payload = await self._queue.get()
+            try:
+                r = await self._client.post(self.url, json=payload)
+                r.raise_for_status()
+            except httpx.HTTPError as e:
+                # Вебхук — best effort: пачку не повторяем
+                logger.warning("Event webhook %s failed: %r", self.url, e)
+            finally:
+                self._queue.task_done()
+
+    async def close(self, timeout: Optional[float] = 30) -> None:
+        # Досылаем то, что уже в очереди, но не дольше timeout
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Dropping %d undelivered event batches for %s", self._queue.qsize(), self.url)
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await self._client.aclose()
+
+
+def sinks_from_env() -> List[Subscriber]:
+    sinks: List[Subscriber] = []
+    if EVENTS_JSONL:
+        sinks.append(JsonlSink(EVENTS_JSONL))
+    sinks.extend(WebhookSink(url) for url in EVENTS_WEBHOOK_URLS)
+    return sinks
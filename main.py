@@ -1,84 +1,169 @@
+import argparse
 import asyncio
+import logging
+import re
+import time
 
-from requests import HTTPError
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
 
-from auth.microsoft import MicrosoftAuth
-from auth.xbox import XboxAuth
-from auth.minecraft import MinecraftAuth
+import presence
 
-from tg import update_status
-from db import set_setting
-
-
-LAST_BACKUP_URL = "last_backup_url"
-
-
-def _is_auth_error(error: HTTPError) -> bool:
-    response = getattr(error, "response", None)
-    if response is None:
-        return False
-    return response.status_code in {401, 403}
+from auth.accounts import AccountManager
+from auth.http_client import close_session
+from auth.realms import AsyncRealmsClient
+from db import dispose_engine, init_db
+from downloader import BACKUP_DIR, pull_backup
+from mirror import mirror, plan
+from monitor import REALM_IDS, Monitor
+from snapshot import STATE_SNAPSHOT
 
 
 async def main():
-    ms = MicrosoftAuth()
-    xbox = XboxAuth()
-    mc = MinecraftAuth()
-
-    # Microsoft
+    monitor = Monitor()
     try:
-        token = ms.get_access_token()
-    except:
-        token = ms.login()
+        await monitor.tick()
+    finally:
+        await monitor.close()
 
-    # Xbox
-    xbl_token, uhs = xbox.get_xbl_token(token)
-    try:
-        xsts_token, uhs = xbox.get_xsts_token(xbl_token)
-    except HTTPError as error:
-        if not _is_auth_error(error):
-            raise
-        xbl_token, uhs = xbox.authenticate(token)
-        xsts_token, uhs = xbox.authorize_xsts(xbl_token)
-
-    # Minecraft
-    try:
-        mc_token = mc.get_token(xsts_token, uhs)
-    except HTTPError as error:
-        if not _is_auth_error(error):
-            raise
-        xbl_token, uhs = xbox.authenticate(token)
-        xsts_token, uhs = xbox.authorize_xsts(xbl_token)
-        mc_token = mc.authenticate(xsts_token, uhs)
 
-    try:
-        profile = mc.get_profile(mc_token)
-    except HTTPError as error:
-        if not _is_auth_error(error):
-            raise
-        mc_token = mc.authenticate(xsts_token, uhs)
-        profile = mc.get_profile(mc_token)
-
-    uuid = profile["id"]
-    name = profile["name"]
-
-    print(f"Logged in as: {name}")
+async def run_monitor():
+    await Monitor(STATE_SNAPSHOT).run()
 
-    for world in mc.get_worlds(mc_token, uuid, name)["servers"]:
-        if world["id"] != 12829680:
-            continue
 
-        print("=== world info ===")
-        world_info = mc.get_world_info(mc_token, uuid, name, world["id"])
-        online_players = sorted([player["name"] for player in world_info["players"] if player["online"]])
-        print(online_players)
-
-        await update_status(online_players)
-
-        print("\n=== backup ===")
-        last_backup = mc.get_world_last_backup(mc_token, uuid, name, world["id"], 1)
-        set_setting(LAST_BACKUP_URL, last_backup["downloadLink"])
+@asynccontextmanager
+async def _realms_clients() -> AsyncIterator[Tuple[AccountManager, AsyncRealmsClient]]:
+    # Бэкапам нужны только токены и Realms: без бота, событий и истории присутствия
+    init_db()
+    accounts = AccountManager.from_env(REALM_IDS)
+    realms = AsyncRealmsClient()
+    try:
+        yield accounts, realms
+    finally:
+        await realms.close()
+        close_session()
+        dispose_engine()
+
+
+async def _resolve_worlds(accounts: AccountManager, realms: AsyncRealmsClient, world_ids: List[int]) -> List[int]:
+    # Ни --world, ни REALM_IDS — берём миры аккаунтов, как это делает monitor
+    if world_ids:
+        return world_ids
+    world_ids = await accounts.discover(realms, await accounts.authorize())
+    if not world_ids:
+        raise SystemExit("No realms found: pass --world or set REALM_IDS")
+    return world_ids
+
+
+async def backup_pull(world_ids: List[int], slot: int, backup_dir: str):
+    async with _realms_clients() as (accounts, realms):
+        world_ids = await _resolve_worlds(accounts, realms, world_ids)
+        credentials = await accounts.authorize(accounts.group(world_ids))
+        for world_id in world_ids:
+            account = accounts.account_for(world_id)
+            if account not in credentials:
+                print(f"{world_id} slot {slot}: failed (account not authorized)")
+                continue
+            last_backup = await realms.get_world_last_backup(*credentials[account], world_id, slot)
+            pulled = await asyncio.to_thread(pull_backup, last_backup["downloadLink"], world_id, slot, backup_dir)
+            state = "unchanged" if pulled.reused else "new"
+            print(f"{world_id} slot {slot}: {pulled.path} ({pulled.size} bytes, {state})")
+
+
+async def backup_mirror(world_ids: List[int], backup_dir: str):
+    async with _realms_clients() as (accounts, realms):
+        world_ids = await _resolve_worlds(accounts, realms, world_ids)
+        groups = accounts.group(world_ids)
+        credentials = await accounts.authorize(groups)
+        world_infos = {}
+        clients = {}
+        for account, account_world_ids in groups.items():
+            if account not in credentials:
+                print(f"{', '.join(map(str, account_world_ids))}: failed (account not authorized)")
+                continue
+            infos = await realms.get_worlds_info(*credentials[account], account_world_ids)
+            for world_id, info in infos.items():
+                if not isinstance(info, Exception):
+                    world_infos[world_id] = info
+                    clients[world_id] = (account.mc, credentials[account])
+        results = await asyncio.to_thread(mirror, plan(world_infos), clients, backup_dir)
+        for job, pulled in results.items():
+            if isinstance(pulled, Exception):
+                print(f"{job.world_id} slot {job.slot}: failed ({pulled!r})")
+            else:
+                state = "unchanged" if pulled.reused else "new"
+                print(f"{job.world_id} slot {job.slot}: {pulled.path} ({pulled.size} bytes, {state})")
+
+
+def _parse_time(value: str, now_ts: int) -> int:
+    # "30d", "12h", "90m" — столько назад; иначе ISO-дата/время (UTC, если без зоны)
+    match = re.fullmatch(r"(\d+)([dhm])", value)
+    if match:
+        return now_ts - int(match.group(1)) * {"d": 86400, "h": 3600, "m": 60}[match.group(2)]
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def presence_report(command: str, world_id: Optional[int], since: str, until: Optional[str], step_hours: int) -> None:
+    init_db()
+    now_ts = int(time.time())
+    start_ts = _parse_time(since, now_ts)
+    end_ts = _parse_time(until, now_ts) if until else now_ts
+
+    if command == "concurrency":
+        for bucket_ts, peak, average in presence.concurrency(start_ts, end_ts, world_id, step_hours * 3600):
+            stamp = datetime.fromtimestamp(bucket_ts, timezone.utc).strftime("%Y-%m-%d %H:%M")
+            print(f"{stamp}  peak {peak:>3}  avg {average:6.2f}")
+    elif command == "players":
+        totals = presence.player_totals(start_ts, end_ts, None if world_id is None else [world_id])
+        for player, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+            print(f"{player:<20} {seconds // 3600:>5}h {seconds % 3600 // 60:02d}m")
+    else:
+        print("      " + "".join(f"{hour:>5}" for hour in range(24)))
+        for name, row in zip(("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"), presence.heatmap(start_ts, end_ts, world_id)):
+            print(f"{name:<6}" + "".join(f"{value:5.1f}" for value in row))
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(prog="realmctl")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="poll realms once and exit (default)")
+    subparsers.add_parser("monitor", help="keep running and poll realms every POLL_INTERVAL seconds")
+
+    backup = subparsers.add_parser("backup", help="work with realm backups")
+    backup_commands = backup.add_subparsers(dest="backup_command", required=True)
+    pull = backup_commands.add_parser("pull", help="download the latest backup of a slot")
+    pull.add_argument("--world", type=int, action="append", help="world id (default: REALM_IDS, or every owned realm)")
+    pull.add_argument("--slot", type=int, default=1)
+    pull.add_argument("--dir", default=BACKUP_DIR)
+    mirror_parser = backup_commands.add_parser("mirror", help="pull every slot of every realm and apply retention")
+    mirror_parser.add_argument("--world", type=int, action="append", help="world id (default: REALM_IDS, or every owned realm)")
+    mirror_parser.add_argument("--dir", default=BACKUP_DIR)
+
+    presence_parser = subparsers.add_parser("presence", help="player presence history")
+    presence_parser.add_argument("report", choices=["concurrency", "players", "heatmap"])
+    presence_parser.add_argument("--world", type=int, help="world id (default: all realms)")
+    presence_parser.add_argument("--since", default="7d", help="e.g. 30d, 12h or 2026-09-01 (default: 7d)")
+    presence_parser.add_argument("--until", help="same format as --since (default: now)")
+    presence_parser.add_argument("--step", type=int, default=1, help="concurrency bucket in hours (default: 1)")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "monitor":
+        asyncio.run(run_monitor())
+    elif args.command == "presence":
+        presence_report(args.report, args.world, args.since, args.until, args.step)
+    elif args.command == "backup" and args.backup_command == "mirror":
+        asyncio.run(backup_mirror(args.world or REALM_IDS, args.dir))
+    elif args.command == "backup":
+        asyncio.run(backup_pull(args.world or REALM_IDS, args.slot, args.dir))
+    else:
+        asyncio.run(main())
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    cli()
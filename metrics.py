@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# 0 — не поднимать /metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Сколько ждём запрос целиком, прежде чем закрыть соединение
+METRICS_READ_TIMEOUT = float(os.getenv("METRICS_READ_TIMEOUT", "5"))
+# Лимиты на строку запроса/заголовка и на число заголовков
+METRICS_MAX_LINE = 8192
+METRICS_MAX_HEADERS = 100
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Labels:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def remove(self, **labels) -> None:
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Счётчики по корзинам (не накопительные), сумма
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+
+# ---------- METRICS ----------
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "realm_http_request_seconds", "Realms/Xbox/Microsoft request latency per attempt", ("endpoint", "status"),
+))
+DB_QUERIES = registry.register(Counter(
+    "realm_db_queries_total", "DB round-trips", ("statement",),
+))
+DB_QUERY_SECONDS = registry.register(Histogram(
+    "realm_db_query_seconds", "DB round-trip latency", ("statement",),
+))
+TELEGRAM_REQUEST_SECONDS = registry.register(Histogram(
+    "realm_telegram_request_seconds", "Telegram Bot API call latency", ("method",),
+))
+TELEGRAM_RETRY_AFTER = registry.register(Counter(
+    "realm_telegram_retry_after_total", "Telegram 429 (flood control) responses", ("chat",),
+))
+TELEGRAM_COMMANDS_TOTAL = registry.register(Counter(
+    "realm_telegram_commands_total", "Chat commands received", ("command",),
+))
+TOKEN_REFRESHES = registry.register(Counter(
+    "realm_token_refreshes_total", "Auth token refreshes per layer", ("account", "layer", "result"),
+))
+TICK_SECONDS = registry.register(Histogram(
+    "realm_tick_seconds", "Poll tick duration", buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+))
+ONLINE_PLAYERS = registry.register(Gauge(
+    "realm_online_players", "Players online per realm", ("realm",),
+))
+
+
+# ---------- HTTP ----------
+
+async def _read_request_line(reader: asyncio.StreamReader) -> bytes:
+    request_line = await reader.readline()
+    # Заголовки запроса не нужны, но их надо дочитать
+    for _ in range(METRICS_MAX_HEADERS):
+        if not (await reader.readline()).strip():
+            return request_line
+    raise ValueError("Too many request headers")
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        # Медленный или бесконечный запрос не должен держать соединение вечно
+        request_line = await asyncio.wait_for(_read_request_line(reader), METRICS_READ_TIMEOUT)
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+        # ValueError — строка длиннее лимита читателя или слишком много заголовков
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """
+    Serves `GET /metrics` in the Prometheus text format; None when `port` is 0
+    """
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port, limit=METRICS_MAX_LINE)
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,177 @@
+import glob
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from auth.accounts import Credentials
+from auth.minecraft import MinecraftAuth
+from downloader import BACKUP_DIR, PulledBackup, pull_backup
+
+
+MIRROR_WORKERS        = int(os.getenv("MIRROR_WORKERS", "3"))
+# Байт в секунду; 0 — без ограничения
+MIRROR_BANDWIDTH      = int(os.getenv("MIRROR_BANDWIDTH", "0"))
+MIRROR_HOST_BANDWIDTH = int(os.getenv("MIRROR_HOST_BANDWIDTH", "0"))
+
+BACKUP_KEEP_DAILY  = int(os.getenv("BACKUP_KEEP_DAILY", "7"))
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", "4"))
+
+DEFAULT_SLOTS = (1, 2, 3)
+
+
+logger = logging.getLogger(__name__)
+
+
+class Throttle:
+    """
+    Blocking token bucket in bytes per second, shared between threads
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(float(self.rate), self.tokens + (now - self.updated) * self.rate) - size
+            self.updated = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class BandwidthLimiter:
+    def __init__(self, total: int = MIRROR_BANDWIDTH, per_host: int = MIRROR_HOST_BANDWIDTH):
+        self.total = Throttle(total) if total else None
+        self.per_host = per_host
+        self._hosts: Dict[str, Throttle] = {}
+        self._lock = threading.Lock()
+
+    def throttle_for(self, url: str) -> Optional[Callable[[int], None]]:
+        throttles = [self.total] if self.total else []
+        if self.per_host:
+            host = urlparse(url).netloc
+            with self._lock:
+                throttles.append(self._hosts.setdefault(host, Throttle(self.per_host)))
+        if not throttles:
+            return None
+
+        def throttle(size: int) -> None:
+            for t in throttles:
+                t.consume(size)
+
+        return throttle
+
+
+class MirrorJob(NamedTuple):
+    priority: int
+    world_id: int
+    slot: int
+
+
+def plan(world_infos: Dict[int, dict]) -> List[MirrorJob]:
+    """
+    One job per slot of every world: the active slot first, then by slot number
+    """
+    jobs = []
+    for world_id, world_info in world_infos.items():
+        active = world_info.get("activeSlot", 1)
+        slots = [slot["slotId"] for slot in world_info.get("slots") or []] or DEFAULT_SLOTS
+        for slot in slots:
+            jobs.append(MirrorJob(0 if slot == active else slot, world_id, slot))
+    return sorted(jobs)
+
+
+# ---------- RETENTION ----------
+
+def _stamp(path: str) -> datetime:
+    stamp = "-".join(os.path.basename(path).split("-")[:2])
+    return datetime.strptime(stamp, "%Y%m%d-%H%M%S").replace(tzinfo=timezone.utc)
+
+
+def apply_retention(slot_dir: str, keep_daily: int = BACKUP_KEEP_DAILY, keep_weekly: int = BACKUP_KEEP_WEEKLY) -> List[str]:
+    """
+    Keeps the newest archive of each of the last `keep_daily` days and of each
+    of the last `keep_weekly` ISO weeks (the newest archive is always kept).
+    Returns removed paths.
+    """
+    archives = sorted(glob.glob(os.path.join(slot_dir, "*.tar.gz")), key=_stamp, reverse=True)
+    keep = set(archives[:1])
+    days: Dict[str, str] = {}
+    weeks: Dict[tuple, str] = {}
+    for path in archives:
+        stamp = _stamp(path)
+        days.setdefault(stamp.strftime("%Y-%m-%d"), path)
+        weeks.setdefault(stamp.isocalendar()[:2], path)
+    keep.update(list(days.values())[:keep_daily])
+    keep.update(list(weeks.values())[:keep_weekly])
+
+    removed = [path for path in archives if path not in keep]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def collect_garbage(backup_dir: str = BACKUP_DIR) -> int:
+    """
+    Removes objects that are no longer linked from any slot directory
+    """
+    referenced = set()
+    for path in glob.glob(os.path.join(backup_dir, "*", "slot*", "*.tar.gz")):
+        st = os.stat(path)
+        referenced.add((st.st_dev, st.st_ino))
+
+    removed = 0
+    for obj in glob.glob(os.path.join(backup_dir, "objects", "*.tar.gz")):
+        st = os.stat(obj)
+        if (st.st_dev, st.st_ino) not in referenced:
+            os.remove(obj)
+            removed += 1
+    return removed
+
+
+# ---------- MIRROR ----------
+
+def _pull(mc: MinecraftAuth, credentials: Credentials, job: MirrorJob,
+          limiter: BandwidthLimiter, backup_dir: str) -> PulledBackup:
+    # Ссылка подписана и живёт недолго — берём её прямо перед скачиванием
+    last_backup = mc.get_world_last_backup(*credentials, job.world_id, job.slot)
+    url = last_backup["downloadLink"]
+    return pull_backup(url, job.world_id, job.slot, backup_dir, throttle=limiter.throttle_for(url))
+
+
+def mirror(jobs: List[MirrorJob], clients: Dict[int, Tuple[MinecraftAuth, Credentials]],
+           backup_dir: str = BACKUP_DIR, workers: int = MIRROR_WORKERS,
+           limiter: Optional[BandwidthLimiter] = None) -> Dict[MirrorJob, Union[PulledBackup, Exception]]:
+    """
+    Pulls the latest backup for every job with at most `workers` downloads at
+    once, then applies retention and drops unreferenced objects.
+    `clients` maps a world to the auth of the account that owns it.
+    """
+    limiter = limiter or BandwidthLimiter()
+    results: Dict[MirrorJob, Union[PulledBackup, Exception]] = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Пул берёт задачи по порядку, так что приоритет сохраняется
+        futures = {job: pool.submit(_pull, *clients[job.world_id], job, limiter, backup_dir) for job in jobs}
+        for job, future in futures.items():
+            try:
+                results[job] = future.result()
+            except Exception as error:
+                logger.warning("Failed to mirror world %s slot %s: %r", job.world_id, job.slot, error)
+                results[job] = error
+
+    for job in jobs:
+        apply_retention(os.path.join(backup_dir, str(job.world_id), f"slot{job.slot}"))
+    collect_garbage(backup_dir)
+
+    return results
@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+
+from typing import Dict, List, Optional
+
+from auth.accounts import Account, AccountManager, Credentials
+from auth.http_client import close_session
+from auth.realms import AsyncRealmsClient
+from auth.resilience import CircuitOpenError
+from auth.token_store import token_store
+
+from backups import BackupCatalog, migrate_backup_url
+from commands import TELEGRAM_COMMANDS, BotCommands
+from db import dispose_engine, init_db
+from events import EventEngine, SessionStore, sinks_from_env
+from metrics import ONLINE_PLAYERS, TICK_SECONDS, start_server
+from presence import PresenceRecorder
+from scheduler import POLL_INTERVAL, POLL_MIN_INTERVAL, PollScheduler
+from snapshot import STATE_SNAPSHOT_INTERVAL, read_snapshot, write_snapshot
+from tg import SESSION_GRACE_PERIOD, STATUS_MAX_STALENESS, WEEK_SECONDS, close_bot, describe_realm, dump_state, open_sessions, render_status, restore_state, save_playtime
+
+
+# Через запятую; пусто (по умолчанию) — все миры, которыми владеет аккаунт (по /worlds)
+REALM_IDS = [int(world_id) for world_id in os.getenv("REALM_IDS", "").split(",") if world_id.strip()]
+# Сколько секунд показываем последний удачный снимок мира, пока Realms недоступен
+WORLD_STATE_MAX_AGE = float(os.getenv("WORLD_STATE_MAX_AGE", str(STATUS_MAX_STALENESS)))
+
+
+logger = logging.getLogger(__name__)
+
+
+class Monitor:
+    """
+    Keeps the auth chains of all accounts, DB engine and Telegram bot alive between ticks.
+
+    `tick()` is a single poll (what the one-shot script does), `run()` repeats
+    it for the worlds `PollScheduler` says are due until SIGTERM/SIGINT.
+    With `snapshot_path` the state is restored from that file on start and
+    `run()` rewrites it every STATE_SNAPSHOT_INTERVAL seconds.
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = None):
+        init_db()
+        self.snapshot_path = snapshot_path
+        snapshot = read_snapshot(snapshot_path) if snapshot_path else None
+
+        self.accounts = AccountManager.from_env(REALM_IDS)
+        self.realms = AsyncRealmsClient()
+        self.backups = BackupCatalog()
+        self.scheduler = PollScheduler()
+        self.presence = PresenceRecorder()
+
+        # Подписчики получают события по порядку: сначала сессии в БД, потом сообщение в Telegram
+        self.events = EventEngine(int(SESSION_GRACE_PERIOD.total_seconds()))
+        self.events.restore(open_sessions(), snapshot and snapshot.get("events"))
+        self.events.subscribe(SessionStore(WEEK_SECONDS))
+        self.events.subscribe(render_status)
+        for sink in sinks_from_env():
+            self.events.subscribe(sink)
+        self.commands = BotCommands(self.events, self.backups, self.realm_address) if TELEGRAM_COMMANDS else None
+
+        self._online: Dict[int, List[str]] = {}
+        self._polled_at: Dict[int, float] = {}
+        self._credentials: Dict[int, Credentials] = {}
+        self._backups_checked: Dict[int, float] = {}
+        # Аккаунты, чьи миры ещё не найдены: первый тик или авторизация не удалась
+        self._undiscovered: List[Account] = list(self.accounts.accounts)
+        self._discovered_at = 0.0
+        self._snapshot_at = time.time()
+        self._stop = asyncio.Event()
+
+        if snapshot:
+            self._restore(snapshot)
+
+    # ---------- SNAPSHOT ----------
+
+    def _restore(self, snapshot: dict) -> None:
+        # Снимок только ускоряет старт: там, где данные есть и в БД, побеждает БД
+        token_store.load(snapshot.get("tokens", {}))
+        world_ids = self.accounts.load(snapshot.get("accounts", {}))
+        if world_ids is not None:
+            # Миры известны — первый тик обойдётся без /worlds
+            self.scheduler.track(world_ids)
+            self._undiscovered = []
+        self.backups.load(snapshot.get("backups", {}))
+        self._backups_checked.update((int(world_id), at) for world_id, at in snapshot.get("backups_checked", {}).items())
+        self.presence.load(snapshot.get("presence", {}))
+        restore_state(snapshot.get("telegram", {}), int(time.time()))
+
+        polled_at = snapshot.get("events", {}).get("polled_at", {})
+        for world_id, players in self.events.online.items():
+            self._online[world_id] = sorted(players)
+            self._polled_at[world_id] = float(polled_at[str(world_id)])
+            ONLINE_PLAYERS.set(len(players), realm=world_id)
+            if world_id in self.scheduler.worlds:
+                self.scheduler.worlds[world_id].online = frozenset(players)
+        logger.info("Restored state snapshot from %.0fs ago", time.time() - snapshot["written_at"])
+
+    def save_state(self) -> None:
+        """
+        Atomically rewrites the state snapshot (no-op without `snapshot_path`)
+        """
+        if not self.snapshot_path:
+            return
+        try:
+            write_snapshot(self.snapshot_path, {
+                "events": self.events.dump(),
+                "tokens": token_store.dump(),
+                "accounts": self.accounts.dump(),
+                "backups": self.backups.dump(),
+                "backups_checked": {str(world_id): at for world_id, at in self._backups_checked.items()},
+                "presence": self.presence.dump(),
+                "telegram": dump_state(),
+            })
+        except OSError as e:
+            logger.warning("Failed to write state snapshot %s: %r", self.snapshot_path, e)
+        self._snapshot_at = time.time()
+
+    # ---------- POLL ----------
+
+    async def _discover(self, credentials: Dict[Account, Credentials]) -> List[int]:
+        world_ids = await self.accounts.discover(self.realms, credentials)
+        self.scheduler.track(world_ids)
+        if self._discovered_at == 0:
+            # Первый поиск — переносим ссылку на бэкап из версий, где мир был один
+            await asyncio.to_thread(migrate_backup_url, list(self.scheduler.worlds))
+        self._undiscovered = [account for account in self._undiscovered if account not in credentials]
+        self._discovered_at = time.time()
+        return world_ids
+
+    def _world_failed(self, world_id: int, error: Exception) -> None:
+        retry_at = error.retry_at if isinstance(error, CircuitOpenError) else 0.0
+        self.scheduler.failed(world_id, not_before=retry_at)
+
+        # Остаёмся на последнем удачном снимке, но не дольше WORLD_STATE_MAX_AGE —
+        # иначе игроки «висели» бы онлайн, пока Realms лежит
+        age = time.time() - self._polled_at.get(world_id, 0)
+        if world_id in self._online and age > WORLD_STATE_MAX_AGE:
+            del self._online[world_id]
+            self.events.forget(world_id, int(time.time()))
+            ONLINE_PLAYERS.remove(realm=world_id)
+            logger.warning("Failed to fetch world %s: %r; last known state is %.0fs old, dropped", world_id, error, age)
+        elif world_id in self._online:
+            logger.warning("Failed to fetch world %s: %r; serving state from %.0fs ago", world_id, error, age)
+        else:
+            logger.warning("Failed to fetch world %s: %r", world_id, error)
+
+    async def realm_address(self, world_id: int) -> str:
+        """
+        Join address of a polled world (from the Realms response cache while it is fresh)
+        """
+        ip = await self.realms.get_realm_ip(*self._credentials[world_id], world_id)
+        return ip["address"]
+
+    async def tick(self, world_ids: Optional[List[int]] = None) -> None:
+        """
+        Polls `world_ids` (all tracked worlds by default) and reschedules them
+        """
+        with TICK_SECONDS.time():
+            await self._tick(world_ids)
+
+    async def _tick(self, world_ids: Optional[List[int]]) -> None:
+        # Авторизация синхронная (requests) — аккаунты авторизуются параллельно в потоках
+        if world_ids is None:
+            credentials = await self.accounts.authorize()
+            if not credentials:
+                raise RuntimeError("No account could be authorized")
+            world_ids = await self._discover(credentials)
+        else:
+            credentials = await self.accounts.authorize(self.accounts.group(world_ids))
+            if self._undiscovered and time.time() - self._discovered_at >= POLL_INTERVAL:
+                # Аккаунт, не авторизовавшийся при старте, ещё не нашёл свои миры
+                retried = await self.accounts.authorize(self._undiscovered)
+                credentials.update(retried)
+                world_ids = world_ids + await self._discover(retried)
+
+        groups = self.accounts.group(world_ids)
+        for account in [account for account in groups if account not in credentials]:
+            # Миры неавторизованного аккаунта не опрашиваем — как при ошибке Realms
+            for world_id in groups.pop(account):
+                self._world_failed(world_id, RuntimeError(f"account {account.name or 'default'!r} is not authorized"))
+        world_credentials = {
+            world_id: credentials[account]
+            for account, account_world_ids in groups.items()
+            for world_id in account_world_ids
+        }
+        self._credentials.update(world_credentials)
+
+        infos = await asyncio.gather(
+            *(self.realms.get_worlds_info(*credentials[account], account_world_ids) for account, account_world_ids in groups.items())
+        )
+
+        polled: Dict[int, int] = {}
+        for world_id, world_info in (item for info in infos for item in info.items()):
+            if isinstance(world_info, Exception):
+                self._world_failed(world_id, world_info)
+                continue
+            self._online[world_id] = sorted([player["name"] for player in world_info["players"] if player["online"]])
+            self._polled_at[world_id] = time.time()
+            self.presence.record(world_id, self._online[world_id], int(self._polled_at[world_id]))
+            self.events.observe(world_id, self._online[world_id], int(self._polled_at[world_id]))
+            describe_realm(world_id, world_info.get("name"), (player["name"] for player in world_info["players"]))
+            ONLINE_PLAYERS.set(len(self._online[world_id]), realm=world_id)
+            polled[world_id] = world_info.get("activeSlot", 1)
+            interval = self.scheduler.update(world_id, world_info)
+            print(f"=== world {world_id} (next poll in {interval:.0f}s) ===")
+            print(self._online[world_id])
+
+        await self.presence.maybe_flush(int(time.time()))
+
+        # Сессии и сообщение в Telegram обновляются по событиям входа/выхода
+        await self.events.publish(int(time.time()))
+
+        # Бэкапы меняются редко — проверяем не чаще раза в POLL_INTERVAL
+        now = time.time()
+        backup_worlds = [
+            world_id for world_id in polled
+            if now - self._backups_checked.get(world_id, 0) >= POLL_INTERVAL
+        ]
+        new_backups = await asyncio.gather(
+            *(
+                self.backups.refresh(self.realms, *world_credentials[world_id], world_id, polled[world_id])
+                for world_id in backup_worlds
+            ),
+            return_exceptions=True,
+        )
+        for world_id, new_backup in zip(backup_worlds, new_backups):
+            if isinstance(new_backup, Exception):
+                logger.warning("Failed to refresh backups of world %s: %r", world_id, new_backup)
+                continue
+            self._backups_checked[world_id] = now
+            if new_backup:
+                print(f"New backup of world {world_id}: {new_backup['backup_id']}")
+
+    # ---------- DAEMON ----------
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        metrics_server = await start_server()
+        if self.commands is not None:
+            await self.commands.start()
+        refreshers: List[asyncio.Task] = []
+        try:
+            while not self._stop.is_set():
+                # Первый тик опрашивает все миры, дальше — только те, чья очередь подошла
+                world_ids = self.scheduler.due() if self.scheduler.worlds else None
+                delay = 1.0
+                if world_ids != []:
+                    try:
+                        await self.tick(world_ids)
+                        if not self.scheduler.worlds:
+                            # Опрашивать нечего — повторяем поиск миров не чаще раза в POLL_INTERVAL
+                            logger.warning("No realms to poll; looking again in %.0fs", POLL_INTERVAL)
+                            delay = POLL_INTERVAL
+                        if not refreshers:
+                            # Запускаем после первого тика: интерактивный логин, если нужен, уже прошёл
+                            refreshers = [
+                                asyncio.create_task(account.refresher.run(self._stop))
+                                for account in self.accounts.accounts
+                            ]
+                    except Exception:
+                        # Один неудачный тик не должен ронять демона
+                        logger.exception("Poll tick failed")
+                        delay = POLL_MIN_INTERVAL
+                if time.time() - self._snapshot_at >= STATE_SNAPSHOT_INTERVAL:
+                    self.save_state()
+
+                next_wakeup = self.scheduler.next_wakeup()
+                if next_wakeup is not None:
+                    delay = max(next_wakeup - time.time(), delay)
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Цикл мог выйти и по исключению/отмене — рефрешеры ждут именно _stop
+            self._stop.set()
+            await asyncio.gather(*refreshers, return_exceptions=True)
+            if self.commands is not None:
+                await self.commands.stop()
+            if metrics_server is not None:
+                metrics_server.close()
+                await metrics_server.wait_closed()
+            self.save_state()
+            await self.close()
+
+    async def close(self) -> None:
+        await close_bot()
+        # Подписчики с ресурсами (файл, HTTP-клиент, очередь) закрываются сами
+        await asyncio.gather(*(subscriber.close() for subscriber in self.events.subscribers if hasattr(subscriber, "close")))
+        await self.realms.close()
+        close_session()
+        self.presence.flush()
+        save_playtime()
+        dispose_engine()
@@ -0,0 +1,172 @@
+import heapq
+import json
+
+from typing import Dict, Iterable, List, Optional, Tuple, TypedDict
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from db import ActiveSession, PlayInterval, SessionLocal, upsert
+
+
+class PlayerSession(TypedDict):
+    started_at: int
+    last_seen: int
+
+
+def load_sessions() -> Dict[str, PlayerSession]:
+    with SessionLocal() as session:
+        rows = session.execute(select(ActiveSession.player, ActiveSession.started_at, ActiveSession.last_seen))
+        return {player: {"started_at": started_at, "last_seen": last_seen} for player, started_at, last_seen in rows}
+
+
+def upsert_sessions(session: Session, sessions: Dict[str, PlayerSession]) -> None:
+    upsert(
+        session,
+        ActiveSession,
+        [{"player": player, **data} for player, data in sessions.items()],
+        "started_at",
+        "last_seen",
+    )
+
+
+def add_intervals(session: Session, intervals: Iterable[Tuple[str, int, int]]) -> None:
+    """
+    Appends (player, start_ts, duration) intervals within `session`; empty ones are skipped
+    """
+    rows: List[dict] = [
+        {"player": player, "start_ts": start_ts, "duration": duration}
+        for player, start_ts, duration in intervals
+        if duration > 0
+    ]
+    if rows:
+        session.execute(PlayInterval.__table__.insert(), rows)
+
+
+def store_sessions(touched: Dict[str, PlayerSession], closed: Dict[str, PlayerSession], prune_before: int) -> None:
+    """
+    One transaction per tick:
+    - upserts sessions of players seen this tick,
+    - turns closed sessions into play intervals (INSERT + DELETE by key),
+    - drops intervals that started before `prune_before` (ranged DELETE).
+    """
+    with SessionLocal() as session:
+        upsert_sessions(session, touched)
+
+        if closed:
+            add_intervals(session, (
+                (player, data["started_at"], data["last_seen"] - data["started_at"])
+                for player, data in closed.items()
+            ))
+            session.execute(delete(ActiveSession).where(ActiveSession.player.in_(list(closed))))
+
+        session.execute(delete(PlayInterval).where(PlayInterval.start_ts < prune_before))
+        session.commit()
+
+
+def intervals_after(last_id: int) -> List[Tuple[int, str, int, int]]:
+    """
+    (id, player, start_ts, duration) of intervals appended after `last_id`
+    """
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(PlayInterval.id, PlayInterval.player, PlayInterval.start_ts, PlayInterval.duration)
+            .where(PlayInterval.id > last_id)
+            .order_by(PlayInterval.id)
+        )
+        return [tuple(row) for row in rows]
+
+
+class RollingPlaytime:
+    """
+    Per-player playtime over the last `window` seconds, kept up to date incrementally.
+
+    Closed intervals are added once (`sync` reads only rows appended since
+    `last_id`) and subtracted when their start leaves the window, so a tick
+    costs O(changes) instead of a scan of the whole week.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.totals: Dict[str, int] = {}
+        self.last_id = 0
+        self._heap: List[Tuple[int, str, int]] = []
+
+    def add(self, player: str, start_ts: int, duration: int) -> None:
+        if duration <= 0:
+            return
+        heapq.heappush(self._heap, (start_ts, player, duration))
+        self.totals[player] = self.totals.get(player, 0) + duration
+
+    def expire(self, now_ts: int) -> bool:
+        cutoff = now_ts - self.window
+        changed = False
+        while self._heap and self._heap[0][0] < cutoff:
+            _, player, duration = heapq.heappop(self._heap)
+            total = self.totals[player] - duration
+            if total > 0:
+                self.totals[player] = total
+            else:
+                del self.totals[player]
+            changed = True
+        return changed
+
+    def apply(self, rows: List[Tuple[int, str, int, int]], now_ts: int) -> bool:
+        """
+        Adds rows from `intervals_after(self.last_id)` and drops expired ones.
+        Returns True if the totals changed.
+        """
+        cutoff = now_ts - self.window
+        for interval_id, player, start_ts, duration in rows:
+            if start_ts >= cutoff:
+                self.add(player, start_ts, duration)
+            self.last_id = interval_id
+        return self.expire(now_ts) or bool(rows)
+
+    def sync(self, now_ts: int) -> bool:
+        """
+        Picks up intervals written since the last sync and drops expired ones
+        """
+        return self.apply(intervals_after(self.last_id), now_ts)
+
+    def weekly(self, sessions: Dict[str, PlayerSession], now_ts: int) -> Dict[str, int]:
+        """
+        Window totals plus the part of live sessions that is inside the window.
+        Live sessions are credited up to `last_seen`, not `now`, so the grace
+        period after a player leaves is not counted.
+        """
+        cutoff = now_ts - self.window
+        weekly = dict(self.totals)
+        for name, session in sessions.items():
+            played = session["last_seen"] - max(session["started_at"], cutoff)
+            if played > 0:
+                weekly[name] = weekly.get(name, 0) + played
+        return weekly
+
+    # ---------- CHECKPOINT ----------
+
+    def dump(self) -> str:
+        # Компактно: имена игроков один раз, в записях — индексы
+        players = sorted({player for _, player, _ in self._heap})
+        index = {player: i for i, player in enumerate(players)}
+        return json.dumps({
+            "last_id": self.last_id,
+            "players": players,
+            "entries": [[start_ts, index[player], duration] for start_ts, player, duration in self._heap],
+        }, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, raw: Optional[str], window: int) -> "RollingPlaytime":
+        aggregator = cls(window)
+        if not raw:
+            return aggregator
+        try:
+            data = json.loads(raw)
+            players = data["players"]
+            for start_ts, player, duration in data["entries"]:
+                aggregator.add(players[player], start_ts, duration)
+            aggregator.last_id = int(data["last_id"])
+        except (ValueError, KeyError, IndexError, TypeError):
+            # Битый checkpoint — пересоберём из таблицы
+            return cls(window)
+        return aggregator
@@ -0,0 +1,384 @@
+import asyncio
+import os
+
+from typing import Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, select
+
+from db import PresenceDay, PresenceHour, PresenceMinutes, SessionLocal, get_setting, set_setting, upsert
+
+
+# Сырые минутные данные храним столько дней, старше — только свёртки по часам и дням
+PRESENCE_RAW_DAYS       = int(os.getenv("PRESENCE_RAW_DAYS", "90"))
+# Игрок, которого видели в двух опросах с промежутком не больше этого, считается онлайн и между ними
+PRESENCE_MAX_GAP        = int(os.getenv("PRESENCE_MAX_GAP", "300"))
+PRESENCE_FLUSH_INTERVAL = int(os.getenv("PRESENCE_FLUSH_INTERVAL", "300"))
+PRESENCE_COMPACT_INTERVAL = 6 * 3600
+
+PRESENCE_COMPACTED_KEY = "presence_compacted_until"
+
+ALL_REALMS = 0
+HOUR = 3600
+DAY = 24 * HOUR
+
+Key = Tuple[int, int, str]
+
+
+def _hour(ts: int) -> int:
+    return ts - ts % HOUR
+
+
+def _minute_mask(start_ts: int, end_ts: int, hour_ts: int) -> int:
+    """
+    Bits of the minutes of `hour_ts` that overlap [start_ts, end_ts)
+    """
+    first = max(start_ts, hour_ts)
+    last = min(end_ts, hour_ts + HOUR) - 1
+    if first > last:
+        return 0
+    a, b = (first - hour_ts) // 60, (last - hour_ts) // 60
+    return ((1 << (b - a + 1)) - 1) << a
+
+
+def _popcount(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+# ---------- RECORDING ----------
+
+def _write_minutes(rows: List[dict]) -> None:
+    if not rows:
+        return
+    with SessionLocal() as session:
+        upsert(session, PresenceMinutes, rows, "minutes")
+        session.commit()
+
+
+class PresenceRecorder:
+    """
+    Turns every world poll into per-minute presence bits.
+
+    Bits of the current hours are kept in memory and upserted at most every
+    `flush_interval` seconds. A row is one (realm, hour, player) with a 60-bit
+    mask, so an hour of play costs 8 bytes however often the realm is polled.
+    """
+
+    def __init__(self, max_gap: int = PRESENCE_MAX_GAP, flush_interval: int = PRESENCE_FLUSH_INTERVAL):
+        self.max_gap = max_gap
+        self.flush_interval = flush_interval
+        self._masks: Dict[Key, int] = {}
+        self._loaded: Set[Tuple[int, int]] = set()
+        self._dirty: Set[Key] = set()
+        self._last_seen: Dict[int, Dict[str, int]] = {}
+        self._flushed_at = 0
+        self._compacted_at = 0
+
+    def _load_hour(self, realm_id: int, hour_ts: int) -> None:
+        # Час мог начаться в другом процессе (one-shot режим) — дописываем к сохранённому
+        if (realm_id, hour_ts) in self._loaded:
+            return
+        with SessionLocal() as session:
+            rows = session.execute(
+                select(PresenceMinutes.player, PresenceMinutes.minutes)
+                .where(PresenceMinutes.realm_id == realm_id, PresenceMinutes.hour_ts == hour_ts)
+            )
+            for player, minutes in rows:
+                key = (realm_id, hour_ts, player)
+                self._masks[key] = self._masks.get(key, 0) | minutes
+        self._loaded.add((realm_id, hour_ts))
+
+    def _mark(self, realm_id: int, player: str, start_ts: int, end_ts: int) -> None:
+        for hour_ts in range(_hour(start_ts), end_ts + 1, HOUR):
+            mask = _minute_mask(start_ts, end_ts + 1, hour_ts)
+            if not mask:
+                continue
+            self._load_hour(realm_id, hour_ts)
+            key = (realm_id, hour_ts, player)
+            merged = self._masks.get(key, 0) | mask
+            if merged != self._masks.get(key):
+                self._masks[key] = merged
+                self._dirty.add(key)
+
+    def record(self, realm_id: int, players: Iterable[str], now_ts: int) -> None:
+        last_seen = self._last_seen.get(realm_id, {})
+        seen = {}
+        for player in players:
+            last = last_seen.get(player)
+            start_ts = last if last is not None and now_ts - last <= self.max_gap else now_ts
+            self._mark(realm_id, player, start_ts, now_ts)
+            seen[player] = now_ts
+        self._last_seen[realm_id] = seen
+
+    def _take_dirty(self) -> List[dict]:
+        rows = [
+            {"realm_id": realm_id, "hour_ts": hour_ts, "player": player, "minutes": self._masks[(realm_id, hour_ts, player)]}
+            for realm_id, hour_ts, player in self._dirty
+        ]
+        self._dirty.clear()
+        return rows
+
+    def _untake(self, rows: List[dict]) -> None:
+        # Запись не удалась — минуты уйдут со следующим flush
+        self._dirty.update((row["realm_id"], row["hour_ts"], row["player"]) for row in rows)
+
+    def _prune(self, now_ts: int) -> None:
+        self._flushed_at = now_ts
+        # Закрытые часы больше не меняются — держим в памяти только текущий и предыдущий
+        keep_from = _hour(now_ts) - HOUR
+        self._masks = {key: mask for key, mask in self._masks.items() if key[1] >= keep_from}
+        self._loaded = {key for key in self._loaded if key[1] >= keep_from}
+
+    def flush(self, now_ts: Optional[int] = None) -> None:
+        rows = self._take_dirty()
+        try:
+            _write_minutes(rows)
+        except Exception:
+            self._untake(rows)
+            raise
+        if now_ts is not None:
+            self._prune(now_ts)
+
+    def dump(self) -> dict:
+        return {
+            "dirty": [[realm_id, hour_ts, player, self._masks[(realm_id, hour_ts, player)]] for realm_id, hour_ts, player in sorted(self._dirty)],
+            "last_seen": {str(realm_id): seen for realm_id, seen in self._last_seen.items()},
+        }
+
+    def load(self, data: dict) -> None:
+        """
+        Restores unflushed minutes and last sightings from `dump()`. Saved
+        masks are merged with what is already stored for their hours, so the
+        next flush doesn't overwrite minutes written by another process.
+        """
+        for realm_id, hour_ts, player, mask in data.get("dirty", []):
+            self._load_hour(realm_id, hour_ts)
+            key = (realm_id, hour_ts, player)
+            self._masks[key] = self._masks.get(key, 0) | mask
+            self._dirty.add(key)
+        for realm_id, seen in data.get("last_seen", {}).items():
+            self._last_seen.setdefault(int(realm_id), seen)
+
+    async def maybe_flush(self, now_ts: int) -> None:
+        """
+        Flushes and compacts when their intervals are due. Dirty masks are taken
+        on the loop, the queries run in a worker thread so polling isn't blocked.
+        """
+        if now_ts - self._flushed_at >= self.flush_interval:
+            rows = self._take_dirty()
+            try:
+                await asyncio.to_thread(_write_minutes, rows)
+            except Exception:
+                self._untake(rows)
+                raise
+            self._prune(now_ts)
+        if now_ts - self._compacted_at >= PRESENCE_COMPACT_INTERVAL:
+            await asyncio.to_thread(compact, now_ts)
+            self._compacted_at = now_ts
+
+
+# ---------- ROLLUPS ----------
+
+def compacted_until() -> int:
+    """
+    Hours before this are only in the rollup tables
+    """
+    return int(get_setting(PRESENCE_COMPACTED_KEY) or 0)
+
+
+def _minute_counts(rows: Iterable[Tuple[int, int, str, int]], start_ts: int, end_ts: int) -> Dict[Tuple[int, int], List[int]]:
+    """
+    (realm, hour) → number of players online in each minute, limited to [start_ts, end_ts)
+    """
+    counts: Dict[Tuple[int, int], List[int]] = {}
+    for realm_id, hour_ts, _, minutes in rows:
+        minutes &= _minute_mask(start_ts, end_ts, hour_ts)
+        if not minutes:
+            continue
+        hour = counts.setdefault((realm_id, hour_ts), [0] * 60)
+        minute = 0
+        while minutes:
+            if minutes & 1:
+                hour[minute] += 1
+            minutes >>= 1
+            minute += 1
+    return counts
+
+
+def _union_realms(rows: Iterable[Tuple[int, int, str, int]]) -> List[Tuple[int, int, str, int]]:
+    """
+    Rows merged into ALL_REALMS: a player's minutes in several realms are OR-ed,
+    so someone online in two realms at once is counted once
+    """
+    masks: Dict[Tuple[int, str], int] = {}
+    for _, hour_ts, player, minutes in rows:
+        masks[(hour_ts, player)] = masks.get((hour_ts, player), 0) | minutes
+    return [(ALL_REALMS, hour_ts, player, minutes) for (hour_ts, player), minutes in masks.items()]
+
+
+def compact(now_ts: int, keep_days: int = PRESENCE_RAW_DAYS) -> int:
+    """
+    Rolls raw minutes older than `keep_days` up into hourly (per realm and
+    for all realms) and daily per-player totals, one day per transaction, and
+    deletes them. Returns the number of compacted days.
+    """
+    boundary = (now_ts - keep_days * DAY) // DAY * DAY
+    day_ts = compacted_until()
+    if day_ts >= boundary:
+        return 0
+    if not day_ts:
+        with SessionLocal() as session:
+            oldest = session.scalar(select(PresenceMinutes.hour_ts).order_by(PresenceMinutes.hour_ts).limit(1))
+        if oldest is None:
+            set_setting(PRESENCE_COMPACTED_KEY, str(boundary))
+            return 0
+        day_ts = oldest // DAY * DAY
+
+    days = 0
+    while day_ts < boundary:
+        with SessionLocal() as session:
+            rows = session.execute(
+                select(PresenceMinutes.realm_id, PresenceMinutes.hour_ts, PresenceMinutes.player, PresenceMinutes.minutes)
+                .where(PresenceMinutes.hour_ts >= day_ts, PresenceMinutes.hour_ts < day_ts + DAY)
+            ).all()
+
+            totals = _minute_counts(rows, day_ts, day_ts + DAY)
+            totals.update(_minute_counts(_union_realms(rows), day_ts, day_ts + DAY))
+            upsert(session, PresenceHour, [
+                {"realm_id": realm_id, "hour_ts": hour_ts, "peak": max(counts), "player_minutes": sum(counts)}
+                for (realm_id, hour_ts), counts in totals.items()
+            ], "peak", "player_minutes")
+
+            daily: Dict[Tuple[int, str], int] = {}
+            for realm_id, _, player, minutes in rows:
+                daily[(realm_id, player)] = daily.get((realm_id, player), 0) + _popcount(minutes)
+            upsert(session, PresenceDay, [
+                {"realm_id": realm_id, "day_ts": day_ts, "player": player, "minutes": minutes}
+                for (realm_id, player), minutes in daily.items()
+            ], "minutes")
+
+            session.execute(delete(PresenceMinutes).where(PresenceMinutes.hour_ts >= day_ts, PresenceMinutes.hour_ts < day_ts + DAY))
+            session.commit()
+        day_ts += DAY
+        days += 1
+        set_setting(PRESENCE_COMPACTED_KEY, str(day_ts))
+    return days
+
+
+# ---------- QUERIES ----------
+
+def _raw_rows(start_ts: int, end_ts: int, realm_ids: Optional[Collection[int]]) -> List[Tuple[int, int, str, int]]:
+    if start_ts >= end_ts:
+        return []
+    query = select(PresenceMinutes.realm_id, PresenceMinutes.hour_ts, PresenceMinutes.player, PresenceMinutes.minutes).where(
+        PresenceMinutes.hour_ts >= _hour(start_ts), PresenceMinutes.hour_ts < end_ts,
+    )
+    if realm_ids is not None:
+        query = query.where(PresenceMinutes.realm_id.in_(realm_ids))
+    with SessionLocal() as session:
+        return [tuple(row) for row in session.execute(query)]
+
+
+def hourly(start_ts: int, end_ts: int, realm_id: Optional[int] = None) -> Dict[int, Tuple[int, int]]:
+    """
+    hour → (peak concurrent players, player-minutes) for hours with any presence.
+    Without `realm_id` the counts cover all realms, each player counted once a minute.
+    """
+    boundary = compacted_until()
+    result: Dict[int, Tuple[int, int]] = {}
+
+    if start_ts < boundary:
+        with SessionLocal() as session:
+            rows = session.execute(
+                select(PresenceHour.hour_ts, PresenceHour.peak, PresenceHour.player_minutes).where(
+                    PresenceHour.realm_id == (ALL_REALMS if realm_id is None else realm_id),
+                    PresenceHour.hour_ts >= _hour(start_ts),
+                    PresenceHour.hour_ts < min(end_ts, boundary),
+                )
+            )
+            result.update({hour_ts: (peak, player_minutes) for hour_ts, peak, player_minutes in rows})
+
+    raw_start = max(start_ts, boundary)
+    if realm_id is None:
+        rows = _union_realms(_raw_rows(raw_start, end_ts, None))
+    else:
+        rows = _raw_rows(raw_start, end_ts, [realm_id])
+    for (_, hour_ts), counts in _minute_counts(rows, raw_start, end_ts).items():
+        result[hour_ts] = (max(counts), sum(counts))
+    return result
+
+
+def concurrency(start_ts: int, end_ts: int, realm_id: Optional[int] = None,
+                step: int = HOUR) -> List[Tuple[int, int, float]]:
+    """
+    (bucket start, peak, average concurrent players) for every `step`-long
+    bucket (a multiple of an hour) in [start_ts, end_ts)
+    """
+    start_ts = _hour(start_ts)
+    step = max(step // HOUR, 1) * HOUR
+    buckets = {bucket: [0, 0] for bucket in range(start_ts, end_ts, step)}
+    for hour_ts, (peak, player_minutes) in hourly(start_ts, end_ts, realm_id).items():
+        bucket = buckets[start_ts + (hour_ts - start_ts) // step * step]
+        bucket[0] = max(bucket[0], peak)
+        bucket[1] += player_minutes
+    return [
+        (bucket_ts, peak, player_minutes / (min(step, end_ts - bucket_ts) / 60))
+        for bucket_ts, (peak, player_minutes) in buckets.items()
+    ]
+
+
+def player_totals(start_ts: int, end_ts: int, realm_ids: Optional[Collection[int]] = None) -> Dict[str, int]:
+    """
+    Seconds played per player in [start_ts, end_ts) in `realm_ids` (all
+    realms by default). A minute in several realms at once counts once.
+    Ranges older than PRESENCE_RAW_DAYS are counted in whole UTC days and
+    summed over realms, since the daily rollup has no minutes to merge.
+    """
+    boundary = compacted_until()
+    totals: Dict[str, int] = {}
+
+    if start_ts < boundary:
+        query = select(PresenceDay.player, PresenceDay.minutes).where(
+            PresenceDay.day_ts >= start_ts // DAY * DAY, PresenceDay.day_ts < min(end_ts, boundary),
+        )
+        if realm_ids is not None:
+            query = query.where(PresenceDay.realm_id.in_(realm_ids))
+        with SessionLocal() as session:
+            for player, minutes in session.execute(query):
+                totals[player] = totals.get(player, 0) + minutes * 60
+
+    raw_start = max(start_ts, boundary)
+    # Маски одного часа из разных миров объединяем, чтобы не считать минуту дважды
+    masks: Dict[Tuple[int, str], int] = {}
+    for _, hour_ts, player, minutes in _raw_rows(raw_start, end_ts, realm_ids):
+        masks[(hour_ts, player)] = masks.get((hour_ts, player), 0) | (minutes & _minute_mask(raw_start, end_ts, hour_ts))
+    for (_, player), minutes in masks.items():
+        if minutes:
+            totals[player] = totals.get(player, 0) + _popcount(minutes) * 60
+    return totals
+
+
+def heatmap(start_ts: int, end_ts: int, realm_id: Optional[int] = None, utc_offset: int = 3) -> List[List[float]]:
+    """
+    Average concurrent players by weekday (Monday first) and local hour,
+    `utc_offset` hours from UTC (Moscow by default)
+    """
+    start_ts = _hour(start_ts)
+    player_minutes = [[0] * 24 for _ in range(7)]
+    hours = [[0] * 24 for _ in range(7)]
+
+    def cell(hour_ts: int) -> Tuple[int, int]:
+        local = hour_ts + utc_offset * HOUR
+        # 1970-01-01 — четверг
+        return (local // DAY + 3) % 7, local % DAY // HOUR
+
+    for hour_ts in range(start_ts, end_ts, HOUR):
+        weekday, hour = cell(hour_ts)
+        hours[weekday][hour] += 1
+    for hour_ts, (_, minutes) in hourly(start_ts, end_ts, realm_id).items():
+        weekday, hour = cell(hour_ts)
+        player_minutes[weekday][hour] += minutes
+
+    return [
+        [player_minutes[weekday][hour] / (hours[weekday][hour] * 60) if hours[weekday][hour] else 0.0 for hour in range(24)]
+        for weekday in range(7)
+    ]
@@ -0,0 +1,96 @@
+import os
+import random
+import time
+
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from tg import SESSION_GRACE_PERIOD
+
+
+POLL_INTERVAL     = float(os.getenv("POLL_INTERVAL", "60"))
+POLL_JITTER       = float(os.getenv("POLL_JITTER", "5"))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "20"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "900"))
+# Во сколько раз растёт интервал за каждый пустой опрос
+POLL_IDLE_BACKOFF = float(os.getenv("POLL_IDLE_BACKOFF", "1.5"))
+
+INACTIVE_STATES = {"CLOSED", "UNINITIALIZED"}
+
+
+@dataclass
+class WorldSchedule:
+    interval: float
+    next_at: float
+    online: FrozenSet[str] = field(default_factory=frozenset)
+    grace_until: float = 0.0
+    # Сдвиг первого повторного опроса, чтобы миры не опрашивались в такт
+    offset: float = 0.0
+
+
+class PollScheduler:
+    """
+    Per-world poll times that follow realm activity.
+
+    Polls fast while players join/leave or a session is still inside
+    SESSION_GRACE_PERIOD, at POLL_INTERVAL while someone is online, and backs
+    off up to POLL_MAX_INTERVAL when a realm is empty, closed or expired.
+    New worlds get spread-out first poll times so they don't fire together.
+    """
+
+    def __init__(self, interval: float = POLL_INTERVAL, jitter: float = POLL_JITTER,
+                 min_interval: float = POLL_MIN_INTERVAL, max_interval: float = POLL_MAX_INTERVAL):
+        self.interval = interval
+        self.jitter = jitter
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.worlds: Dict[int, WorldSchedule] = {}
+
+    def _next_at(self, now: float, interval: float) -> float:
+        return now + max(interval + random.uniform(-self.jitter, self.jitter), 0)
+
+    def track(self, world_ids: Iterable[int], now: Optional[float] = None) -> None:
+        now = now if now is not None else time.time()
+        new = [world_id for world_id in world_ids if world_id not in self.worlds]
+        for i, world_id in enumerate(new):
+            # Разносим опросы равномерно по интервалу
+            self.worlds[world_id] = WorldSchedule(self.interval, now, offset=self.interval * i / len(new))
+
+    def due(self, now: Optional[float] = None) -> List[int]:
+        now = now if now is not None else time.time()
+        return [world_id for world_id, schedule in self.worlds.items() if schedule.next_at <= now]
+
+    def next_wakeup(self) -> Optional[float]:
+        return min((schedule.next_at for schedule in self.worlds.values()), default=None)
+
+    def update(self, world_id: int, world_info: dict, now: Optional[float] = None) -> float:
+        now = now if now is not None else time.time()
+        schedule = self.worlds.setdefault(world_id, WorldSchedule(self.interval, now))
+
+        online = frozenset(player["name"] for player in world_info.get("players") or [] if player["online"])
+        if schedule.online - online:
+            # Кто-то вышел — сессия может закрыться в пределах grace period
+            schedule.grace_until = now + SESSION_GRACE_PERIOD.total_seconds()
+
+        if world_info.get("expired") or world_info.get("state") in INACTIVE_STATES:
+            interval = self.max_interval
+        elif online != schedule.online or now < schedule.grace_until:
+            interval = self.min_interval
+        elif online:
+            interval = self.interval
+        else:
+            interval = min(max(schedule.interval, self.interval) * POLL_IDLE_BACKOFF, self.max_interval)
+
+        schedule.online = online
+        schedule.interval = interval
+        schedule.next_at = self._next_at(now, interval) + schedule.offset
+        schedule.offset = 0.0
+        return interval
+
+    def failed(self, world_id: int, now: Optional[float] = None, not_before: float = 0.0) -> float:
+        now = now if now is not None else time.time()
+        schedule = self.worlds.setdefault(world_id, WorldSchedule(self.interval, now))
+        schedule.interval = min(schedule.interval * 2, self.max_interval)
+        # Пока breaker открыт, опрашивать мир бессмысленно
+        schedule.next_at = max(self._next_at(now, schedule.interval), not_before)
+        return schedule.interval
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import time
+
+from typing import Optional
+
+
+# Путь к снимку состояния (в нём токены); пусто (по умолчанию) — без снимка
+STATE_SNAPSHOT = os.getenv("STATE_SNAPSHOT", "")
+STATE_SNAPSHOT_INTERVAL = int(os.getenv("STATE_SNAPSHOT_INTERVAL", "60"))
+
+SNAPSHOT_VERSION = 1
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path: str, data: str) -> None:
+    """
+    Replaces `path` with `data` so that a crash leaves either the old
+    content or the new one, never a truncated file. The file is readable
+    by the owner only: both callers keep tokens in it.
+    """
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # Режим из os.open применяется только к новому файлу, а .tmp мог остаться от прошлого сбоя
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # Переименование переживёт сбой питания, только если сохранён и каталог
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def write_snapshot(path: str, state: dict) -> None:
+    """
+    Atomically replaces `path` with `state` as JSON (see `write_atomic`)
+    """
+    data = json.dumps({"version": SNAPSHOT_VERSION, "written_at": int(time.time()), **state}, separators=(",", ":"))
+    write_atomic(path, data)
+
+
+def read_snapshot(path: str) -> Optional[dict]:
+    """
+    The snapshot at `path`; None if there is none or it can't be used
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable state snapshot %s: %r", path, e)
+        return None
+    if not isinstance(state, dict) or state.get("version") != SNAPSHOT_VERSION:
+        logger.warning("Ignoring state snapshot %s of an unknown version", path)
+        return None
+    return state
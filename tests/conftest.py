@@ -0,0 +1,25 @@
+import os
+import sys
+
+# Модули проекта лежат в корне репозитория; конфиг читается при импорте
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["SETTINGS_BACKEND"] = "memory"
+os.environ.setdefault("TELEGRAM_CHAT_ID", "1")
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def database():
+    """
+    A fresh in-memory database and settings store for one test
+    """
+    db.dispose_engine()
+    db._settings_store = None
+    db.init_db()
+    yield
+    db.dispose_engine()
+    db._settings_store = None
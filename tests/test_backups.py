@@ -0,0 +1,31 @@
+import asyncio
+
+from backups import LAST_BACKUP_URL, BackupCatalog, backup_url_key, migrate_backup_url
+from db import get_setting, set_setting
+
+
+class FakeRealms:
+    async def get_world_backups(self, mc_token, uuid, name, world_id):
+        return {"backups": [{"backupId": "b1", "lastModifiedDate": 1_700_000_000_000, "size": 10}]}
+
+    async def get_world_last_backup(self, mc_token, uuid, name, world_id, slot):
+        return {"downloadLink": f"https://example.invalid/{world_id}"}
+
+
+def test_download_link_is_stored_per_world_even_for_a_single_world(database):
+    catalog = BackupCatalog()
+    new = asyncio.run(catalog.refresh(FakeRealms(), "token", "uuid", "name", 7, 1))
+    assert new["backup_id"] == "b1"
+    assert get_setting(backup_url_key(7)) == "https://example.invalid/7"
+    assert get_setting(LAST_BACKUP_URL) is None
+    assert asyncio.run(catalog.refresh(FakeRealms(), "token", "uuid", "name", 7, 1)) is None
+
+
+def test_legacy_link_moves_to_the_only_world(database):
+    set_setting(LAST_BACKUP_URL, "https://example.invalid/old")
+    migrate_backup_url([7, 8])
+    assert get_setting(LAST_BACKUP_URL) == "https://example.invalid/old"
+
+    migrate_backup_url([7])
+    assert get_setting(backup_url_key(7)) == "https://example.invalid/old"
+    assert get_setting(LAST_BACKUP_URL) is None
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+import delivery
+
+from delivery import DeliveryQueue, TokenBucket
+
+
+def test_bucket_lets_a_burst_through_then_paces_at_the_rate():
+    async def run():
+        bucket = TokenBucket(rate=50, capacity=2)
+        started = time.monotonic()
+        for _ in range(2):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        for _ in range(3):
+            await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(run())
+    assert burst < 0.02
+    # Три запроса сверх ёмкости — не быстрее 3 / 50 с
+    assert total >= 0.055
+
+
+def test_pending_updates_of_one_key_are_coalesced():
+    async def run():
+        queue = DeliveryQueue(workers=1)
+        sent = []
+        for version in range(5):
+            queue.submit("status:1:dashboard", "1", lambda version=version: _record(sent, version))
+        queue.submit("status:2:dashboard", "2", lambda: _record(sent, "other"))
+        await queue.close(timeout=5)
+        return sent
+
+    assert asyncio.run(run()) == [4, "other"]
+
+
+def test_retry_after_pauses_the_chat_and_resends(monkeypatch):
+    monkeypatch.setattr(delivery, "TELEGRAM_CHAT_BURST", 10)
+
+    async def run():
+        queue = DeliveryQueue(workers=1)
+        attempts = []
+
+        async def send():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(timedelta(milliseconds=100))
+
+        queue.submit("status:1:dashboard", "1", send)
+        # Очередь пустеет только после повторной отправки
+        while len(attempts) < 2:
+            await asyncio.sleep(0.01)
+        await queue.close(timeout=5)
+        return attempts
+
+    attempts = asyncio.run(run())
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+
+
+def test_retry_is_dropped_when_a_newer_update_arrived(monkeypatch):
+    monkeypatch.setattr(delivery, "TELEGRAM_CHAT_BURST", 10)
+
+    async def run():
+        queue = DeliveryQueue(workers=1)
+        sent = []
+
+        async def stale():
+            sent.append("stale")
+            queue.submit("status:1:dashboard", "1", lambda: _record(sent, "fresh"))
+            raise RetryAfter(timedelta(milliseconds=50))
+
+        queue.submit("status:1:dashboard", "1", stale)
+        while "fresh" not in sent:
+            await asyncio.sleep(0.01)
+        await queue.close(timeout=5)
+        return sent
+
+    assert asyncio.run(run()) == ["stale", "fresh"]
+
+
+async def _record(sent, value):
+    sent.append(value)
@@ -0,0 +1,142 @@
+import hashlib
+import os
+
+import pytest
+import requests
+
+from downloader import DownloadError, download, pull_backup, store, verify
+
+
+class FakeResponse:
+    def __init__(self, status: int, body: bytes = b"", headers: dict = None):
+        self.status_code = status
+        self.headers = headers or {}
+        self.raw = self
+        self._body = body
+
+    def stream(self, size, decode_content=True):
+        for i in range(0, len(self._body), size):
+            yield self._body[i:i + size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeServer:
+    """
+    Serves `data` with an ETag, honouring Range/If-Range; `cut` drops the
+    tail of the next response to simulate a broken connection
+    """
+
+    def __init__(self, data: bytes, etag: str = '"v1"'):
+        self.data = data
+        self.etag = etag
+        self.cut = None
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        body, status = self.data, 200
+        extra = {"Content-Length": str(len(self.data))}
+        if "Range" in headers and headers.get("If-Range") == self.etag:
+            start = int(headers["Range"][len("bytes="):-1])
+            if start >= len(self.data):
+                return FakeResponse(416)
+            body, status = self.data[start:], 206
+            extra = {"Content-Range": f"bytes {start}-{len(self.data) - 1}/{len(self.data)}"}
+        if self.cut is not None:
+            body, self.cut = body[:self.cut], None
+        return FakeResponse(status, body, {"ETag": self.etag, **extra})
+
+
+def sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+DATA = os.urandom(5000)
+
+
+def test_interrupted_download_resumes_with_a_range_request(tmp_path, monkeypatch):
+    monkeypatch.setattr("downloader.CHUNK_SIZE", 1024)
+    server = FakeServer(DATA)
+    partial = str(tmp_path / "w.part")
+
+    server.cut = 3000
+    with pytest.raises(DownloadError):
+        download("http://x/backup", partial, server)
+    assert os.path.getsize(partial) == 3000
+
+    assert download("http://x/backup", partial, server) == (sha(DATA), len(DATA))
+    assert server.requests[-1] == {"Range": "bytes=3000-", "If-Range": '"v1"'}
+    assert open(partial, "rb").read() == DATA
+    assert not os.path.exists(f"{partial}.json")
+
+
+def test_changed_file_is_downloaded_again_from_the_start(tmp_path):
+    server = FakeServer(DATA)
+    partial = str(tmp_path / "w.part")
+    server.cut = 3000
+    with pytest.raises(DownloadError):
+        download("http://x/backup", partial, server)
+
+    # If-Range не совпал — сервер отдаёт файл целиком
+    server.data, server.etag = DATA[::-1], '"v2"'
+    assert download("http://x/backup", partial, server) == (sha(DATA[::-1]), len(DATA))
+    assert open(partial, "rb").read() == DATA[::-1]
+
+
+def test_unsatisfiable_range_restarts_the_download(tmp_path):
+    server = FakeServer(DATA)
+    partial = str(tmp_path / "w.part")
+    with open(partial, "wb") as f:
+        f.write(DATA + b"junk")
+    with open(f"{partial}.json", "w") as f:
+        f.write('{"validator": "\\"v1\\"", "total": 5000}')
+
+    assert download("http://x/backup", partial, server) == (sha(DATA), len(DATA))
+    assert [request.get("Range") for request in server.requests] == ["bytes=5004-", None]
+
+
+def test_identical_archives_are_stored_once(tmp_path):
+    server = FakeServer(DATA)
+    first = pull_backup("http://x/backup", 1, 1, str(tmp_path), server)
+    second = pull_backup("http://x/backup", 2, 1, str(tmp_path), server)
+
+    assert not first.reused and second.reused
+    assert os.listdir(tmp_path / "objects") == [f"{sha(DATA)}.tar.gz"]
+    assert os.path.samefile(first.path, second.path)
+    assert verify(first.path) and verify(second.path)
+
+    # Тот же архив в том же слоте ещё раз не ссылается
+    again = pull_backup("http://x/backup", 1, 1, str(tmp_path), server)
+    assert again.path == first.path and again.reused
+
+
+def test_corrupted_object_is_repaired_before_reuse(tmp_path):
+    server = FakeServer(DATA)
+    first = pull_backup("http://x/backup", 1, 1, str(tmp_path), server)
+    obj = tmp_path / "objects" / f"{sha(DATA)}.tar.gz"
+    with open(obj, "r+b") as f:
+        f.truncate(100)
+    assert not verify(first.path)
+
+    second = pull_backup("http://x/backup", 2, 1, str(tmp_path), server)
+    assert second.reused
+    assert verify(first.path) and verify(second.path)
+
+
+def test_store_moves_the_download_into_the_object_store(tmp_path):
+    partial = tmp_path / "w.part"
+    partial.write_bytes(DATA)
+    pulled = store(str(partial), sha(DATA), len(DATA), str(tmp_path / "1" / "slot1"), str(tmp_path))
+    assert not partial.exists()
+    assert pulled.path.endswith(f"-{sha(DATA)[:12]}.tar.gz")
+    assert open(pulled.path, "rb").read() == DATA
@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import httpx
+
+from events import EventBatch, EventEngine, JsonlSink, PlayerJoined, PlayerLeft, SessionClosed, WebhookSink
+
+GRACE = 600
+
+
+def publish(engine: EventEngine, now_ts: int) -> EventBatch:
+    return asyncio.run(engine.publish(now_ts))
+
+
+def test_join_and_steady_roster():
+    engine = EventEngine(GRACE)
+    engine.observe(1, ["a", "b"], 100)
+    batch = publish(engine, 100)
+    assert batch.events == [PlayerJoined(1, "a", 100), PlayerJoined(1, "b", 100)]
+    assert batch.rosters == {1: ["a", "b"]}
+
+    engine.observe(1, ["a", "b"], 160)
+    batch = publish(engine, 160)
+    assert batch.events == []
+    assert batch.sessions["a"] == {"started_at": 100, "last_seen": 160}
+
+
+def test_leave_closes_the_session_after_the_grace_period():
+    engine = EventEngine(GRACE)
+    engine.observe(1, ["a"], 100)
+    engine.observe(1, ["a"], 160)
+    engine.observe(1, [], 220)
+    assert publish(engine, 220).events == [PlayerJoined(1, "a", 100), PlayerLeft(1, "a", 160)]
+
+    assert publish(engine, 160 + GRACE).events == []
+    batch = publish(engine, 160 + GRACE + 1)
+    assert batch.events == [SessionClosed("a", 100, 160)]
+    assert batch.sessions == {}
+
+
+def test_return_within_grace_continues_the_session():
+    engine = EventEngine(GRACE)
+    engine.observe(1, ["a"], 100)
+    engine.observe(1, [], 160)
+    engine.observe(1, ["a"], 400)
+    publish(engine, 400)
+    batch = publish(engine, 100 + GRACE + 1)
+    assert not batch.of(SessionClosed)
+    assert batch.sessions["a"]["started_at"] == 100
+
+
+def test_moving_between_realms_keeps_one_session():
+    engine = EventEngine(GRACE)
+    engine.observe(1, ["a"], 100)
+    engine.observe(2, [], 100)
+    publish(engine, 100)
+
+    engine.observe(1, [], 160)
+    engine.observe(2, ["a"], 160)
+    batch = publish(engine, 160)
+    assert batch.events == [PlayerLeft(1, "a", 100), PlayerJoined(2, "a", 160)]
+    assert engine.where == {"a": {2}}
+
+    batch = publish(engine, 160 + 2 * GRACE)
+    assert not batch.of(SessionClosed)
+    assert batch.sessions["a"] == {"started_at": 100, "last_seen": 160 + 2 * GRACE}
+
+
+def test_restore_without_snapshot_resumes_sessions_on_the_next_poll():
+    engine = EventEngine(GRACE)
+    engine.restore({"a": {"started_at": 100, "last_seen": 500}})
+    engine.observe(1, ["a"], 700)
+    batch = publish(engine, 700)
+    assert batch.events == [PlayerJoined(1, "a", 700)]
+    assert batch.sessions["a"] == {"started_at": 100, "last_seen": 700}
+
+
+def test_restore_without_snapshot_closes_sessions_that_expired_during_the_restart():
+    engine = EventEngine(GRACE)
+    engine.restore({"a": {"started_at": 100, "last_seen": 500}})
+    assert publish(engine, 500 + GRACE + 1).events == [SessionClosed("a", 100, 500)]
+
+
+def test_restore_from_snapshot_is_silent_for_players_still_online():
+    before = EventEngine(GRACE)
+    before.observe(1, ["a", "b"], 100)
+    before.observe(1, ["a", "b"], 400)
+    publish(before, 400)
+    snapshot = json.loads(json.dumps(before.dump()))
+
+    after = EventEngine(GRACE)
+    # «b» за время простоя закрыли в БД — в ростер из снимка он не попадает
+    after.restore({"a": {"started_at": 100, "last_seen": 300}}, snapshot)
+    assert after.where == {"a": {1}}
+    assert after.sessions["a"]["started_at"] == 100
+
+    after.observe(1, ["a", "b"], 460)
+    batch = publish(after, 460)
+    assert batch.events == [PlayerJoined(1, "b", 460)]
+    assert batch.sessions["a"] == {"started_at": 100, "last_seen": 460}
+
+
+def test_jsonl_sink_appends_events(tmp_path):
+    path = tmp_path / "events.jsonl"
+    sink = JsonlSink(str(path))
+
+    async def run():
+        await sink(EventBatch(100, [PlayerJoined(1, "a", 100)]))
+        await sink(EventBatch(160, []))
+        await sink(EventBatch(220, [PlayerLeft(1, "a", 160)]))
+        await sink.close()
+
+    asyncio.run(run())
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines == [
+        {"type": "join", "realm_id": 1, "player": "a", "ts": 100},
+        {"type": "leave", "realm_id": 1, "player": "a", "ts": 160},
+    ]
+
+
+def test_webhook_sink_posts_from_a_queue():
+    received = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        received.append(json.loads(request.content))
+        return httpx.Response(200)
+
+    async def run():
+        sink = WebhookSink("http://hook.test/events")
+        sink._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        await sink(EventBatch(100, [PlayerJoined(1, "a", 100)]))
+        await sink(EventBatch(160, []))
+        # Подписчик только ставит пачку в очередь
+        assert received == []
+        await sink.close()
+
+    asyncio.run(run())
+    assert received == [{"ts": 100, "events": [{"type": "join", "realm_id": 1, "player": "a", "ts": 100}]}]
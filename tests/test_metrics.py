@@ -0,0 +1,34 @@
+import asyncio
+
+import metrics
+
+
+async def request(payload, read_timeout=0.2):
+    server = await asyncio.start_server(metrics._handle, "127.0.0.1", 0, limit=metrics.METRICS_MAX_LINE)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(payload)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), read_timeout)
+        writer.close()
+        return response
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def test_serves_metrics():
+    response = asyncio.run(request(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n"))
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert b"realm_tick_seconds" in response
+
+
+def test_idle_client_is_disconnected_after_the_read_timeout(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_READ_TIMEOUT", 0.05)
+    # Заголовки так и не заканчиваются — сервер закрывает соединение без ответа
+    assert asyncio.run(request(b"GET /metrics HTTP/1.1\r\nHost: x\r\n")) == b""
+
+
+def test_overlong_request_line_is_dropped():
+    assert asyncio.run(request(b"GET /" + b"a" * (2 * metrics.METRICS_MAX_LINE) + b" HTTP/1.1\r\n\r\n")) == b""
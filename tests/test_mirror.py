@@ -0,0 +1,64 @@
+import os
+
+from mirror import MirrorJob, apply_retention, collect_garbage, plan
+
+
+def touch(path, content=b""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_plan_puts_the_active_slot_first():
+    jobs = plan({
+        7: {"activeSlot": 2, "slots": [{"slotId": 1}, {"slotId": 2}, {"slotId": 3}]},
+        8: {"activeSlot": 1},
+    })
+    assert jobs[:2] == [MirrorJob(0, 7, 2), MirrorJob(0, 8, 1)]
+    assert [(job.world_id, job.slot) for job in jobs[2:]] == [(7, 1), (8, 2), (7, 3), (8, 3)]
+
+
+def test_retention_keeps_the_newest_archive_per_day_and_week(tmp_path):
+    slot_dir = tmp_path / "7" / "slot1"
+    for day in range(1, 18):
+        touch(str(slot_dir / f"202610{day:02d}-120000-{day:012x}.tar.gz"))
+    touch(str(slot_dir / "20261017-180000-aaaaaaaaaaaa.tar.gz"))
+
+    removed = apply_retention(str(slot_dir), keep_daily=3, keep_weekly=2)
+
+    kept = sorted(os.listdir(slot_dir))
+    # Три последних дня и последний архив предыдущей ISO-недели (вс 11.10)
+    assert kept == [
+        "20261011-120000-00000000000b.tar.gz",
+        "20261015-120000-00000000000f.tar.gz",
+        "20261016-120000-000000000010.tar.gz",
+        "20261017-180000-aaaaaaaaaaaa.tar.gz",
+    ]
+    assert len(removed) == 18 - len(kept)
+
+
+def test_garbage_collection_drops_only_unlinked_objects(tmp_path):
+    backup_dir = str(tmp_path)
+    linked = touch(os.path.join(backup_dir, "objects", f"{'a' * 64}.tar.gz"), b"a")
+    orphan = touch(os.path.join(backup_dir, "objects", f"{'b' * 64}.tar.gz"), b"b")
+    slot_dir = os.path.join(backup_dir, "7", "slot1")
+    os.makedirs(slot_dir)
+    os.link(linked, os.path.join(slot_dir, f"20261017-120000-{'a' * 12}.tar.gz"))
+
+    assert collect_garbage(backup_dir) == 1
+    assert os.path.exists(linked)
+    assert not os.path.exists(orphan)
+
+
+def test_retention_then_garbage_collection_frees_expired_objects(tmp_path):
+    backup_dir = str(tmp_path)
+    slot_dir = os.path.join(backup_dir, "7", "slot1")
+    os.makedirs(slot_dir)
+    for day, digest in ((16, "c" * 64), (17, "d" * 64)):
+        obj = touch(os.path.join(backup_dir, "objects", f"{digest}.tar.gz"), digest.encode())
+        os.link(obj, os.path.join(slot_dir, f"202610{day}-120000-{digest[:12]}.tar.gz"))
+
+    apply_retention(slot_dir, keep_daily=1, keep_weekly=0)
+    assert collect_garbage(backup_dir) == 1
+    assert os.listdir(os.path.join(backup_dir, "objects")) == [f"{'d' * 64}.tar.gz"]
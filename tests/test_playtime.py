@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+from db import SessionLocal
+from playtime import RollingPlaytime, add_intervals
+
+WEEK_SECONDS = 7 * 24 * 3600
+
+
+def record_intervals(intervals):
+    with SessionLocal() as session:
+        add_intervals(session, intervals)
+        session.commit()
+
+
+def brute_force(entries, now_ts):
+    totals = {}
+    for player, start_ts, duration in entries:
+        if start_ts >= now_ts - WEEK_SECONDS and duration > 0:
+            totals[player] = totals.get(player, 0) + duration
+    return totals
+
+
+def live_part(sessions, now_ts):
+    cutoff = now_ts - WEEK_SECONDS
+    return {
+        name: session["last_seen"] - max(session["started_at"], cutoff)
+        for name, session in sessions.items()
+        if session["last_seen"] - max(session["started_at"], cutoff) > 0
+    }
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_brute_force_on_random_streams(database, seed):
+    rng = random.Random(seed)
+    players = [f"p{i}" for i in range(6)]
+    entries = []
+    aggregator = RollingPlaytime(WEEK_SECONDS)
+    now_ts = 1_700_000_000
+
+    for _ in range(150):
+        now_ts += rng.randint(0, 2 * 24 * 3600)
+        # Интервалы приходят с опозданием, иногда уже за пределами недели
+        batch = [
+            (rng.choice(players), now_ts - rng.randint(0, 9 * 24 * 3600), rng.randint(0, 4 * 3600))
+            for _ in range(rng.randint(0, 4))
+        ]
+        record_intervals(batch)
+        entries.extend(batch)
+
+        if rng.random() < 0.2:
+            aggregator = RollingPlaytime.load(aggregator.dump(), WEEK_SECONDS)
+        if rng.random() < 0.3:
+            aggregator.expire(now_ts)
+        aggregator.sync(now_ts)
+        assert aggregator.totals == brute_force(entries, now_ts)
+
+        sessions = {
+            name: {"started_at": now_ts - rng.randint(0, 10 * 24 * 3600), "last_seen": now_ts - rng.randint(0, 600)}
+            for name in rng.sample(players, 2)
+        }
+        expected = brute_force(entries, now_ts)
+        for name, played in live_part(sessions, now_ts).items():
+            expected[name] = expected.get(name, 0) + played
+        assert aggregator.weekly(sessions, now_ts) == expected
+
+
+def test_week_boundary(database):
+    now_ts = 1_700_000_000
+    entries = [
+        ("edge", now_ts - WEEK_SECONDS, 60),
+        ("old", now_ts - WEEK_SECONDS - 1, 60),
+    ]
+    record_intervals(entries)
+    aggregator = RollingPlaytime(WEEK_SECONDS)
+    aggregator.sync(now_ts)
+    assert aggregator.totals == brute_force(entries, now_ts) == {"edge": 60}
+
+    # Через секунду «edge» выходит из окна
+    assert aggregator.expire(now_ts + 1)
+    assert aggregator.totals == brute_force(entries, now_ts + 1) == {}
+
+
+def test_load_dump_round_trip(database):
+    now_ts = 1_700_000_000
+    entries = [("a", now_ts - 100, 50), ("b", now_ts - 3 * 24 * 3600, 700), ("a", now_ts - 6 * 24 * 3600, 30)]
+    record_intervals(entries)
+    aggregator = RollingPlaytime(WEEK_SECONDS)
+    aggregator.sync(now_ts)
+
+    restored = RollingPlaytime.load(aggregator.dump(), WEEK_SECONDS)
+    assert restored.totals == aggregator.totals == brute_force(entries, now_ts)
+    assert restored.last_id == aggregator.last_id
+
+    later = now_ts + 2 * 24 * 3600
+    record_intervals([("c", later - 10, 5)])
+    entries.append(("c", later - 10, 5))
+    restored.sync(later)
+    assert restored.totals == brute_force(entries, later)
+
+
+def test_broken_checkpoint_rebuilds_from_table(database):
+    now_ts = 1_700_000_000
+    entries = [("a", now_ts - 100, 50)]
+    record_intervals(entries)
+    aggregator = RollingPlaytime.load("{not json", WEEK_SECONDS)
+    aggregator.sync(now_ts)
+    assert aggregator.totals == brute_force(entries, now_ts)
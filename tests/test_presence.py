@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import presence
+
+from db import PresenceMinutes, SessionLocal
+
+HOUR_TS = 1_700_000_000 // 3600 * 3600
+
+
+def store(*rows):
+    with SessionLocal() as session:
+        session.add_all(PresenceMinutes(realm_id=realm_id, hour_ts=hour_ts, player=player, minutes=minutes) for realm_id, hour_ts, player, minutes in rows)
+        session.commit()
+
+
+def test_player_totals_count_a_minute_in_two_realms_once(database):
+    # Минуты 0–9 в мире 1, 5–14 в мире 2: вместе 15 минут
+    store(
+        (1, HOUR_TS, "a", (1 << 10) - 1),
+        (2, HOUR_TS, "a", ((1 << 10) - 1) << 5),
+        (2, HOUR_TS, "b", 1),
+    )
+    end_ts = HOUR_TS + 3600
+    assert presence.player_totals(HOUR_TS, end_ts) == {"a": 15 * 60, "b": 60}
+    assert presence.player_totals(HOUR_TS, end_ts, [1, 2]) == {"a": 15 * 60, "b": 60}
+    assert presence.player_totals(HOUR_TS, end_ts, [1]) == {"a": 10 * 60}
+
+
+def test_player_totals_clip_to_the_range(database):
+    store((1, HOUR_TS, "a", (1 << 60) - 1))
+    assert presence.player_totals(HOUR_TS + 30 * 60, HOUR_TS + 40 * 60, [1]) == {"a": 10 * 60}
+
+
+def test_failed_flush_keeps_the_minutes_for_the_next_one(database, monkeypatch):
+    recorder = presence.PresenceRecorder(flush_interval=0)
+    recorder.record(1, ["a"], HOUR_TS + 60)
+
+    def broken(rows):
+        raise OSError("database is down")
+
+    monkeypatch.setattr(presence, "_write_minutes", broken)
+    with pytest.raises(OSError):
+        asyncio.run(recorder.maybe_flush(HOUR_TS + 120))
+    monkeypatch.undo()
+
+    asyncio.run(recorder.maybe_flush(HOUR_TS + 180))
+    assert presence.player_totals(HOUR_TS, HOUR_TS + 3600, [1]) == {"a": 60}
+
+
+def test_all_realm_concurrency_counts_a_player_in_two_realms_once(database):
+    store(
+        (1, HOUR_TS, "a", (1 << 10) - 1),
+        (2, HOUR_TS, "a", ((1 << 10) - 1) << 5),
+        (2, HOUR_TS, "b", 1),
+    )
+    end_ts = HOUR_TS + 3600
+    # Минута 0: a и b; минуты 1–14: только a
+    assert presence.hourly(HOUR_TS, end_ts) == {HOUR_TS: (2, 16)}
+    assert presence.hourly(HOUR_TS, end_ts, 2) == {HOUR_TS: (1, 11)}
+
+
+def test_compacted_all_realm_rollup_matches_raw_minutes(database):
+    store(
+        (1, HOUR_TS, "a", (1 << 10) - 1),
+        (2, HOUR_TS, "a", ((1 << 10) - 1) << 5),
+        (2, HOUR_TS, "b", 1),
+    )
+    end_ts = HOUR_TS + 3600
+    before = presence.hourly(HOUR_TS, end_ts), presence.hourly(HOUR_TS, end_ts, 1)
+    assert presence.compact(HOUR_TS + 3 * presence.DAY, keep_days=1) > 0
+    assert (presence.hourly(HOUR_TS, end_ts), presence.hourly(HOUR_TS, end_ts, 1)) == before
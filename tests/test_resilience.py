@@ -0,0 +1,117 @@
+import time
+
+import pytest
+import requests
+
+from auth.resilience import CircuitBreaker, CircuitOpenError, Resilience
+
+
+def response(status: int, headers: dict = None) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    r.headers.update(headers or {})
+    r.url = "http://realms.test/worlds/1"
+    return r
+
+
+def sender(*statuses: int):
+    calls = []
+
+    def send():
+        calls.append(1)
+        return response(statuses[min(len(calls), len(statuses)) - 1])
+
+    return send, calls
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failures=3, cooldown=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.failure()
+    breaker.before_call()
+    breaker.success()
+    assert breaker.consecutive == 0
+
+    for _ in range(3):
+        breaker.before_call()
+        breaker.failure()
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_at >= time.time() + 59
+
+
+def test_breaker_lets_a_single_probe_through_after_cooldown():
+    breaker = CircuitBreaker("test", failures=1, cooldown=60)
+    breaker.before_call()
+    breaker.failure()
+    breaker.open_until = time.time() - 1
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # Проба прервалась до хоста — следующий вызов снова пробный
+    breaker.release()
+    breaker.before_call()
+    breaker.success()
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_breaker_honours_retry_after():
+    breaker = CircuitBreaker("test", failures=5, cooldown=60)
+    breaker.failure(retry_at=time.time() + 600)
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_at > time.time() + 500
+
+
+def test_call_records_one_failure_when_retries_are_exhausted():
+    resilience = Resilience(retries=2, backoff_base=0)
+    send, calls = sender(503)
+    with pytest.raises(requests.HTTPError):
+        resilience.call("realms:/worlds/{id}", send)
+    assert len(calls) == 3
+    assert resilience.breaker("realms:/worlds/{id}").consecutive == 1
+
+
+def test_call_records_one_success_after_retries():
+    resilience = Resilience(retries=2, backoff_base=0)
+    breaker = resilience.breaker("realms:/worlds/{id}")
+    breaker.failure()
+    send, calls = sender(503, 503, 200)
+    assert resilience.call("realms:/worlds/{id}", send).status_code == 200
+    assert len(calls) == 3
+    assert breaker.consecutive == 0
+
+
+def test_retries_of_a_probe_are_not_rejected():
+    resilience = Resilience(retries=2, backoff_base=0)
+    breaker = resilience.breaker("key")
+    breaker.open_until = time.time() - 1
+    send, calls = sender(503, 200)
+    assert resilience.call("endpoint", send, breaker_key="key").status_code == 200
+    assert breaker.open_until == 0.0
+
+
+def test_breakers_are_keyed_per_world():
+    resilience = Resilience(retries=0, backoff_base=0)
+    resilience.breaker("realms:/worlds/1").failures = 1
+    failing, _ = sender(503)
+    with pytest.raises(requests.HTTPError):
+        resilience.call("realms:/worlds/{id}", failing, breaker_key="realms:/worlds/1")
+    with pytest.raises(CircuitOpenError):
+        resilience.call("realms:/worlds/{id}", failing, breaker_key="realms:/worlds/1")
+
+    ok, _ = sender(200)
+    assert resilience.call("realms:/worlds/{id}", ok, breaker_key="realms:/worlds/2").status_code == 200
+
+
+def test_client_errors_do_not_count_against_the_host():
+    resilience = Resilience(retries=2, backoff_base=0)
+    send, calls = sender(404)
+    with pytest.raises(requests.HTTPError):
+        resilience.call("realms:/worlds/{id}", send)
+    assert len(calls) == 1
+    assert resilience.breaker("realms:/worlds/{id}").consecutive == 0
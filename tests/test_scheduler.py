@@ -0,0 +1,61 @@
+import pytest
+
+from scheduler import POLL_IDLE_BACKOFF, PollScheduler
+from tg import SESSION_GRACE_PERIOD
+
+NOW = 1_700_000_000.0
+
+
+def world(*online, **extra):
+    return {"players": [{"name": name, "online": True} for name in online], **extra}
+
+
+@pytest.fixture
+def scheduler():
+    return PollScheduler(interval=60, jitter=0, min_interval=20, max_interval=900)
+
+
+def test_polls_fast_on_changes_and_at_the_base_interval_while_steady(scheduler):
+    assert scheduler.update(1, world("a"), NOW) == 20
+    assert scheduler.update(1, world("a"), NOW + 20) == 60
+    assert scheduler.update(1, world("a", "b"), NOW + 80) == 20
+    assert scheduler.worlds[1].next_at == NOW + 100
+
+
+def test_stays_fast_through_the_grace_period_then_backs_off_when_empty(scheduler):
+    scheduler.update(1, world("a"), NOW)
+    assert scheduler.update(1, world(), NOW + 60) == 20
+    grace = SESSION_GRACE_PERIOD.total_seconds()
+    assert scheduler.update(1, world(), NOW + 60 + grace - 1) == 20
+
+    now = NOW + 60 + grace
+    intervals = []
+    for _ in range(10):
+        intervals.append(scheduler.update(1, world(), now))
+        now += intervals[-1]
+    assert intervals[0] == 60 * POLL_IDLE_BACKOFF
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == 900
+
+
+@pytest.mark.parametrize("info", [world(state="CLOSED"), world(expired=True)])
+def test_inactive_realms_are_polled_at_the_max_interval(scheduler, info):
+    assert scheduler.update(1, info, NOW) == 900
+
+
+def test_failures_double_the_interval_and_wait_for_the_breaker(scheduler):
+    scheduler.update(1, world("a"), NOW)
+    scheduler.update(1, world("a"), NOW + 20)
+    assert scheduler.failed(1, NOW + 80) == 120
+    assert scheduler.failed(1, NOW + 200, not_before=NOW + 1000) == 240
+    assert scheduler.worlds[1].next_at == NOW + 1000
+
+
+def test_new_worlds_are_spread_over_the_interval(scheduler):
+    scheduler.track([1, 2, 3], NOW)
+    assert scheduler.due(NOW) == [1, 2, 3]
+    for world_id in (1, 2, 3):
+        scheduler.update(world_id, world("a"), NOW)
+    assert sorted(schedule.next_at for schedule in scheduler.worlds.values()) == [NOW + 20, NOW + 40, NOW + 60]
+    assert scheduler.next_wakeup() == NOW + 20
+    assert scheduler.due(NOW + 45) == [1, 2]
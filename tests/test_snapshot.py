@@ -0,0 +1,48 @@
+import json
+import os
+import stat
+
+from snapshot import SNAPSHOT_VERSION, read_snapshot, write_snapshot
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "state.json")
+    state = {"events": {"online": {"1": ["a"]}}, "tokens": {"ms": {"token": "t", "expires": 1.0}}}
+    write_snapshot(path, state)
+
+    snapshot = read_snapshot(path)
+    assert snapshot["version"] == SNAPSHOT_VERSION
+    assert snapshot["written_at"] > 0
+    assert {key: snapshot[key] for key in state} == state
+    assert os.listdir(tmp_path) == ["state.json"]
+
+
+def test_replaces_the_previous_snapshot(tmp_path):
+    path = str(tmp_path / "state.json")
+    write_snapshot(path, {"n": 1})
+    write_snapshot(path, {"n": 2})
+    assert read_snapshot(path)["n"] == 2
+
+
+def test_owner_only_even_over_a_stale_tmp_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    with open(f"{path}.tmp", "w") as f:
+        f.write("partial")
+    os.chmod(f"{path}.tmp", 0o644)
+
+    write_snapshot(path, {})
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_missing_broken_or_foreign_snapshots_are_ignored(tmp_path):
+    path = tmp_path / "state.json"
+    assert read_snapshot(str(path)) is None
+
+    path.write_text('{"version": 1, "events"')
+    assert read_snapshot(str(path)) is None
+
+    path.write_text(json.dumps({"version": SNAPSHOT_VERSION + 1}))
+    assert read_snapshot(str(path)) is None
+
+    path.write_text("[]")
+    assert read_snapshot(str(path)) is None
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+import tg
+
+from db import get_setting
+from playtime import RollingPlaytime
+from tg import TargetSpec, parse_targets
+
+
+def test_empty_spec_is_a_dashboard_of_every_realm_in_the_default_chat():
+    assert parse_targets("", default_chat="-100") == [TargetSpec("-100", True, None)]
+    assert parse_targets("  ", default_chat=None) == []
+
+
+def test_parses_realm_lists_dashboards_and_wildcards():
+    spec = " -100 = 1, 2 ;-200=dashboard:3,4;-300=dashboard;-400=*;"
+    assert parse_targets(spec) == [
+        TargetSpec("-100", False, frozenset({1, 2})),
+        TargetSpec("-200", True, frozenset({3, 4})),
+        TargetSpec("-300", True, None),
+        TargetSpec("-400", False, None),
+    ]
+
+
+@pytest.mark.parametrize("entry", ["-100", "-100=", "=1", "-100=1,x", "-100=dashboard:one", "-100=,"])
+def test_malformed_entry_is_named_in_the_error(entry):
+    with pytest.raises(ValueError, match=f"TELEGRAM_TARGETS entry {entry!r}"):
+        parse_targets(f"-200=1;{entry}")
+
+
+def test_playtime_checkpoint_is_written_on_an_interval_and_on_shutdown(database, monkeypatch):
+    monkeypatch.setattr(tg, "_playtime", RollingPlaytime(tg.WEEK_SECONDS))
+    monkeypatch.setattr(tg, "_playtime_dirty", False)
+    monkeypatch.setattr(tg, "_checkpointed_at", 0)
+    now_ts = 1_700_000_000
+
+    tg._playtime.add("a", now_ts - 60, 60)
+    tg._playtime_dirty = True
+    asyncio.run(tg._checkpoint_playtime(now_ts))
+    assert RollingPlaytime.load(get_setting(tg.PLAYTIME_CHECKPOINT_KEY), tg.WEEK_SECONDS).totals == {"a": 60}
+
+    # Следующее изменение внутри интервала ждёт остановки
+    tg._playtime.add("b", now_ts, 30)
+    tg._playtime_dirty = True
+    asyncio.run(tg._checkpoint_playtime(now_ts + 1))
+    assert "b" not in RollingPlaytime.load(get_setting(tg.PLAYTIME_CHECKPOINT_KEY), tg.WEEK_SECONDS).totals
+
+    tg.save_playtime()
+    assert RollingPlaytime.load(get_setting(tg.PLAYTIME_CHECKPOINT_KEY), tg.WEEK_SECONDS).totals == {"a": 60, "b": 30}
@@ -1,35 +1,88 @@
+import asyncio
+import hashlib
 import json
 import os
 
 from datetime import datetime, timezone, timedelta
-from typing import Dict, List, TypedDict
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
 
+from sqlalchemy import delete, select
 from telegram import Bot
 from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 
-from db import get_setting, remove_setting, set_setting
+from db import Setting, SessionLocal, get_setting, get_settings, set_setting, set_settings
+from delivery import DeliveryQueue
+from events import EventBatch, SessionClosed
+from metrics import TELEGRAM_REQUEST_SECONDS
+from playtime import PlayerSession, RollingPlaytime, add_intervals, intervals_after, load_sessions, upsert_sessions
 
 
 # === CONFIG ===
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+# Свой Bot API сервер (или заглушка бенчмарка) вместо api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+# Какие миры в какие чаты: "chat=realm,realm;chat=dashboard:*" (см. parse_targets).
+# Пусто — одна сводка всех миров в TELEGRAM_CHAT_ID
+TELEGRAM_TARGETS = os.getenv("TELEGRAM_TARGETS", "")
+DASHBOARD = "dashboard"
+ALL_TRACKED = "*"
+# Лимит длины текста сообщения в Bot API
+MESSAGE_TEXT_LIMIT = 4096
 
 MESSAGE_ID_KEY = "realm_status_message_id"
+MESSAGE_HASH_KEY = "realm_status_message_hash"
+MESSAGE_EDITED_KEY = "realm_status_message_edited"
 PLAYER_SESSIONS_KEY = "realm_player_sessions"
 PLAYTIME_LOG_KEY = "realm_playtime_log"
+PLAYTIME_CHECKPOINT_KEY = "realm_playtime_checkpoint"
 
 SESSION_GRACE_PERIOD = timedelta(minutes=10)
+# Даже без изменений обновляем сообщение не реже, чем раз в столько секунд
+STATUS_MAX_STALENESS = int(os.getenv("STATUS_MAX_STALENESS", "900"))
 WEEK_SECONDS = 7 * 24 * 3600
+# Недельный агрегат сохраняем не чаще раза в столько секунд и при остановке.
+# Старый checkpoint безопасен: sync дочитает интервалы, записанные после него
+PLAYTIME_CHECKPOINT_INTERVAL = int(os.getenv("PLAYTIME_CHECKPOINT_INTERVAL", "600"))
 
 MSK = timezone(timedelta(hours=3))
 
-class PlayerSession(TypedDict):
-    started_at: int
-    last_seen: int
+_bot: Optional[Bot] = None
+_delivery: Optional[DeliveryQueue] = None
+_migrated = False
+_playtime: Optional[RollingPlaytime] = None
+_playtime_dirty = False
+_checkpointed_at = 0
+_targets: Optional["TargetRegistry"] = None
 
 
-def _load_player_sessions() -> Dict[str, PlayerSession]:
-    raw = get_setting(PLAYER_SESSIONS_KEY)
+def _get_bot() -> Bot:
+    # Один Bot (и его HTTP-соединения) на весь процесс
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=BOT_TOKEN, base_url=TELEGRAM_API_URL)
+    return _bot
+
+
+def _get_delivery() -> DeliveryQueue:
+    global _delivery
+    if _delivery is None:
+        _delivery = DeliveryQueue()
+    return _delivery
+
+
+async def close_bot() -> None:
+    global _bot, _delivery
+    if _delivery is not None:
+        await _delivery.close()
+        _delivery = None
+    if _bot is not None:
+        await _bot.shutdown()
+        _bot = None
+
+
+def _load_player_sessions(raw: Optional[str]) -> Dict[str, PlayerSession]:
     if not raw:
         return {}
     try:
@@ -53,16 +106,8 @@ def _load_player_sessions() -> Dict[str, PlayerSession]:
     return sessions
 
 
-def _save_player_sessions(sessions: Dict[str, PlayerSession]) -> None:
-    if not sessions:
-        remove_setting(PLAYER_SESSIONS_KEY)
-        return
-    set_setting(PLAYER_SESSIONS_KEY, json.dumps(sessions))
-
-
-# Playtime log: {player: [[start_ts, duration_secs], ...]}
-def _load_playtime_log() -> Dict[str, List[List[int]]]:
-    raw = get_setting(PLAYTIME_LOG_KEY)
+# Legacy playtime log: {player: [[start_ts, duration_secs], ...]}
+def _load_playtime_log(raw: Optional[str]) -> Dict[str, List[List[int]]]:
     if not raw:
         return {}
     try:
@@ -74,27 +119,67 @@ def _load_playtime_log() -> Dict[str, List[List[int]]]:
     return data
 
 
-def _save_playtime_log(log: Dict[str, List[List[int]]], now_ts: int) -> None:
-    cutoff = now_ts - WEEK_SECONDS
-    pruned = {
-        player: [[s, d] for s, d in entries if s >= cutoff]
-        for player, entries in log.items()
-    }
-    pruned = {p: e for p, e in pruned.items() if e}
-    if not pruned:
-        remove_setting(PLAYTIME_LOG_KEY)
-    else:
-        set_setting(PLAYTIME_LOG_KEY, json.dumps(pruned))
-
+def _migrate_legacy_state() -> None:
+    # Переносим JSON из settings в таблицы player_sessions / play_intervals (один раз).
+    # Старое состояние всегда лежало в таблице settings, поэтому читаем, переносим
+    # и удаляем его в одной транзакции: падение посередине не задвоит интервалы
+    global _migrated
+    if _migrated:
+        return
 
-def _record_session(log: Dict[str, List[List[int]]], player: str, start_ts: int, end_ts: int) -> None:
-    duration = max(end_ts - start_ts, 0)
-    if duration == 0:
+    with SessionLocal() as session:
+        stored = dict(session.execute(
+            select(Setting.key, Setting.value).where(Setting.key.in_([PLAYER_SESSIONS_KEY, PLAYTIME_LOG_KEY]))
+        ).all())
+        if stored:
+            sessions = _load_player_sessions(stored.get(PLAYER_SESSIONS_KEY))
+            playtime_log = _load_playtime_log(stored.get(PLAYTIME_LOG_KEY))
+            add_intervals(session, (
+                (player, s, d)
+                for player, entries in playtime_log.items()
+                for s, d in entries
+            ))
+            upsert_sessions(session, sessions)
+            session.execute(delete(Setting).where(Setting.key.in_(list(stored))))
+            session.commit()
+
+    _migrated = True
+
+
+def _get_playtime() -> RollingPlaytime:
+    global _playtime
+    if _playtime is None:
+        _playtime = RollingPlaytime.load(get_setting(PLAYTIME_CHECKPOINT_KEY), WEEK_SECONDS)
+    return _playtime
+
+
+async def _checkpoint_playtime(now_ts: int) -> None:
+    global _playtime_dirty, _checkpointed_at
+    if not _playtime_dirty or now_ts - _checkpointed_at < PLAYTIME_CHECKPOINT_INTERVAL:
         return
-    log.setdefault(player, []).append([start_ts, duration])
+    await asyncio.to_thread(set_setting, PLAYTIME_CHECKPOINT_KEY, _get_playtime().dump())
+    _playtime_dirty = False
+    _checkpointed_at = now_ts
+
+
+def save_playtime() -> None:
+    """
+    Writes the playtime checkpoint if it changed since the last one (on shutdown)
+    """
+    global _playtime_dirty
+    if _playtime is not None and _playtime_dirty:
+        set_setting(PLAYTIME_CHECKPOINT_KEY, _playtime.dump())
+        _playtime_dirty = False
+
+
+def weekly_playtime(sessions: Dict[str, PlayerSession], now_ts: int) -> Dict[str, int]:
+    """
+    Seconds played per player over the last week, live sessions included
+    """
+    return _get_playtime().weekly(sessions, now_ts)
 
 
-def _format_playtime(total_seconds: int) -> str:
+def format_playtime(total_seconds: int) -> str:
     total_minutes = total_seconds // 60
     hours = total_minutes // 60
     minutes = total_minutes % 60
@@ -103,7 +188,7 @@ def _format_playtime(total_seconds: int) -> str:
     return f"{hours}ч {minutes} мин"
 
 
-def _format_duration(started_at: datetime, now: datetime) -> str:
+def format_duration(started_at: datetime, now: datetime) -> str:
     total_minutes = int((now - started_at).total_seconds() // 60)
     total_minutes = max(total_minutes, 0)
 
@@ -119,111 +204,367 @@ def _format_duration(started_at: datetime, now: datetime) -> str:
     return f"(Играет {hours}ч {minutes} мин)"
 
 
-def _format_message(players: List[str], sessions: Dict[str, PlayerSession], playtime_log: Dict[str, List[List[int]]], now_ts: int) -> str:
-    now_msk = datetime.now(MSK).strftime("%H:%M")
-    now_utc = datetime.fromtimestamp(now_ts, timezone.utc)
+def format_players(players: List[str], sessions: Dict[str, PlayerSession], now_utc: datetime) -> str:
+    if not players:
+        return "— никого нет —"
+    return "\n".join(
+        f"• {name} {format_duration(datetime.fromtimestamp(sessions[name]['started_at'], timezone.utc), now_utc)}"
+        for name in players
+    )
 
-    if players:
-        players_block = "\n".join(
-            f"• {name} {_format_duration(datetime.fromtimestamp(sessions[name]['started_at'], timezone.utc), now_utc)}"
-            for name in players
-        )
-        online = len(players)
-    else:
-        players_block = "— никого нет —"
-        online = 0
 
+def _weekly_section(weekly: Dict[str, int]) -> str:
     # Weekly stats: all players with playtime in the last 7 days
-    cutoff = now_ts - WEEK_SECONDS
-    weekly: Dict[str, int] = {}
-    for player, entries in playtime_log.items():
-        total = sum(d for s, d in entries if s >= cutoff)
-        if total > 0:
-            weekly[player] = total
-    for name, session in sessions.items():
-        weekly[name] = weekly.get(name, 0) + max(now_ts - session["started_at"], 0)
-
-    if weekly:
-        weekly_lines = "\n".join(
-            f"• {name}: {_format_playtime(secs)}"
-            for name, secs in sorted(weekly.items(), key=lambda x: -x[1])
-        )
-        weekly_section = f"\n📊 *За неделю:*\n{weekly_lines}\n"
-    else:
-        weekly_section = ""
+    if not weekly:
+        return ""
+    weekly_lines = "\n".join(
+        f"• {name}: {format_playtime(secs)}"
+        for name, secs in sorted(weekly.items(), key=lambda x: -x[1])
+    )
+    return f"\n📊 *За неделю:*\n{weekly_lines}\n"
 
+
+def _format_body(players: List[str], sessions: Dict[str, PlayerSession], weekly: Dict[str, int], now_ts: int) -> str:
+    now_utc = datetime.fromtimestamp(now_ts, timezone.utc)
     return (
-        f"👥 *Онлайн:* {online}\n"
+        f"👥 *Онлайн:* {len(players)}\n"
         f"\n"
         f"🟢 *Игроки:*\n"
-        f"{players_block}\n"
-        f"{weekly_section}"
-        f"\n"
-        f"🕒 _Обновлено: {now_msk} (МСК)_"
+        f"{format_players(players, sessions, now_utc)}\n"
+        f"{_weekly_section(weekly)}"
     )
 
 
-async def update_status(players: List[str]) -> None:
-    bot = Bot(token=BOT_TOKEN)
-    now_utc = datetime.now(timezone.utc)
-    now_ts = int(now_utc.timestamp())
+def _format_dashboard(realms: List[Tuple[str, List[str]]], sessions: Dict[str, PlayerSession],
+                      weekly: Dict[str, int], now_ts: int) -> str:
+    # Сводка нескольких миров: общий онлайн, затем игроки по мирам
+    now_utc = datetime.fromtimestamp(now_ts, timezone.utc)
+    online = len({name for _, players in realms for name in players})
+    sections = "\n".join(
+        f"\n🌍 *{escape_markdown(name)}* ({len(players)})\n{format_players(players, sessions, now_utc)}"
+        for name, players in realms
+    )
+    return (
+        f"👥 *Онлайн:* {online}\n"
+        f"{sections}\n"
+        f"{_weekly_section(weekly)}"
+    )
 
-    sessions = _load_player_sessions()
-    playtime_log = _load_playtime_log()
 
-    # Update last_seen for current players, create new sessions for newcomers
-    for name in players:
-        if name in sessions:
-            sessions[name]["last_seen"] = now_ts
-        else:
-            sessions[name] = {"started_at": now_ts, "last_seen": now_ts}
+def _format_message(body: str) -> str:
+    now_msk = datetime.now(MSK).strftime("%H:%M")
+    footer = f"\n🕒 _Обновлено: {now_msk} (МСК)_"
+    if len(body) + len(footer) > MESSAGE_TEXT_LIMIT:
+        # Режем по строкам, чтобы не разорвать разметку
+        lines = body.split("\n")
+        while lines and len("\n".join(lines)) + len(footer) + 2 > MESSAGE_TEXT_LIMIT:
+            lines.pop()
+        body = "\n".join(lines) + "\n…\n"
+    return f"{body}{footer}"
 
-    # Record completed sessions for players whose grace period has expired
-    grace_cutoff = int((now_utc - SESSION_GRACE_PERIOD).timestamp())
-    for name, session in sessions.items():
-        if session["last_seen"] < grace_cutoff:
-            _record_session(playtime_log, name, session["started_at"], session["last_seen"])
 
-    # Prune expired sessions
-    sessions = {
-        name: session
-        for name, session in sessions.items()
-        if session["last_seen"] >= grace_cutoff
-    }
+def _body_hash(body: str) -> str:
+    # Время в подвале не хэшируем — иначе текст «меняется» каждую минуту
+    return hashlib.sha256(body.encode()).hexdigest()[:16]
 
-    _save_player_sessions(sessions)
-    _save_playtime_log(playtime_log, now_ts)
-    text = _format_message(players, sessions, playtime_log, now_ts)
 
-    message_id = get_setting(MESSAGE_ID_KEY)
+# ---------- TARGETS ----------
 
-    try:
-        if message_id:
-            # Пытаемся отредактировать сообщение
-            await bot.edit_message_text(
-                chat_id=CHAT_ID,
-                message_id=int(message_id),
-                text=text,
-                parse_mode="Markdown",
-            )
-        else:
-            raise ValueError("No message_id")
+class TargetSpec(NamedTuple):
+    chat_id: str
+    dashboard: bool
+    # None — все отслеживаемые миры
+    realm_ids: Optional[FrozenSet[int]]
+
+
+class RealmInfo(NamedTuple):
+    name: str
+    members: FrozenSet[str]
+
+
+# (chat_id, str(realm_id) или DASHBOARD)
+MessageKey = Tuple[str, str]
+
+
+def parse_targets(spec: str, default_chat: Optional[str] = CHAT_ID) -> List[TargetSpec]:
+    """
+    Parses "chat=realm,realm;chat=dashboard:realm,realm;chat=*".
+
+    A plain realm list pins one message per realm in the chat, `dashboard:`
+    one combined message; `*` means every tracked realm. An empty spec is a
+    dashboard of all realms in `default_chat`. A malformed entry raises
+    ValueError naming it.
+    """
+    if not spec.strip():
+        return [TargetSpec(default_chat, True, None)] if default_chat else []
 
-    except BadRequest as e:
-        if "message is too old" in str(e) or "can't be edited" in str(e):
-            # Если сообщение старое или его нет — отправляем новое
+    targets = []
+    for entry in spec.split(";"):
+        if not entry.strip():
+            continue
+        chat_id, separator, value = entry.partition("=")
+        value = value.strip()
+        if not separator or not chat_id.strip() or not value:
+            raise ValueError(f"Bad TELEGRAM_TARGETS entry {entry.strip()!r}: expected chat=realm,... or chat=dashboard[:realm,...]")
+        dashboard = value.startswith(DASHBOARD)
+        if dashboard:
+            value = value[len(DASHBOARD):].lstrip(":").strip() or ALL_TRACKED
+        realm_ids = None
+        if value != ALL_TRACKED:
+            try:
+                realm_ids = frozenset(int(realm_id) for realm_id in value.split(",") if realm_id.strip())
+            except ValueError:
+                raise ValueError(f"Bad TELEGRAM_TARGETS entry {entry.strip()!r}: realm ids must be numbers or {ALL_TRACKED!r}") from None
+            if not realm_ids:
+                raise ValueError(f"Bad TELEGRAM_TARGETS entry {entry.strip()!r}: no realms")
+        targets.append(TargetSpec(chat_id.strip(), dashboard, realm_ids))
+    return targets
+
+
+def _state_keys(key: MessageKey) -> Tuple[str, str, str]:
+    chat_id, scope = key
+    if chat_id == CHAT_ID and scope == DASHBOARD:
+        # Сводка в основном чате живёт под прежними ключами — без миграции
+        return MESSAGE_ID_KEY, MESSAGE_HASH_KEY, MESSAGE_EDITED_KEY
+    suffix = f":{chat_id}:{scope}"
+    return MESSAGE_ID_KEY + suffix, MESSAGE_HASH_KEY + suffix, MESSAGE_EDITED_KEY + suffix
+
+
+class TargetRegistry:
+    """
+    Maps realms to chats (many-to-many): one pinned message per (chat, realm)
+    or one dashboard per chat.
+
+    Only the message id, body hash and edit time are stored per message;
+    bodies are rendered once per realm (or realm set, for dashboards) per
+    tick and shared by every chat that shows them.
+    """
+
+    def __init__(self, specs: List[TargetSpec]):
+        self.specs = specs
+        self.realms: Dict[int, RealmInfo] = {}
+        self._states: Dict[MessageKey, Dict[str, Optional[str]]] = {}
+
+    def describe(self, realm_id: int, name: Optional[str], members: Iterable[str]) -> None:
+        self.realms[realm_id] = RealmInfo(name or f"Realm {realm_id}", frozenset(members))
+
+    def name(self, realm_id: int) -> str:
+        return self.realms[realm_id].name if realm_id in self.realms else f"Realm {realm_id}"
+
+    def shown(self, realm_ids: Iterable[int], rosters: Dict[int, List[str]]) -> Set[str]:
+        """
+        Members of the realms plus whoever is online there now
+        """
+        players: Set[str] = set()
+        for realm_id in realm_ids:
+            if realm_id in self.realms:
+                players.update(self.realms[realm_id].members)
+            players.update(rosters.get(realm_id, ()))
+        return players
+
+    def chat_realms(self, chat_id: str, tracked: Iterable[int]) -> List[int]:
+        """
+        Realms shown in `chat_id` (empty for chats that are not targets)
+        """
+        tracked = sorted(tracked)
+        realm_ids: Set[int] = set()
+        for spec in self.specs:
+            if spec.chat_id == chat_id:
+                realm_ids.update(tracked if spec.realm_ids is None else spec.realm_ids)
+        return sorted(realm_ids)
+
+    def messages(self, tracked: Iterable[int]) -> Dict[MessageKey, Tuple[int, ...]]:
+        """
+        Realms shown by every configured message
+        """
+        tracked = sorted(tracked)
+        messages: Dict[MessageKey, Tuple[int, ...]] = {}
+        for spec in self.specs:
+            realm_ids = tracked if spec.realm_ids is None else sorted(spec.realm_ids)
+            if spec.dashboard:
+                if realm_ids:
+                    messages[(spec.chat_id, DASHBOARD)] = tuple(realm_ids)
+            else:
+                messages.update(((spec.chat_id, str(realm_id)), (realm_id,)) for realm_id in realm_ids)
+        return messages
+
+    def state(self, key: MessageKey) -> Dict[str, Optional[str]]:
+        return self.states([key])[key]
+
+    def states(self, keys: Iterable[MessageKey]) -> Dict[MessageKey, Dict[str, Optional[str]]]:
+        # Недостающие состояния читаем одним запросом
+        missing = [key for key in keys if key not in self._states]
+        if missing:
+            stored = get_settings([name for key in missing for name in _state_keys(key)])
+            for key in missing:
+                id_key, hash_key, edited_key = _state_keys(key)
+                self._states[key] = {"id": stored.get(id_key), "hash": stored.get(hash_key), "edited": stored.get(edited_key)}
+        return {key: self._states[key] for key in keys}
+
+    def render(self, messages: Dict[MessageKey, Tuple[int, ...]], rosters: Dict[int, List[str]],
+               sessions: Dict[str, PlayerSession], weekly: Dict[str, int], now_ts: int) -> Dict[Tuple[int, ...], str]:
+        """
+        One body per distinct realm set in `messages`
+        """
+        bodies: Dict[Tuple[int, ...], str] = {}
+        for realm_ids in messages.values():
+            if realm_ids in bodies:
+                continue
+            # Неделя — только тех, кто состоит в показанных мирах или играет в них сейчас
+            shown = self.shown(realm_ids, rosters)
+            realm_weekly = {name: secs for name, secs in weekly.items() if name in shown}
+            if len(realm_ids) == 1:
+                bodies[realm_ids] = _format_body(rosters.get(realm_ids[0], []), sessions, realm_weekly, now_ts)
+            else:
+                realms = [(self.name(realm_id), rosters.get(realm_id, [])) for realm_id in realm_ids]
+                bodies[realm_ids] = _format_dashboard(realms, sessions, realm_weekly, now_ts)
+        return bodies
+
+    def dump(self) -> dict:
+        return {
+            "realms": {str(realm_id): {"name": info.name, "members": sorted(info.members)} for realm_id, info in self.realms.items()},
+            "messages": [[chat_id, scope, state] for (chat_id, scope), state in self._states.items()],
+        }
+
+    def load(self, data: dict) -> None:
+        """
+        Restores realm names/members and message states from `dump()`.
+        Message states are checked against the stored ones in one query and
+        the more recently edited one wins.
+        """
+        for realm_id, info in data.get("realms", {}).items():
+            self.realms.setdefault(int(realm_id), RealmInfo(info["name"], frozenset(info["members"])))
+        saved = {(chat_id, scope): state for chat_id, scope, state in data.get("messages", [])}
+        for key, state in self.states(saved).items():
+            if int(saved[key]["edited"] or 0) > int(state["edited"] or 0):
+                state.update(saved[key])
+
+
+def get_targets() -> TargetRegistry:
+    global _targets
+    if _targets is None:
+        _targets = TargetRegistry(parse_targets(TELEGRAM_TARGETS))
+    return _targets
+
+
+def describe_realm(realm_id: int, name: Optional[str], members: Iterable[str]) -> None:
+    """
+    Realm name and member list for per-realm messages and dashboards
+    """
+    get_targets().describe(realm_id, name, members)
+
+
+def _is_fresh(state: Dict[str, Optional[str]], body_hash: str, now_ts: int) -> bool:
+    if not state["id"] or state["hash"] != body_hash:
+        return False
+    edited_at = int(state["edited"] or 0)
+    return now_ts - edited_at < STATUS_MAX_STALENESS
+
+
+async def _send_status(key: MessageKey, body: str, body_hash: str, now_ts: int) -> None:
+    bot = _get_bot()
+    chat_id = key[0]
+    state = get_targets().state(key)
+    text = _format_message(body)
+    message_id = state["id"]
+
+    if message_id:
+        try:
+            # Пытаемся отредактировать сообщение
+            with TELEGRAM_REQUEST_SECONDS.time(method="editMessageText"):
+                await bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=int(message_id),
+                    text=text,
+                    parse_mode="Markdown",
+                )
+        except BadRequest as e:
+            if "message is not modified" in str(e):
+                pass
+            elif "message is too old" in str(e) or "can't be edited" in str(e) or "message to edit not found" in str(e):
+                message_id = None
+            else:
+                raise
+
+    if not message_id:
+        # Если сообщение старое или его нет — отправляем новое
+        with TELEGRAM_REQUEST_SECONDS.time(method="sendMessage"):
             msg = await bot.send_message(
-                chat_id=CHAT_ID,
+                chat_id=chat_id,
                 text=text,
                 parse_mode="Markdown",
                 disable_notification=True,
             )
 
-            # Закрепляем без звука
+        # Закрепляем без звука
+        with TELEGRAM_REQUEST_SECONDS.time(method="pinChatMessage"):
             await bot.pin_chat_message(
-                chat_id=CHAT_ID,
+                chat_id=chat_id,
                 message_id=msg.message_id,
                 disable_notification=True,
             )
 
-            set_setting(MESSAGE_ID_KEY, str(msg.message_id))
+        message_id = str(msg.message_id)
+
+    state.update({"id": message_id, "hash": body_hash, "edited": str(now_ts)})
+    await asyncio.to_thread(set_settings, dict(zip(_state_keys(key), (state["id"], state["hash"], state["edited"]))))
+
+
+def dump_state() -> dict:
+    """
+    Message states, realm info and the playtime aggregate for a state snapshot
+    """
+    return {"targets": get_targets().dump(), "playtime": _get_playtime().dump()}
+
+
+def restore_state(data: dict, now_ts: int) -> None:
+    global _playtime, _playtime_dirty
+    get_targets().load(data.get("targets", {}))
+    if data.get("playtime"):
+        # Интервалы, записанные после снимка, подтянет sync
+        _playtime = RollingPlaytime.load(data["playtime"], WEEK_SECONDS)
+        _playtime_dirty = _playtime.sync(now_ts)
+
+
+def open_sessions() -> Dict[str, PlayerSession]:
+    """
+    Sessions left open by the previous run (legacy JSON state is migrated first)
+    """
+    _migrate_legacy_state()
+    return load_sessions()
+
+
+async def render_status(batch: EventBatch) -> None:
+    """
+    Event subscriber: re-renders every pinned status message that changed
+    """
+    global _playtime_dirty
+    now_ts = batch.now_ts
+
+    # Новые интервалы появляются только при закрытии сессий — иначе таблицу не читаем
+    playtime = _get_playtime()
+    if batch.of(SessionClosed):
+        # Запрос — в потоке, сам агрегат меняем только на цикле событий
+        rows = await asyncio.to_thread(intervals_after, playtime.last_id)
+        changed = playtime.apply(rows, now_ts)
+    else:
+        changed = playtime.expire(now_ts)
+    _playtime_dirty = _playtime_dirty or changed
+    await _checkpoint_playtime(now_ts)
+    weekly = playtime.weekly(batch.sessions, now_ts)
+
+    targets = get_targets()
+    messages = targets.messages(set(targets.realms) | set(batch.rosters))
+    bodies = targets.render(messages, batch.rosters, batch.sessions, weekly, now_ts)
+    hashes = {realm_ids: _body_hash(body) for realm_ids, body in bodies.items()}
+
+    states = await asyncio.to_thread(targets.states, messages)
+    for key, state in states.items():
+        body, body_hash = bodies[messages[key]], hashes[messages[key]]
+        if _is_fresh(state, body_hash, now_ts):
+            continue
+        # Отправка идёт через очередь — опрос не ждёт Telegram
+        _get_delivery().submit(
+            f"status:{key[0]}:{key[1]}", key[0],
+            lambda key=key, body=body, body_hash=body_hash: _send_status(key, body, body_hash, now_ts),
+        )